@@ -1,155 +1,4165 @@
+import time
+PROCESS_START = time.perf_counter()
+
 import sys
+import os
+import json
+import argparse
+import hashlib
+import heapq
+import importlib.util
+import itertools
+import logging
+import queue
+import copy
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import struct
+import subprocess
+import zlib
+import http.client
+import urllib.parse
+from logging.handlers import RotatingFileHandler, QueueListener
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QPushButton, 
                             QVBoxLayout, QTextEdit, QLabel, QHBoxLayout, 
-                            QFrame, QListWidget, QProgressBar)
-from PyQt5.QtCore import Qt, QPoint, QTimer, pyqtSlot, QThread, pyqtSignal
+                            QFrame, QListWidget, QProgressBar, QCheckBox)
+from PyQt5.QtCore import (Qt, QPoint, QTimer, pyqtSlot, QThread, pyqtSignal, QObject,
+                          QCoreApplication, QMimeData)
 from PyQt5.QtGui import QIcon, QFont, QCursor
-import pyperclip
-from langchain.llms import Ollama
-import time
-from pynput import keyboard
-from pynput.keyboard import Key, Controller, Listener
-from queue import Queue
-from threading import Lock
+import re
+from threading import Lock, Thread, Condition, get_ident
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from bisect import bisect_left, insort
+from array import array
+import keycapture
+# pyperclip, pynput and llama_cpp are imported where they are first used so
+# the window can show before they load
+
+QUILL_DIR = os.path.join(os.path.expanduser("~"), ".quill")
+CONFIG_PATH = os.path.join(QUILL_DIR, "config.json")
+
+DEFAULT_CONFIG = {
+    "model": "hf.co/bartowski/SmolLM2-360M-Instruct-GGUF:Q5_K_S",
+    # "ollama", "llamacpp" (in-process, needs llama-cpp-python) or "stub" (fake
+    # model for testing without one)
+    "backend": "ollama",
+    "ollama_url": "http://localhost:11434",
+    # How long Ollama keeps the model loaded after the warm-up and each request
+    "keep_alive": "30m",
+    # "adaptive" waits for a pause or a sentence end; "space" fires on every space
+    "trigger_mode": "adaptive",
+    # How results reach the focused application: "clipboard" pastes them and
+    # puts the user's clipboard back after insert_restore_ms, "typing" sends key
+    # presses, "unicode" sends the characters the way an input method does
+    # (needs wtype or xdotool on Linux); "auto" uses "unicode" where it works and
+    # "clipboard" otherwise. python benchmark.py --insertion compares them.
+    "insert_method": "auto",
+    "insert_restore_ms": 500,
+    # After Use Now, the rest of a rephrasing is typed in as it is generated
+    # instead of being cut off
+    "insert_streaming": True,
+    # The event loop running this much late is logged to metrics.jsonl as a UI
+    # stall, with the slot that held it up; 0 turns the monitor off
+    "ui_stall_ms": 100,
+    # "process" hooks the keyboard in a small separate process (keycapture.py)
+    # so a busy window can't delay it; "thread" hooks it in the window
+    "key_capture": "process",
+    # Typed text is kept per "application" or per "window" (title included), so
+    # prompts only carry what was written there; "global" keeps one buffer.
+    # Up to context_max_apps buffers of context_chars characters each.
+    "context_scope": "application",
+    "context_chars": 2000,
+    "context_max_apps": 20,
+    # Keep each application's recent text in ~/.quill/contexts.json across restarts
+    "context_persist": False,
+    # "auto" uses the engine daemon (python app.py --engine) when it is running
+    # and loads the model in the window otherwise; "daemon" also starts the
+    # daemon when it isn't running; "off" always loads it in the window
+    "engine": "auto",
+    # Serve live latency percentiles at http://127.0.0.1:<port>/metrics; off when null
+    "metrics_port": None,
+    "autocomplete_candidates": 3,
+    # Longest suggestion in tokens, sequences that end it, and whether to stop
+    # reading at the first "sentence" or "clause" end ("none" reads it all)
+    "autocomplete_max_tokens": 24,
+    "autocomplete_stop": ["\n"],
+    "autocomplete_stop_at": "sentence",
+    # Per-request output limits for the other tasks; a rephrased chunk may be
+    # twice as long as the original when this is null
+    "rephrase_max_tokens": None,
+    "auto_write_max_tokens": 800,
+    # Ollama only runs requests side by side up to OLLAMA_NUM_PARALLEL
+    "max_parallel_requests": 3,
+    # Per-task models (null uses "model") and latency budgets. With more than one
+    # model, Quill measures each one's speed and moves a task to another model
+    # when its own would miss the budget.
+    "autocomplete_model": None,
+    "autocomplete_budget_ms": 600,
+    # A larger model raced against the autocomplete model; its suggestion
+    # replaces the small model's when it finishes within the budget
+    "autocomplete_upgrade_model": None,
+    "rephrase_model": None,
+    "rephrase_budget_ms": 6000,
+    # Longer selections are rephrased as chunks of about this many tokens at once
+    "rephrase_chunk_tokens": 300,
+    # A selection is acted on once it stops changing for this long
+    "selection_settle_ms": 300,
+    # Settled selections are rephrased in the background with this many of the
+    # most used instructions, behind all other work; 0 turns it off
+    "rephrase_prefetch": 2,
+    "rephrase_prefetch_max_chars": 2000,
+    "auto_write_model": None,
+    "auto_write_budget_ms": 20000,
+    # Long-form Auto Write: outline first, then up to this many sections at once
+    "auto_write_max_sections": 5,
+    "auto_write_section_tokens": 250,
+    # Finished Rephrase and Auto Write results saved in ~/.quill/results.sqlite3;
+    # 0 turns the cache off
+    "result_cache_mb": 20,
+    "result_cache_days": 30,
+    # Word pairs kept by the instant local predictor; 0 turns it off
+    "ngram_max_entries": 500000,
+    # Keep what the predictor learned in ~/.quill/ngrams.bin across restarts
+    "ngram_persist": False,
+    "llamacpp_model_path": None,
+    "llamacpp_context_size": 4096,
+    "llamacpp_threads": None,
+    "stub_latency": 0.2,
+    "stub_tokens_per_second": 30.0,
+}
+
+def load_config(path=CONFIG_PATH):
+    # Settings in ~/.quill/config.json override the defaults key by key
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(path, encoding="utf-8") as f:
+            config.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"Ignoring {path}: {e}")
+    return config
+
+class StartupTimer:
+    def __init__(self, started=PROCESS_START):
+        self.started = started
+        self.begun = {}
+        self.phases = {}
+        self.milestones = {}
+
+    def begin(self, phase):
+        self.begun[phase] = time.perf_counter()
+
+    def end(self, phase):
+        # Phases that were never begun are measured from process start
+        self.phases[phase] = time.perf_counter() - self.begun.pop(phase, self.started)
+
+    @contextmanager
+    def phase(self, phase):
+        self.begin(phase)
+        try:
+            yield
+        finally:
+            self.end(phase)
+
+    def milestone(self, name):
+        self.milestones[name] = time.perf_counter() - self.started
+
+    def report(self):
+        return {
+            "phases_ms": {name: round(t * 1000, 1) for name, t in self.phases.items()},
+            "since_start_ms": {name: round(t * 1000, 1) for name, t in self.milestones.items()},
+        }
+
+    def save(self, path=os.path.join(QUILL_DIR, "startup.jsonl")):
+        # One line per launch so regressions show up when comparing runs
+        record = dict(self.report(), timestamp=time.time())
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"Could not save startup timings: {e}")
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "p50": round(rank(50), 2),
+        "p95": round(rank(95), 2),
+        "p99": round(rank(99), 2),
+        "max": round(ordered[-1], 2),
+    }
+
+METRIC_STAGES = ("queue_wait_ms", "ttft_ms", "total_ms", "paste_ms")
+
+# Collects per-request timings. Every record goes to a rotating JSONL file,
+# written by a QueueListener thread so generation threads never block on disk,
+# and the most recent `window` values per trigger and stage are kept in memory
+# for live percentiles.
+class MetricsRecorder:
+    def __init__(self, path=os.path.join(QUILL_DIR, "metrics.jsonl"), window=1000,
+                 max_bytes=5 * 1024 * 1024, backups=3):
+        self.window = window
+        self.samples = {}  # (trigger, stage) -> deque of recent values
+        self.counts = {}   # trigger -> completed requests
+        self.lock = Lock()
+        self.queue = None
+        self.listener = None
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+                handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                              encoding="utf-8")
+            except OSError as e:
+                print(f"Metrics log disabled: {e}")
+            else:
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self.queue = queue.SimpleQueue()
+                self.listener = QueueListener(self.queue, handler)
+                self.listener.start()
+
+    def record_generation(self, trigger, prompt, queued_at, started, first_token, finished,
+                          output_tokens, prompt_tokens=None, cancelled=False, stopped=False):
+        generating = finished - (first_token or finished)
+        record = {
+            "event": "generation",
+            "trigger": trigger,
+            "time": time.time(),
+            "prompt_chars": len(prompt),
+            # Roughly four characters per token when the backend doesn't say
+            "prompt_tokens": prompt_tokens if prompt_tokens is not None else len(prompt) // 4,
+            "queue_wait_ms": round((started - (queued_at or started)) * 1000, 2),
+            "ttft_ms": round(((first_token or finished) - started) * 1000, 2),
+            "total_ms": round((finished - started) * 1000, 2),
+            "output_tokens": output_tokens,
+            "tokens_per_second": round(output_tokens / generating, 2) if generating > 0 else None,
+            "cancelled": cancelled,
+            # Cut short by the client once the output was complete
+            "stopped": stopped,
+        }
+        self._add(record)
+
+    def record_paste(self, trigger, seconds):
+        self._add({"event": "paste", "trigger": trigger, "time": time.time(),
+                   "paste_ms": round(seconds * 1000, 2)})
+
+    def record_stall(self, milliseconds, slot, where):
+        # Logged only; the window keeps its own lag percentiles
+        self._add({"event": "stall", "trigger": "ui", "time": time.time(),
+                   "stall_ms": round(milliseconds, 2), "slot": slot, "at": where})
+
+    def _add(self, record):
+        with self.lock:
+            trigger = record["trigger"]
+            if record["event"] == "generation":
+                self.counts[trigger] = self.counts.get(trigger, 0) + 1
+            for stage in METRIC_STAGES + ("tokens_per_second",):
+                if record.get(stage) is not None:
+                    key = (trigger, stage)
+                    if key not in self.samples:
+                        self.samples[key] = deque(maxlen=self.window)
+                    self.samples[key].append(record[stage])
+        if self.queue is not None:
+            self.queue.put(logging.makeLogRecord({"msg": json.dumps(record)}))
 
+    def snapshot(self):
+        with self.lock:
+            samples = {key: list(values) for key, values in self.samples.items()}
+            counts = dict(self.counts)
+        stats = {}
+        for (trigger, stage), values in samples.items():
+            stats.setdefault(trigger, {"requests": counts.get(trigger, 0)})[stage] = percentiles(values)
+        return stats
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP quill_request_latency_seconds Per-stage latency of generation requests",
+            "# TYPE quill_request_latency_seconds summary",
+        ]
+        throughput = [
+            "# HELP quill_tokens_per_second Generation throughput after the first token",
+            "# TYPE quill_tokens_per_second summary",
+        ]
+        requests = [
+            "# HELP quill_requests_total Completed generation requests",
+            "# TYPE quill_requests_total counter",
+        ]
+        for trigger, stages in sorted(self.snapshot().items()):
+            requests.append(f'quill_requests_total{{trigger="{trigger}"}} {stages["requests"]}')
+            for stage, stats in sorted(stages.items()):
+                if stage == "requests":
+                    continue
+                if stage == "tokens_per_second":
+                    name, labels, scale, target = "quill_tokens_per_second", f'trigger="{trigger}"', 1, throughput
+                else:
+                    name, scale, target = "quill_request_latency_seconds", 0.001, lines
+                    labels = f'trigger="{trigger}",stage="{stage[:-3]}"'
+                for quantile, label in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")):
+                    value = stats[quantile] * scale
+                    target.append(f'{name}{{{labels},quantile="{label}"}} {value:.6g}')
+                target.append(f"{name}_count{{{labels}}} {stats['count']}")
+        return "\n".join(lines + throughput + requests) + "\n"
+
+    def summary(self):
+        # One line per trigger for the status tooltip
+        lines = []
+        for trigger, stages in sorted(self.snapshot().items()):
+            parts = [f"{trigger}: {stages['requests']} requests"]
+            for stage, label in (("ttft_ms", "first token"), ("total_ms", "total"), ("paste_ms", "paste")):
+                if stage in stages:
+                    parts.append(f"{label} p50 {stages[stage]['p50']:.0f} / p95 {stages[stage]['p95']:.0f} ms")
+            if "tokens_per_second" in stages:
+                parts.append(f"{stages['tokens_per_second']['p50']:.1f} tok/s")
+            lines.append(", ".join(parts))
+        return "\n".join(lines)
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+def start_metrics_server(recorder, port, host="127.0.0.1"):
+    # Prometheus-style text endpoint, bound to localhost only
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = recorder.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+SENTENCE_END = ".!?"
+
+# Fixed-capacity ring of characters that follows the user's edits.
+# Positions are absolute (they keep counting past max_size), so the word and
+# sentence start indexes stay valid as old text falls off the front.
 class TextBuffer:
     def __init__(self, max_size=1000):
-        self.buffer = ""
         self.max_size = max_size
+        self.chars = [""] * max_size
+        self.start = 0   # oldest character still held
+        self.end = 0     # one past the newest character
+        self.cursor = 0  # where typed text goes, normally equal to end
+        self.word_starts = deque()
+        self.sentence_starts = deque()
         self.lock = Lock()
 
     def append(self, text):
         with self.lock:
-            self.buffer += text
-            if len(self.buffer) > self.max_size:
-                self.buffer = self.buffer[-self.max_size:]
+            for char in text:
+                if self.cursor == self.end:
+                    self._push(char)
+                else:
+                    self._insert(char)
+
+    def backspace(self):
+        with self.lock:
+            if self.cursor <= self.start:
+                return
+            if self.cursor == self.end:
+                self.end -= 1
+                self.cursor -= 1
+                self._drop_boundaries_from(self.end)
+            else:
+                self._remove(self.cursor - 1)
+                self.cursor -= 1
+
+    def delete(self):
+        with self.lock:
+            if self.cursor < self.end:
+                self._remove(self.cursor)
+
+    def move_cursor(self, offset):
+        with self.lock:
+            self.cursor = min(max(self.cursor + offset, self.start), self.end)
 
     def get(self):
         with self.lock:
-            return self.buffer
+            return self._slice(self.start, self.end)
+
+    def tail(self, max_chars):
+        with self.lock:
+            return self._slice(max(self.start, self.end - max_chars), self.end)
+
+    def last_words(self, count):
+        with self.lock:
+            if count <= 0 or not self.word_starts:
+                return ""
+            if count >= len(self.word_starts):
+                return self._slice(self.start, self.end)
+            return self._slice(self.word_starts[-count], self.end)
+
+    def context(self, max_chars, boundary="sentence"):
+        # Longest tail of at most max_chars that starts on a sentence (or
+        # word) boundary, falling back to a plain character cut
+        with self.lock:
+            limit = max(self.start, self.end - max_chars)
+            starts = self.sentence_starts if boundary == "sentence" else self.word_starts
+            index = bisect_left(starts, limit)
+            if index < len(starts):
+                return self._slice(starts[index], self.end)
+            if boundary == "sentence":
+                index = bisect_left(self.word_starts, limit)
+                if index < len(self.word_starts):
+                    return self._slice(self.word_starts[index], self.end)
+            return self._slice(limit, self.end)
+
+    def __len__(self):
+        return self.end - self.start
 
     def clear(self):
         with self.lock:
-            self.buffer = ""
+            self.start = self.end = self.cursor = 0
+            self.word_starts.clear()
+            self.sentence_starts.clear()
+
+    def _char(self, position):
+        return self.chars[position % self.max_size]
+
+    def _slice(self, first, last):
+        i = first % self.max_size
+        j = i + (last - first)
+        if j <= self.max_size:
+            return "".join(self.chars[i:j])
+        return "".join(self.chars[i:]) + "".join(self.chars[:j - self.max_size])
+
+    def _push(self, char):
+        # O(1) append at the end of the ring
+        position = self.end
+        self.chars[position % self.max_size] = char
+        self.end += 1
+        self.cursor = self.end
+        if self.end - self.start > self.max_size:
+            self.start += 1
+            while self.word_starts and self.word_starts[0] < self.start:
+                self.word_starts.popleft()
+            while self.sentence_starts and self.sentence_starts[0] < self.start:
+                self.sentence_starts.popleft()
+        self._index(position)
+
+    def _index(self, position):
+        char = self._char(position)
+        if char.isspace():
+            return
+        previous = position - 1
+        if previous >= self.start and not self._char(previous).isspace():
+            return
+        self.word_starts.append(position)
+
+        # A word starts a sentence when the last non-blank character before
+        # it ends one, or when a line break separates them
+        while previous >= self.start and self._char(previous).isspace():
+            if self._char(previous) == "\n":
+                break
+            previous -= 1
+        if (previous < self.start or self._char(previous) == "\n"
+                or self._char(previous) in SENTENCE_END):
+            self.sentence_starts.append(position)
+
+    def _drop_boundaries_from(self, position):
+        while self.word_starts and self.word_starts[-1] >= position:
+            self.word_starts.pop()
+        while self.sentence_starts and self.sentence_starts[-1] >= position:
+            self.sentence_starts.pop()
+
+    def _insert(self, char):
+        # Typing after moving the cursor back: shift the tail right by one
+        text = self._slice(self.cursor, self.end)
+        cursor = self.cursor
+        self.end = cursor
+        self._drop_boundaries_from(cursor)
+        self._push(char)
+        for moved in text:
+            self._push(moved)
+        self.cursor = max(cursor + 1, self.start)
+        self._reindex()
+
+    def _remove(self, position):
+        text = self._slice(position + 1, self.end)
+        cursor = self.cursor
+        self.end = position
+        for moved in text:
+            self.chars[self.end % self.max_size] = moved
+            self.end += 1
+        self.cursor = min(cursor, self.end)
+        self._reindex()
+
+    def _reindex(self):
+        # Mid-buffer edits are rare enough that a rescan is fine
+        self.word_starts.clear()
+        self.sentence_starts.clear()
+        for position in range(self.start, self.end):
+            self._index(position)
+
+CONTEXTS_PATH = os.path.join(QUILL_DIR, "contexts.json")
+
+# One TextBuffer per application (or window), so text typed in one app never
+# ends up in another's prompts. It stands in for the active buffer, so the
+# keyboard monitor and the trigger keep a single reference while focus moves.
+# Buffers left behind are kept least recently focused first and the oldest
+# are dropped beyond max_contexts; with a path, they are saved on exit and
+# restored at the next start. Contexts nothing was typed in aren't kept.
+class ContextBuffers:
+    active = None
+
+    def __init__(self, max_chars=2000, max_contexts=20, path=None):
+        self.max_chars = max_chars
+        self.max_contexts = max_contexts
+        self.path = path
+        self.buffers = OrderedDict()  # context key -> TextBuffer, except the active one
+        self.key = ""  # "" until the focused application is known
+        self.evicted = 0
+        self.switch("")
+
+    def __getattr__(self, name):
+        # append, get, tail, backspace and the rest go to the active buffer
+        return getattr(self.active, name)
+
+    def __len__(self):
+        return len(self.active)
+
+    def switch(self, key):
+        if self.active is not None and len(self.active):
+            self.buffers[self.key] = self.active
+        buffer = self.buffers.pop(key, None)
+        self.key = key
+        self.active = buffer if buffer is not None else TextBuffer(max_size=self.max_chars)
+        # The active buffer takes one of the max_contexts slots
+        self._trim(self.max_contexts - 1)
+        return self.active
+
+    def _trim(self, limit):
+        while len(self.buffers) > max(limit, 0):
+            self.buffers.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self):
+        return {"active": self.key, "contexts": len(self.buffers) + bool(len(self.active)),
+                "evicted": self.evicted}
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring {self.path}: {e}")
+            return
+        for key, text in reversed(list(saved.items())):
+            buffer = TextBuffer(max_size=self.max_chars)
+            buffer.append(text)
+            if key == self.key and not len(self.active):
+                self.active = buffer
+            elif key != self.key:
+                # Saved least recently focused first, ahead of this session's
+                self.buffers[key] = buffer
+                self.buffers.move_to_end(key, last=False)
+        # Until something is typed, the active context needs no slot
+        self._trim(self.max_contexts - bool(len(self.active)))
+
+    def save(self):
+        if not self.path:
+            return
+        saved = {key: buffer.get() for key, buffer in self.buffers.items()}
+        if len(self.active):
+            saved[self.key] = self.active.get()
+        try:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(saved, f)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            print(f"Could not save {self.path}: {e}")
+
+# The instruction block comes first and never changes, and the user's text is
+# the only variable part, so consecutive prompts share a long byte-identical
+# prefix that the backend can serve from its KV cache
+AUTOCOMPLETE_PROMPT = """Instructions: You are an autocomplete AI. You will be given text and you need to suggest a natural continuation. Consider the entire context provided. Note: DO NOT PROVIDE ANY TEXT EXCEPT THE CONTINUATION.
+Previous text: {text}
+Provide a natural continuation:"""
+
+SENTENCE_BREAK = re.compile(r"[.!?\n]\s+")
+
+# Keeps the history window of consecutive autocomplete prompts anchored.
+# TextBuffer drops a character off the front for every one typed once it is
+# full, which would shift the whole prompt and make the backend re-evaluate
+# all of it. Instead the window keeps the same start while the user types,
+# so each request only costs the newly typed text, and it is moved forward
+# to a sentence boundary in one jump when it outgrows max_chars.
+class PromptSession:
+    def __init__(self, max_chars=2000, rebase_chars=1000, anchor_chars=64):
+        self.max_chars = max_chars
+        self.rebase_chars = rebase_chars
+        self.anchor_chars = anchor_chars
+        self.window = ""
+        self.lock = Lock()
+        self.reused = 0
+        self.rebased = 0
+        self.new_chars = 0
+
+    def build(self, text):
+        with self.lock:
+            window = self._anchored(text)
+            if window is None:
+                window = self._rebase(text)
+                self.rebased += 1
+                self.new_chars += len(window)
+            else:
+                self.reused += 1
+                self.new_chars += len(window) - self._common_prefix(window)
+            self.window = window
+            return AUTOCOMPLETE_PROMPT.format(text=window)
+
+    def reset(self):
+        with self.lock:
+            self.window = ""
+
+    def stats(self):
+        with self.lock:
+            return {"reused": self.reused, "rebased": self.rebased, "new_chars": self.new_chars}
+
+    def _anchored(self, text):
+        # The previous window's opening characters are still in the buffer:
+        # keep starting there, even if the user edited text after them
+        anchor = self.window[:self.anchor_chars]
+        if not anchor:
+            return None
+        index = text.rfind(anchor)
+        if index == -1 or len(text) - index > self.max_chars:
+            return None
+        return text[index:]
+
+    def _rebase(self, text):
+        if len(text) <= self.rebase_chars:
+            return text
+        cut = len(text) - self.rebase_chars
+        match = SENTENCE_BREAK.search(text, cut)
+        if match and match.end() < len(text):
+            return text[match.end():]
+        space = text.find(" ", cut)
+        if space != -1 and space + 1 < len(text):
+            return text[space + 1:]
+        return text[cut:]
+
+    def _common_prefix(self, window):
+        previous = self.window
+        limit = min(len(previous), len(window))
+        index = 0
+        while index < limit and previous[index] == window[index]:
+            index += 1
+        return index
+
+def remaining_continuation(old_context, continuation, context):
+    # The user may be typing out a suggestion: if context is old_context plus
+    # the start of continuation, returns the rest of it, else None
+    if len(context) <= len(old_context) or not context.startswith(old_context):
+        return None
+    typed = context[len(old_context):].lstrip()
+    continuation = continuation.lstrip()
+    rest = continuation[len(typed):]
+    if not continuation.startswith(typed) or not rest.strip():
+        return None
+    # A whole word typed out still needs the space after it
+    lead = " " if rest[0].isspace() and not context[-1].isspace() else ""
+    return lead + rest.strip()
+
+class CompletionCache:
+    def __init__(self, max_entries=256):
+        self.entries = OrderedDict()  # (model, template, context) -> continuation
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self.hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+
+    def get(self, model, template, context):
+        # Returns the text to show after context, or None
+        with self.lock:
+            key = (model, template, context)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key].strip()
+
+            # The user may be typing out an earlier suggestion: serve the rest
+            # of its continuation
+            match = None
+            for old_key, continuation in reversed(self.entries.items()):
+                old_model, old_template, old_context = old_key
+                if old_model != model or old_template != template:
+                    continue
+                remainder = remaining_continuation(old_context, continuation, context)
+                if remainder is not None:
+                    match = old_key, remainder
+                    break
+            if match is None:
+                self.misses += 1
+                return None
+            old_key, remainder = match
+            self.entries.move_to_end(old_key)
+            self.prefix_hits += 1
+            return remainder
+
+    def put(self, model, template, context, continuation):
+        with self.lock:
+            self.entries[(model, template, context)] = continuation
+            self.entries.move_to_end((model, template, context))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.prefix_hits + self.misses
+            return {
+                "hits": self.hits,
+                "prefix_hits": self.prefix_hits,
+                "misses": self.misses,
+                "calls_saved": self.hits + self.prefix_hits,
+                "hit_rate": (self.hits + self.prefix_hits) / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+            }
+
+WORD = re.compile(r"[\w'’-]+")
+PARTIAL_WORD = re.compile(r"[\w'’-]+$")
+SENTENCE_SPLIT = re.compile(r"[.!?\n]")
+NGRAM_MAGIC = b"QNG1"
+NGRAM_ID_BITS = 24
+NGRAMS_PATH = os.path.join(QUILL_DIR, "ngrams.bin")
+
+# Suggests the next few words instantly from what the user has written before,
+# while the model is still thinking. Each context (the previous word, or the
+# previous two) maps to one flat array: the ids of the words that followed it,
+# then their counts, kept in count order so the best guesses are always at
+# the front. Once there are more than max_entries (context, word) pairs, every
+# count is halved and the pairs and words that reach zero are forgotten, so
+# rare typos and one-off phrases go first. Sentences containing something that
+# looks like a password are never learned. With a path, the index is saved
+# there, readable only by the user, and loaded at the next start.
+class NgramPredictor:
+    def __init__(self, path=None, max_entries=500000):
+        self.path = path
+        self.max_entries = max_entries
+        self.clear()
+
+    def clear(self):
+        self.words = [""]  # id 0 stands for the start of a sentence
+        self.ids = {"": 0}
+        self.sorted_words = []
+        self.unigrams = array("I", [0])
+        self.successors = {}  # context key -> array of ids then counts
+        self.entries = 0
+        self.dirty = False
+
+    @staticmethod
+    def key(*context):
+        # A leading 1 keeps one- and two-word contexts apart
+        key = 1
+        for word_id in context:
+            key = key << NGRAM_ID_BITS | word_id
+        return key
+
+    def word_id(self, word):
+        word_id = self.ids.get(word)
+        if word_id is None:
+            word_id = self.ids[word] = len(self.words)
+            self.words.append(word)
+            self.unigrams.append(0)
+            insort(self.sorted_words, word)
+        return word_id
+
+    def count(self, key, word_id):
+        pairs = self.successors.get(key)
+        if pairs is None:
+            self.successors[key] = array("I", (word_id, 1))
+            self.entries += 1
+            return
+        size = len(pairs) // 2
+        try:
+            position = pairs.index(word_id, 0, size)
+        except ValueError:
+            pairs.insert(size, word_id)
+            pairs.append(1)
+            self.entries += 1
+            return
+        new_count = pairs[size + position] + 1
+        # Counts are in descending order: swap with the first one it now beats
+        low, high = 0, position
+        while low < high:
+            middle = (low + high) // 2
+            if pairs[size + middle] >= new_count:
+                low = middle + 1
+            else:
+                high = middle
+        pairs[low], pairs[position] = pairs[position], pairs[low]
+        pairs[size + position] = pairs[size + low]
+        pairs[size + low] = new_count
+
+    def learn(self, text):
+        for sentence in SENTENCE_SPLIT.split(text):
+            if any(looks_like_secret(token) for token in sentence.split()):
+                continue
+            ids = [0] + [self.word_id(word) for word in WORD.findall(sentence)]
+            for i in range(1, len(ids)):
+                self.unigrams[ids[i]] += 1
+                self.count(self.key(ids[i - 1]), ids[i])
+                if i >= 2:
+                    self.count(self.key(ids[i - 2], ids[i - 1]), ids[i])
+            self.dirty = self.dirty or len(ids) > 1
+        if self.entries > self.max_entries:
+            while self.entries > self.max_entries * 3 // 4:
+                self.prune()
+
+    def prune(self):
+        keep = [word_id == 0 or count > 1 for word_id, count in enumerate(self.unigrams)]
+        mapping = array("i", [-1]) * len(self.words)
+        words = []
+        for word_id, word in enumerate(self.words):
+            if keep[word_id]:
+                mapping[word_id] = len(words)
+                words.append(word)
+        successors = {}
+        entries = 0
+        mask = (1 << NGRAM_ID_BITS) - 1
+        for key, pairs in self.successors.items():
+            context = []
+            while key > 1:
+                context.append(mapping[key & mask])
+                key >>= NGRAM_ID_BITS
+            if -1 in context:
+                continue
+            size = len(pairs) // 2
+            survivors = [(mapping[pairs[i]], pairs[size + i] >> 1) for i in range(size)
+                         if pairs[size + i] > 1 and mapping[pairs[i]] != -1]
+            if survivors:
+                successors[self.key(*reversed(context))] = array(
+                    "I", [word_id for word_id, _ in survivors] + [count for _, count in survivors])
+                entries += len(survivors)
+        self.unigrams = array("I", (self.unigrams[word_id] >> 1
+                                    for word_id in range(len(self.words)) if keep[word_id]))
+        self.words = words
+        self.ids = {word: word_id for word_id, word in enumerate(words)}
+        self.sorted_words = sorted(words[1:])
+        self.successors = successors
+        self.entries = entries
+        self.dirty = True
+
+    def candidates(self, context, prefix, limit):
+        # Words seen after the two-word context, then after the last word, then
+        # for a half-typed word the most used words it could become
+        keys = []
+        if len(context) >= 2:
+            keys.append(self.key(*context[-2:]))
+        if context:
+            keys.append(self.key(context[-1]))
+        found = []
+        for key in keys:
+            pairs = self.successors.get(key)
+            if pairs is not None:
+                scan = min(len(pairs) // 2, 64 if prefix else limit)
+                found.extend(word for word in (self.words[word_id] for word_id in pairs[:scan])
+                             if word.startswith(prefix) and word != prefix)
+        if prefix and len(found) < limit:
+            start = bisect_left(self.sorted_words, prefix)
+            words = [word for word in self.sorted_words[start:start + 200]
+                     if word.startswith(prefix) and word != prefix]
+            found.extend(heapq.nlargest(limit, words, key=lambda word: self.unigrams[self.ids[word]]))
+        return list(dict.fromkeys(found))[:limit]
+
+    def extend(self, context, max_words=3):
+        # Follow the most likely next word while it is a clear favourite
+        words = []
+        for _ in range(max_words):
+            pairs = self.successors.get(self.key(*context[-2:]))
+            if pairs is None:
+                break
+            size = len(pairs) // 2
+            count = pairs[size]
+            if count < 2 or count * 10 < sum(pairs[size:]) * 3:
+                break
+            words.append(self.words[pairs[0]])
+            context = context + [pairs[0]]
+        return words
+
+    def predict(self, text, limit=3):
+        sentence = SENTENCE_SPLIT.split(text)[-1]
+        partial = PARTIAL_WORD.search(sentence)
+        prefix = partial.group() if partial else ""
+        before = sentence[:partial.start()] if partial else sentence
+        words = WORD.findall(before)[-2:]
+        if len(words) < 2:
+            words.insert(0, "")  # the start of the sentence
+        # The known words right before the cursor
+        context = []
+        for word in reversed(words):
+            if word not in self.ids:
+                break
+            context.insert(0, self.ids[word])
+        # Next words need a space unless the text already ends with one
+        lead = "" if prefix or not text or text[-1].isspace() else " "
+        predictions = []
+        for word in self.candidates(context, prefix, limit):
+            phrase = [word] + self.extend(context + [self.ids[word]])
+            predictions.append(lead + " ".join(phrase)[len(prefix):])
+        return predictions
+
+    def memory_bytes(self):
+        size = (sys.getsizeof(self.successors) + sys.getsizeof(self.ids)
+                + sys.getsizeof(self.words) + sys.getsizeof(self.sorted_words)
+                + sys.getsizeof(self.unigrams))
+        size += sum(sys.getsizeof(key) + sys.getsizeof(pairs)
+                    for key, pairs in self.successors.items())
+        size += sum(sys.getsizeof(word) for word in self.words)
+        return size
+
+    def stats(self):
+        return {"words": len(self.words) - 1, "contexts": len(self.successors),
+                "entries": self.entries, "memory_bytes": self.memory_bytes()}
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        vocabulary = json.dumps(self.words).encode("utf-8")
+        keys = array("Q", self.successors.keys())
+        lengths = array("I", (len(pairs) for pairs in self.successors.values()))
+        try:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            # Everything the user typed is in here
+            descriptor = os.open(self.path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+                                 | getattr(os, "O_BINARY", 0), 0o600)
+            with os.fdopen(descriptor, "wb") as f:
+                f.write(NGRAM_MAGIC)
+                f.write(struct.pack("<QQ", len(vocabulary), len(keys)))
+                f.write(vocabulary)
+                self.unigrams.tofile(f)
+                keys.tofile(f)
+                lengths.tofile(f)
+                for pairs in self.successors.values():
+                    pairs.tofile(f)
+            os.replace(self.path + ".tmp", self.path)
+            self.dirty = False
+        except OSError as e:
+            print(f"Could not save {self.path}: {e}")
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "rb") as f:
+                if f.read(len(NGRAM_MAGIC)) != NGRAM_MAGIC:
+                    raise ValueError("not a Quill n-gram file")
+                vocabulary_size, context_count = struct.unpack("<QQ", f.read(16))
+                words = json.loads(f.read(vocabulary_size).decode("utf-8"))
+                unigrams = array("I")
+                unigrams.fromfile(f, len(words))
+                keys = array("Q")
+                keys.fromfile(f, context_count)
+                lengths = array("I")
+                lengths.fromfile(f, context_count)
+                values = array("I")
+                values.fromfile(f, sum(lengths))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, EOFError, struct.error) as e:
+            print(f"Ignoring {self.path}: {e}")
+            return
+        self.words = words
+        self.ids = {word: word_id for word_id, word in enumerate(words)}
+        self.sorted_words = sorted(words[1:])
+        self.unigrams = unigrams
+        self.successors = {}
+        offset = 0
+        for key, length in zip(keys, lengths):
+            self.successors[key] = values[offset:offset + length]
+            offset += length
+        self.entries = len(values) // 2
+        self.dirty = False
+
+# Keeps finished Rephrase and Auto Write results in a SQLite file, so asking
+# for the same thing again, even after a restart, returns in milliseconds.
+# Entries are keyed by task, whitespace-normalized input and instructions,
+# model and prompt template, so changing any of those is a miss. Entries older
+# than max_age are dropped, and the least recently used ones are evicted once
+# the stored results pass max_bytes.
+class ResultCache:
+    def __init__(self, path=os.path.join(QUILL_DIR, "results.sqlite3"), max_bytes=20 * 2**20,
+                 max_age=30 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.db = None
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def connect(self):
+        # Opened on first use so startup doesn't touch the disk
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, task TEXT, "
+                            "response TEXT, size INTEGER, created REAL, used REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        return self.db
+
+    @staticmethod
+    def key(task, text, instructions, model, template):
+        material = json.dumps([task, " ".join(text.split()), " ".join(instructions.split()),
+                               model, template])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, task, text, instructions, model, template, bypass=False):
+        # bypass is "regenerate": skip the lookup, and the fresh result replaces the old one
+        if bypass:
+            self.bypassed += 1
+            return None
+        key = self.key(task, text, instructions, model, template)
+        now = time.time()
+        with self.lock:
+            try:
+                db = self.connect()
+                row = db.execute("SELECT response, created FROM results WHERE key = ?",
+                                 (key,)).fetchone()
+                if row is not None and now - row[1] <= self.max_age:
+                    db.execute("UPDATE results SET used = ? WHERE key = ?", (now, key))
+                    db.commit()
+                    self.hits += 1
+                    return row[0]
+            except sqlite3.Error as e:
+                print(f"Result cache unavailable: {e}")
+            self.misses += 1
+            return None
+
+    def put(self, task, text, instructions, model, template, response):
+        if not response.strip():
+            return
+        key = self.key(task, text, instructions, model, template)
+        now = time.time()
+        with self.lock:
+            try:
+                db = self.connect()
+                db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                           (key, task, response, len(response.encode("utf-8")), now, now))
+                self.evict(db, now)
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"Result cache unavailable: {e}")
+
+    def evict(self, db, now):
+        db.execute("DELETE FROM results WHERE created < ?", (now - self.max_age,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Least recently used first, down to 90% so evictions don't run on every put
+        doomed = []
+        for key, size in db.execute("SELECT key, size FROM results ORDER BY used"):
+            if total <= self.max_bytes * 0.9:
+                break
+            doomed.append((key,))
+            total -= size
+        db.executemany("DELETE FROM results WHERE key = ?", doomed)
+
+    def stats(self):
+        entries, size = 0, 0
+        with self.lock:
+            if self.db is not None:
+                try:
+                    entries, size = self.db.execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+                except sqlite3.Error:
+                    pass
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+class BackendError(Exception):
+    pass
+
+# What a backend's stream() returns: iterate it for text chunks as they are
+# generated, close() it to cancel. Once the stream is exhausted, stats holds
+# what the backend reported about the request, such as prompt_tokens.
+class TokenStream:
+    def __init__(self, chunks, stats):
+        self.chunks = chunks
+        self.stats = stats
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.chunks)
+
+    def close(self):
+        self.chunks.close()
+
+# Request fields Ollama takes at the top level; everything else is a model option
+OLLAMA_REQUEST_KEYS = ("keep_alive", "raw", "format", "system", "template")
+
+# Talks to Ollama's /api/generate directly. Connections are kept alive and
+# reused, so a request doesn't pay for a new TCP connection, and responses
+# are read line by line as Ollama streams them. Closing a stream early closes
+# its connection, which is how Ollama learns to stop generating.
+class OllamaBackend:
+    def __init__(self, model, base_url="http://localhost:11434", keep_alive=None,
+                 pool_size=4, timeout=300):
+        url = urllib.parse.urlsplit(base_url)
+        self.model = model
+        self.base_url = base_url
+        self.keep_alive = keep_alive
+        self.https = url.scheme == "https"
+        self.host = url.hostname or "localhost"
+        self.port = url.port or (443 if self.https else 80)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.idle = []
+        self.lock = Lock()
+
+    def connection(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout), False
+
+    def release(self, connection):
+        with self.lock:
+            if len(self.idle) < self.pool_size:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def post(self, path, payload):
+        body = json.dumps(payload).encode("utf-8")
+        while True:
+            connection, reused = self.connection()
+            try:
+                connection.request("POST", path, body, {"Content-Type": "application/json"})
+                response = connection.getresponse()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                # Ollama may have closed an idle connection; retry on a fresh one
+                if not reused:
+                    raise
+        if response.status != 200:
+            message = response.read().decode("utf-8", "replace")
+            self.release(connection)
+            try:
+                message = json.loads(message).get("error", message)
+            except (ValueError, AttributeError):
+                pass
+            raise BackendError(f"Ollama returned {response.status}: {message}")
+        return connection, response
+
+    def payload(self, prompt, options):
+        payload = {"model": self.model, "prompt": prompt}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        model_options = {}
+        for key, value in options.items():
+            if key in OLLAMA_REQUEST_KEYS:
+                payload[key] = value
+            else:
+                model_options[key] = value
+        if model_options:
+            payload["options"] = model_options
+        return payload
+
+    def stream(self, prompt, **options):
+        stats = {}
+        return TokenStream(self.generate(prompt, options, stats), stats)
+
+    def generate(self, prompt, options, stats):
+        payload = self.payload(prompt, options)
+        payload["stream"] = True
+        connection, response = self.post("/api/generate", payload)
+        done = False
+        try:
+            for line in response:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise BackendError(chunk["error"])
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    stats["prompt_tokens"] = chunk.get("prompt_eval_count")
+                    stats["output_tokens"] = chunk.get("eval_count")
+                    done = True
+                    break
+        finally:
+            if done:
+                # Read the end of the chunked body so the connection can be reused
+                response.read()
+                self.release(connection)
+            else:
+                connection.close()
+
+    def __call__(self, prompt, **options):
+        return "".join(self.stream(prompt, **options))
+
+    def for_model(self, model):
+        # Same server and connection pool, another model
+        backend = copy.copy(self)
+        backend.model = model
+        return backend
+
+    def warm_up(self):
+        # A generate request without a prompt only loads the model
+        payload = {"model": self.model, "stream": False}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        connection, response = self.post("/api/generate", payload)
+        response.read()
+        self.release(connection)
+
+# Ollama option names mapped to llama-cpp-python's
+LLAMACPP_OPTIONS = {
+    "temperature": "temperature",
+    "top_p": "top_p",
+    "top_k": "top_k",
+    "seed": "seed",
+    "stop": "stop",
+    "repeat_penalty": "repeat_penalty",
+    "num_predict": "max_tokens",
+}
+
+# Runs a GGUF model inside the Quill process through llama-cpp-python, with no
+# server in between. The model is loaded on the warm-up thread. One llama.cpp
+# context can only run one request at a time, so requests take turns; keeping
+# the context between them lets llama.cpp reuse the shared prompt prefix.
+class LlamaCppBackend:
+    def __init__(self, model_path, context_size=4096, threads=None):
+        self.model = model_path
+        self.model_path = model_path
+        self.context_size = context_size
+        self.threads = threads
+        self.llama = None
+        self.load_lock = Lock()
+        self.lock = Lock()
+
+    def load(self):
+        with self.load_lock:
+            if self.llama is None:
+                from llama_cpp import Llama
+                self.llama = Llama(model_path=self.model_path, n_ctx=self.context_size,
+                                   n_threads=self.threads, verbose=False)
+            return self.llama
+
+    def stream(self, prompt, **options):
+        stats = {}
+        return TokenStream(self.generate(prompt, options, stats), stats)
+
+    def generate(self, prompt, options, stats):
+        llama = self.load()
+        kwargs = {LLAMACPP_OPTIONS[key]: value for key, value in options.items()
+                  if key in LLAMACPP_OPTIONS}
+        # None already means no limit; Ollama's -1 does too
+        max_tokens = kwargs.get("max_tokens")
+        if max_tokens is not None and max_tokens < 0:
+            kwargs["max_tokens"] = None
+        with self.lock:
+            # Chat completion applies the model's prompt template, as Ollama does
+            chunks = llama.create_chat_completion(
+                messages=[{"role": "user", "content": prompt}], stream=True, **kwargs)
+            output_tokens = 0
+            for chunk in chunks:
+                text = chunk["choices"][0]["delta"].get("content")
+                if text:
+                    output_tokens += 1
+                    yield text
+            stats["output_tokens"] = output_tokens
+
+    def __call__(self, prompt, **options):
+        return "".join(self.stream(prompt, **options))
+
+    def for_model(self, model_path):
+        return LlamaCppBackend(model_path, self.context_size, self.threads)
+
+    def warm_up(self):
+        self.load()
+
+STUB_WORDS = ("the", "a", "and", "of", "to", "in", "that", "it", "for", "as", "with",
+              "was", "on", "this", "we", "will", "be", "more", "about", "next", "time")
+
+# Answers /api/generate the way Ollama does, with made-up but deterministic
+# text: the same prompt and options always give the same words. Lets the app,
+# the benchmark and tests run the real HTTP path without a model.
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like Ollama
+
+    def setup(self):
+        super().setup()
+        # Send each streamed token right away instead of waiting for the last ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/api/generate":
+            self.send_error(404)
+            return
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            self.send_json({"error": "invalid JSON"}, 400)
+            return
+        prompt = request.get("prompt") or ""
+        if not prompt:
+            self.send_json({"model": request.get("model"), "response": "", "done": True,
+                            "done_reason": "load"})
+            return
+        options = request.get("options") or {}
+        words = self.server.complete(prompt, options)
+        final = {"model": request.get("model"), "response": "", "done": True,
+                 "prompt_eval_count": len(prompt) // 4, "eval_count": len(words)}
+        time.sleep(self.server.latency)
+        if not request.get("stream", True):
+            time.sleep(len(words) / self.server.tokens_per_second)
+            final["response"] = " ".join(words)
+            self.send_json(final)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(1.0 / self.server.tokens_per_second)
+                self.send_chunk({"model": request.get("model"),
+                                 "response": (" " if i else "") + word, "done": False})
+            self.send_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client cancelled
+
+    def send_chunk(self, message):
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_json(self, message, status=200):
+        data = json.dumps(message).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.2, tokens_per_second=30.0, max_tokens=12):
+        super().__init__(("127.0.0.1", port), StubRequestHandler)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.max_tokens = max_tokens
+        Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def complete(self, prompt, options):
+        count = options.get("num_predict", self.max_tokens)
+        if count is None or count < 0:
+            count = self.max_tokens
+        rng = random.Random(zlib.crc32((prompt + json.dumps(options, sort_keys=True)).encode("utf-8")))
+        words = [rng.choice(STUB_WORDS) for _ in range(count)]
+        for stop in options.get("stop") or []:
+            if stop in words:
+                words = words[:words.index(stop)]
+        return words
+
+# An OllamaBackend wired to its own StubServer
+class StubBackend(OllamaBackend):
+    def __init__(self, latency=0.2, tokens_per_second=30.0, pool_size=4):
+        self.server = StubServer(latency=latency, tokens_per_second=tokens_per_second)
+        super().__init__("stub", self.server.url, pool_size=pool_size)
+
+def create_backend(config):
+    backend = config["backend"]
+    if backend == "ollama":
+        return OllamaBackend(config["model"], config["ollama_url"], config["keep_alive"],
+                             pool_size=config["max_parallel_requests"])
+    if backend == "llamacpp":
+        if not config["llamacpp_model_path"]:
+            raise ValueError('Set "llamacpp_model_path" to a GGUF file to use the llamacpp backend')
+        return LlamaCppBackend(config["llamacpp_model_path"], config["llamacpp_context_size"],
+                               config["llamacpp_threads"])
+    if backend == "stub":
+        return StubBackend(config["stub_latency"], config["stub_tokens_per_second"],
+                           pool_size=config["max_parallel_requests"])
+    raise ValueError(f"Unknown backend {backend!r}; expected ollama, llamacpp or stub")
+
+# Asks the backend to load the model, so the user's first completion doesn't
+# wait for it: Ollama loads it and keeps it resident, llama.cpp reads the
+# model file into this process
+class WarmupThread(QThread):
+    done = pyqtSignal(bool)
+
+    def __init__(self, llm):
+        super().__init__()
+        self.llm = llm
+
+    def run(self):
+        try:
+            self.llm.warm_up()
+        except (ImportError, OSError, ValueError, BackendError) as e:
+            print(f"Model warm-up failed: {e}")
+            self.done.emit(False)
+            return
+        self.done.emit(True)
+
+TASKS = ("autocomplete", "rephrase", "auto_write")
+
+# Typical response length per task, in tokens, for predicting its latency
+TASK_OUTPUT_TOKENS = {"autocomplete": 12, "rephrase": 150, "auto_write": 400}
+
+CALIBRATION_PROMPT = "Write a short paragraph about the weather today."
+CALIBRATION_TOKENS = 32
+CALIBRATION_PATH = os.path.join(QUILL_DIR, "calibration.json")
+CALIBRATION_MAX_AGE = 7 * 24 * 3600  # seconds before a model is measured again
+
+# Picks the backend for each task. Every task has its own model and latency
+# budget. Once calibration has measured how fast each configured model runs on
+# this machine, a task whose model would miss its budget goes to the slowest
+# (usually largest) model that still makes it, or the fastest if none does.
+class ModelRouter:
+    def __init__(self, config, backend, path=CALIBRATION_PATH):
+        self.backend = backend
+        self.kind = config["backend"]
+        self.path = path
+        self.tasks = {task: {"model": config[f"{task}_model"] or backend.model,
+                             "budget_ms": config[f"{task}_budget_ms"]}
+                      for task in TASKS}
+        self.upgrade_model = config["autocomplete_upgrade_model"]
+        self.backends = {backend.model: backend}
+        self.speeds = {}  # model -> ttft_ms and tokens_per_second, or error
+        self.lock = Lock()
+        self.load()
+
+    def models(self):
+        # Autocomplete's model first, since it is needed first
+        models = [self.tasks[task]["model"] for task in TASKS]
+        if self.upgrade_model:
+            models.append(self.upgrade_model)
+        return list(dict.fromkeys(models))
+
+    def uncalibrated(self):
+        # Routing only needs measurements when there is a choice of model
+        models = self.models()
+        if len(models) < 2:
+            return []
+        now = time.time()
+        return [model for model in models
+                if now - self.speeds.get(model, {}).get("time", 0) > CALIBRATION_MAX_AGE]
+
+    def backend_for(self, model):
+        with self.lock:
+            if model not in self.backends:
+                self.backends[model] = self.backend.for_model(model)
+            return self.backends[model]
+
+    def budget_ms(self, task):
+        return self.tasks[task]["budget_ms"]
+
+    def predict_ms(self, model, tokens):
+        speed = self.speeds.get(model)
+        if speed is None:
+            return None
+        if "error" in speed:
+            return float("inf")
+        return speed["ttft_ms"] + 1000.0 * tokens / speed["tokens_per_second"]
+
+    def route(self, task, tokens=None):
+        settings = self.tasks[task]
+        tokens = tokens or TASK_OUTPUT_TOKENS[task]
+        model = settings["model"]
+        predicted = self.predict_ms(model, tokens)
+        if predicted is not None and predicted > settings["budget_ms"]:
+            measured = sorted((self.predict_ms(m, tokens), m) for m in self.models()
+                              if m in self.speeds)
+            fitting = [m for ms, m in measured if ms <= settings["budget_ms"]]
+            if fitting:
+                model = fitting[-1]
+            elif measured[0][0] != float("inf"):
+                model = measured[0][1]
+        return self.backend_for(model)
+
+    def upgrade(self):
+        # The larger autocomplete model, unless it is off or measured too slow
+        # to ever finish inside the autocomplete budget
+        if not self.upgrade_model:
+            return None
+        predicted = self.predict_ms(self.upgrade_model, TASK_OUTPUT_TOKENS["autocomplete"])
+        if predicted is not None and predicted > self.budget_ms("autocomplete"):
+            return None
+        return self.backend_for(self.upgrade_model)
+
+    def calibrate(self, model):
+        backend = self.backend_for(model)
+        try:
+            backend.warm_up()
+            started = time.perf_counter()
+            first_token = None
+            chunks = 0
+            stream = backend.stream(CALIBRATION_PROMPT, temperature=0,
+                                    num_predict=CALIBRATION_TOKENS)
+            try:
+                for chunk in stream:
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    chunks += 1
+            finally:
+                stream.close()
+            finished = time.perf_counter()
+        except (ImportError, OSError, ValueError, BackendError) as e:
+            speed = {"error": str(e)}
+        else:
+            tokens = stream.stats.get("output_tokens") or chunks
+            generating = finished - (first_token or finished)
+            if tokens < 2 or generating <= 0:
+                speed = {"error": "too few tokens to measure"}
+            else:
+                speed = {"ttft_ms": round((first_token - started) * 1000, 2),
+                         "tokens_per_second": round((tokens - 1) / generating, 2)}
+        speed["time"] = time.time()
+        with self.lock:
+            self.speeds[model] = speed
+        return speed
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring {self.path}: {e}")
+            return
+        prefix = self.kind + ":"
+        self.speeds = {key[len(prefix):]: speed for key, speed in saved.items()
+                       if key.startswith(prefix)}
+
+    def save(self):
+        # Failed measurements are retried next launch, so only successes are kept;
+        # other backends' entries in the file are left alone
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        with self.lock:
+            saved.update({f"{self.kind}:{model}": speed for model, speed in self.speeds.items()
+                          if "error" not in speed})
+        try:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(saved, f, indent=2)
+        except OSError as e:
+            print(f"Could not save calibration: {e}")
+
+    def stats(self):
+        with self.lock:
+            speeds = dict(self.speeds)
+        return {
+            "routes": {task: self.route(task).model for task in TASKS},
+            "upgrade": getattr(self.upgrade(), "model", None),
+            "speeds": speeds,
+        }
+
+# Measures each model's speed after the warm-up, one at a time
+class CalibrationThread(QThread):
+    calibrated = pyqtSignal(str, dict)  # model, measured speed
+
+    def __init__(self, router, models):
+        super().__init__()
+        self.router = router
+        self.models = models
+
+    def run(self):
+        for model in self.models:
+            self.calibrated.emit(model, self.router.calibrate(model))
+        self.router.save()
+
+# Where a suggestion can end: sentence ends, or also clause ends, followed by
+# whitespace, and line breaks
+STOP_BOUNDARIES = {
+    "sentence": re.compile(r"[.!?](?=\s)|\n"),
+    "clause": re.compile(r"[.!?,;:](?=\s)|\n"),
+}
 
-class GenerationThread(QThread):
+def completion_boundary(text, stop_at="sentence", min_words=1):
+    # text cut after the first boundary that follows at least min_words words,
+    # or None while the suggestion is still incomplete
+    pattern = STOP_BOUNDARIES.get(stop_at)
+    if pattern is None:
+        return None
+    for match in pattern.finditer(text):
+        cut = text[:match.end()].rstrip()
+        if len(WORD.findall(cut)) >= min_words:
+            return cut
+    return None
+
+PRIORITY_USER = 0         # Rephrase, Auto Write and the Complete button
+PRIORITY_SPECULATIVE = 1  # autocomplete while the user types
+PRIORITY_PREFETCH = 2     # rephrasings of a selection nobody has asked for yet
+
+# One generation request. It runs on a RequestScheduler worker and reports back
+# through Qt signals, which arrive queued on the thread that created the job.
+# finished is always emitted, with whatever was generated, even when the job
+# was cancelled or failed.
+class GenerationJob(QObject):
+    partial = pyqtSignal(str)  # text generated so far, emitted per token when streaming
     finished = pyqtSignal(str)
     
-    def __init__(self, llm, prompt):
+    def __init__(self, llm, prompt, stream=False, options=None, trigger="generate",
+                 metrics=None, priority=PRIORITY_USER, group=None, until=None):
         super().__init__()
         self.llm = llm
         self.prompt = prompt
+        self.stream = stream
+        self.options = options or {}
+        # Called with the text so far; returning text ends the generation there
+        self.until = until
+        self.cancelled = False
+        self.stopped = False
+        self.error = None
+        self.trigger = trigger
+        self.metrics = metrics
+        self.priority = priority
+        self.group = group
+        self.queued_at = time.perf_counter()
+
+    def cancel(self):
+        self.cancelled = True
         
     def run(self):
-        response = self.llm(self.prompt)
+        started = time.perf_counter()
+        response = ""
+        first_token = None
+        tokens = 0
+        stats = {}
+        try:
+            if not self.stream:
+                response = self.llm(self.prompt, **self.options)
+                tokens = len(response) // 4
+            else:
+                # Stop reading as soon as we are cancelled; closing the stream
+                # drops the HTTP response so the backend stops generating too
+                chunks = self.llm.stream(self.prompt, **self.options)
+                stats = getattr(chunks, "stats", stats)
+                try:
+                    for chunk in chunks:
+                        if self.cancelled:
+                            break
+                        if first_token is None:
+                            first_token = time.perf_counter()
+                        tokens += 1  # backends stream one token per chunk
+                        response += chunk
+                        complete = self.until(response) if self.until is not None else None
+                        if complete is not None:
+                            # Closing the stream below cancels the rest on the backend
+                            response = complete
+                            self.stopped = True
+                            self.partial.emit(response)
+                            break
+                        self.partial.emit(response)
+                finally:
+                    chunks.close()
+        except Exception as e:
+            self.error = str(e)
+            print(f"{self.trigger} request failed: {e}")
+        self.record(started, first_token, stats.get("output_tokens") or tokens,
+                    stats.get("prompt_tokens"))
         self.finished.emit(response)
 
+    def record(self, started, first_token, tokens, prompt_tokens=None):
+        if self.metrics is not None:
+            self.metrics.record_generation(
+                self.trigger, self.prompt, self.queued_at, started, first_token,
+                time.perf_counter(), tokens, prompt_tokens=prompt_tokens,
+                cancelled=self.cancelled, stopped=self.stopped)
+
+# Runs every generation request on a fixed pool of worker threads, so the local
+# model never sees more than `workers` requests at once. Queued jobs start in
+# priority order, first come first served within a priority. A user request
+# that finds every worker busy with speculative work cancels one of those jobs
+# to take its place.
+class RequestScheduler:
+    def __init__(self, workers=2):
+        self.condition = Condition()
+        self.heap = []
+        self.order = itertools.count()
+        self.running = []
+        self.stopped = False
+        self.dropped = 0
+        self.threads = []
+        for i in range(max(1, workers)):
+            thread = Thread(target=self._work, name=f"quill-generation-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, job):
+        with self.condition:
+            job.queued_at = time.perf_counter()
+            heapq.heappush(self.heap, (job.priority, next(self.order), job))
+            if len(self.running) >= len(self.threads):
+                lower = [r for r in self.running if r.priority > job.priority and not r.cancelled]
+                if lower:
+                    max(lower, key=lambda r: r.priority).cancel()
+            self.condition.notify()
+        return job
+
+    def promote(self, group, priority):
+        # Queued jobs of group move up to priority; running ones can no longer
+        # be cancelled to make room for anything below it
+        with self.condition:
+            self.heap = [(min(p, priority) if job.group == group else p, order, job)
+                         for p, order, job in self.heap]
+            heapq.heapify(self.heap)
+            for job in self.running:
+                if job.group == group:
+                    job.priority = min(job.priority, priority)
+            for _, _, job in self.heap:
+                if job.group == group:
+                    job.priority = min(job.priority, priority)
+
+    def cancel_group(self, group):
+        # Queued jobs are skipped when a worker reaches them; running ones stop
+        # at their next token
+        with self.condition:
+            for _, _, job in self.heap:
+                if job.group == group:
+                    job.cancel()
+            for job in self.running:
+                if job.group == group:
+                    job.cancel()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "queued": sum(1 for _, _, job in self.heap if not job.cancelled),
+                "running": len(self.running),
+                "dropped": self.dropped,
+            }
+
+    def shutdown(self):
+        with self.condition:
+            self.stopped = True
+            for _, _, job in self.heap:
+                job.cancel()
+            for job in self.running:
+                job.cancel()
+            self.condition.notify_all()
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while not self.heap and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                _, _, job = heapq.heappop(self.heap)
+                # Decided once: a cancel landing after this is run() finding out
+                skipped = job.cancelled
+                if skipped:
+                    self.dropped += 1
+                else:
+                    self.running.append(job)
+            if skipped:
+                job.finished.emit("")
+                continue
+            try:
+                job.run()
+            finally:
+                with self.condition:
+                    self.running.remove(job)
+
+# Sampling settings for the autocomplete candidates of one trigger. The first
+# stays close to greedy and is the one that streams and gets cached; the rest
+# trade some accuracy for variety.
+CANDIDATE_SAMPLING = [
+    {"temperature": 0.2},
+    {"temperature": 0.7, "seed": 1},
+    {"temperature": 0.9, "top_p": 0.95, "seed": 2},
+    {"temperature": 1.1, "top_p": 0.9, "seed": 3},
+]
+
+def candidate_sampling(count):
+    sampling = CANDIDATE_SAMPLING[:count]
+    for seed in range(len(sampling), count):
+        sampling.append({"temperature": 0.9, "top_p": 0.95, "seed": seed})
+    return sampling
+
+def score_candidate(context, candidate):
+    # Cheap heuristics only: this runs on the GUI thread for every result
+    words = candidate.split()
+    if not words:
+        return float("-inf")
+    score = -0.1 * abs(len(words) - 8)
+    if candidate[-1] in ".!?,;:":
+        score += 0.5
+    tail = context.split()[-len(words):]
+    if [word.lower() for word in words] == [word.lower() for word in tail]:
+        score -= 2.0  # echoes what the user just wrote
+    if len(set(words)) < len(words) / 2:
+        score -= 1.0  # repeats itself
+    return score
+
+def rank_candidates(context, candidates):
+    # candidates are (sampling index, text); ties go to the lower temperature
+    ranked = sorted(candidates, key=lambda c: (-score_candidate(context, c[1]), c[0]))
+    seen = set()
+    unique = []
+    for _, text in ranked:
+        key = " ".join(re.findall(r"\w+", text.lower()))
+        if text and key not in seen:
+            seen.add(key)
+            unique.append(text)
+    return unique
+
+# Runs autocomplete through the RequestScheduler. Each trigger asks for several
+# candidates with different sampling settings. A newer buffer cancels the
+# running candidates and drops the queued ones, and results for anything but
+# the newest buffer never reach the UI.
+class CompletionPipeline(QObject):
+    suggestion_partial = pyqtSignal(str, str)  # context, first candidate so far
+    suggestions_ready = pyqtSignal(str, list)  # context, ranked candidates
+
+    def __init__(self, llm, scheduler, cache=None, session=None, candidates=1,
+                 metrics=None, upgrade=None, budget_ms=None, max_tokens=None, stop=None,
+                 stop_at=None, parent=None):
+        super().__init__(parent)
+        self.scheduler = scheduler
+        self.cache = cache
+        self.session = session
+        self.metrics = metrics
+        self.budget_ms = budget_ms
+        # Bounded output: the backend stops at max_tokens or a stop sequence,
+        # and the stream is dropped at the first sentence or clause end
+        limits = {}
+        if max_tokens:
+            limits["num_predict"] = max_tokens
+        if stop:
+            limits["stop"] = list(stop)
+        self.sampling = [dict(options, **limits) for options in candidate_sampling(max(1, candidates))]
+        self.until = None
+        if stop_at and stop_at != "none":
+            self.until = lambda text: completion_boundary(text, stop_at)
+        self.set_models(llm, upgrade)
+        self.jobs = {}  # (request_id, sampling index or "upgrade") -> job, until it finishes
+        self.results = []
+        self.upgraded = None
+        self.request_id = 0
+        self.dropped = 0
+        self.upgrades = {"started": 0, "shown": 0, "over_budget": 0}
+
+    def set_models(self, llm, upgrade=None):
+        self.llm = llm
+        self.upgrade = upgrade
+        self.model = getattr(llm, "model", "")
+
+    def submit(self, text, priority=PRIORITY_SPECULATIVE):
+        self.cancel()
+        if self.cache is not None:
+            cached = self.cache.get(self.model, AUTOCOMPLETE_PROMPT, text)
+            if cached is not None:
+                # Served without a model call
+                self.suggestions_ready.emit(text, [cached])
+                return
+        if self.session is not None:
+            prompt = self.session.build(text)
+        else:
+            prompt = AUTOCOMPLETE_PROMPT.format(text=text)
+        self.results = []
+        self.upgraded = None
+        for index in range(len(self.sampling)):
+            self._start(self.request_id, text, prompt, index, priority)
+        if self.upgrade is not None:
+            self._start_upgrade(self.request_id, text, prompt, priority)
+
+    def cancel(self):
+        # Newer context supersedes whatever is running or waiting
+        self.request_id += 1
+        self.scheduler.cancel_group(self)
+
+    def _start(self, request_id, text, prompt, index, priority):
+        job = GenerationJob(self.llm, prompt, stream=True, options=self.sampling[index],
+                            trigger="autocomplete", metrics=self.metrics,
+                            priority=priority, group=self, until=self.until)
+        job.partial.connect(
+            lambda response: self._handle_partial(request_id, text, index, response))
+        job.finished.connect(
+            lambda response: self._handle_response(request_id, text, index, response))
+        self.jobs[(request_id, index)] = job
+        self.scheduler.submit(job)
+
+    def _start_upgrade(self, request_id, text, prompt, priority):
+        # The larger model races the small one and is cancelled once the
+        # budget is spent, so a slow answer never replaces a shown one late
+        job = GenerationJob(self.upgrade, prompt, stream=True, options=self.sampling[0],
+                            trigger="autocomplete_upgrade", metrics=self.metrics,
+                            priority=priority, group=self, until=self.until)
+        job.finished.connect(lambda response: self._handle_upgrade(request_id, text, response))
+        self.jobs[(request_id, "upgrade")] = job
+        self.upgrades["started"] += 1
+        self.scheduler.submit(job)
+        if self.budget_ms is not None:
+            QTimer.singleShot(int(self.budget_ms), lambda: self._expire_upgrade(request_id))
+
+    def _expire_upgrade(self, request_id):
+        job = self.jobs.get((request_id, "upgrade"))
+        if job is not None:
+            job.cancel()
+
+    def _ranked(self, text):
+        ranked = rank_candidates(text, self.results)
+        if self.upgraded:
+            ranked = [self.upgraded] + [c for c in ranked if c != self.upgraded]
+        return ranked
+
+    def _handle_partial(self, request_id, text, index, response):
+        # Stream the first candidate until any candidate is complete
+        if (request_id == self.request_id and index == 0 and not self.results
+                and not self.upgraded and response.strip()):
+            self.suggestion_partial.emit(text, response.strip())
+
+    def _handle_response(self, request_id, text, index, response):
+        job = self.jobs.pop((request_id, index))
+        if not job.cancelled and not job.error and response.strip():
+            if self.cache is not None and index == 0 and not self.upgraded:
+                self.cache.put(self.model, AUTOCOMPLETE_PROMPT, text, response)
+            if request_id == self.request_id:
+                self.results.append((index, response.strip()))
+                self.suggestions_ready.emit(text, self._ranked(text))
+        if request_id != self.request_id:
+            self.dropped += 1
+
+    def _handle_upgrade(self, request_id, text, response):
+        job = self.jobs.pop((request_id, "upgrade"))
+        if request_id != self.request_id:
+            self.dropped += 1
+            return
+        in_budget = (self.budget_ms is None
+                     or (time.perf_counter() - job.queued_at) * 1000 <= self.budget_ms)
+        if job.cancelled or not in_budget:
+            self.upgrades["over_budget"] += 1
+        elif not job.error and response.strip():
+            self.upgrades["shown"] += 1
+            self.upgraded = response.strip()
+            if self.cache is not None:
+                self.cache.put(self.model, AUTOCOMPLETE_PROMPT, text, response)
+            self.suggestions_ready.emit(text, self._ranked(text))
+
+REPHRASE_PROMPT = "Rephrase the following text: {text}\nInstructions: {instructions}"
+
+# Paragraph breaks, then sentence ends, then any whitespace
+CHUNK_BREAKS = (re.compile(r"\n\s*\n"), re.compile(r"(?<=[.!?])\s+|\n"), re.compile(r"\s+"))
+
+def split_at(text, pattern):
+    pieces = []
+    start = 0
+    for match in pattern.finditer(text):
+        pieces.append((text[start:match.start()], match.group()))
+        start = match.end()
+    pieces.append((text[start:], ""))
+    return pieces
+
+def split_chunks(text, max_chars, level=0):
+    # (chunk, separator) pairs of at most max_chars each, split at the coarsest
+    # boundary that fits and packed back together up to the limit. Joining every
+    # chunk and separator in order gives back the original text.
+    units = []
+    for piece, separator in split_at(text, CHUNK_BREAKS[level]):
+        if len(piece) > max_chars and level + 1 < len(CHUNK_BREAKS):
+            pieces = split_chunks(piece, max_chars, level + 1)
+            pieces[-1] = (pieces[-1][0], pieces[-1][1] + separator)
+            units.extend(pieces)
+        else:
+            units.append((piece, separator))  # a single overlong word stays whole
+    chunks = []
+    for piece, separator in units:
+        if chunks and len(chunks[-1][0]) + len(chunks[-1][1]) + len(piece) <= max_chars:
+            chunks[-1] = (chunks[-1][0] + chunks[-1][1] + piece, separator)
+        else:
+            chunks.append((piece, separator))
+    return chunks
+
+# Rephrases a selection as chunks that run side by side on the scheduler, so a
+# long selection takes about as long as its slowest chunk. progress carries the
+# text reassembled in order: finished chunks, the partial output of running
+# ones and nothing yet for those still queued. A chunk that fails keeps its
+# original wording and sets error.
+class ChunkedRephrase(QObject):
+    progress = pyqtSignal(str)
+    finished = pyqtSignal(str)
+
+    def __init__(self, router, scheduler, text, instructions, max_tokens=300,
+                 metrics=None, results=None, regenerate=False, output_tokens=None,
+                 priority=PRIORITY_USER, trigger="rephrase", parent=None):
+        super().__init__(parent)
+        self.router = router
+        self.scheduler = scheduler
+        self.text_in = text
+        self.instructions = instructions
+        self.metrics = metrics
+        self.results = results
+        self.regenerate = regenerate
+        self.output_tokens = output_tokens
+        self.priority = priority
+        self.trigger = trigger
+        self.chunks = split_chunks(text, max_tokens * 4)
+        self.outputs = [None] * len(self.chunks)
+        self.jobs = {}  # chunk index -> job, until it finishes
+        self.pending = 0
+        self.started = False
+        self.done = False
+        self.cancelled = False
+        self.retired = False
+        self.error = None
+
+    def start(self):
+        if self.started:
+            # A prefetched rephrasing handed to the user: show what is there
+            if self.done:
+                self.progress.emit(self.text())
+                self.finished.emit(self.text())
+            elif any(output is not None for output in self.outputs):
+                self.progress.emit(self.text())
+            return
+        self.started = True
+        jobs = []
+        for index, (chunk, _) in enumerate(self.chunks):
+            if not chunk.strip():
+                self.outputs[index] = chunk
+                continue
+            backend = self.router.route("rephrase", len(chunk) // 4)
+            if self.results is not None:
+                cached = self.results.get("rephrase", chunk, self.instructions, backend.model,
+                                          REPHRASE_PROMPT, bypass=self.regenerate)
+                if cached is not None:
+                    self.outputs[index] = cached
+                    continue
+            jobs.append(self._job(index, backend))
+        self.pending = len(jobs)
+        if len(jobs) < len(self.chunks):
+            # Saved results show straight away
+            self.progress.emit(self.text())
+        if not jobs:
+            self.done = True
+            self.finished.emit(self.text())
+        for job in jobs:
+            self.scheduler.submit(job)
+
+    def _job(self, index, backend):
+        chunk = self.chunks[index][0]
+        limit = self.output_tokens or 2 * (len(chunk) // 4) + 32
+        job = GenerationJob(
+            backend, REPHRASE_PROMPT.format(text=chunk, instructions=self.instructions),
+            stream=True, options={"num_predict": limit}, trigger=self.trigger,
+            metrics=self.metrics, priority=self.priority, group=self)
+        job.partial.connect(lambda response, index=index: self._handle_partial(index, response))
+        job.finished.connect(lambda response, index=index: self._handle_finished(index, response))
+        self.jobs[index] = job
+        return job
+
+    def promote(self, priority):
+        self.priority = min(self.priority, priority)
+        self.scheduler.promote(self, priority)
+
+    def cancel(self):
+        self.cancelled = True
+        self.scheduler.cancel_group(self)
+
+    def retire(self):
+        # Cancelled, and deleted once no job is left to report back. A job
+        # collected while its signals are still queued takes the process down.
+        self.cancel()
+        self.retired = True
+        if not self.jobs:
+            self.deleteLater()
+
+    def text(self):
+        return "".join((output or "") + separator
+                       for output, (_, separator) in zip(self.outputs, self.chunks))
+
+    def settled_text(self):
+        # Up to the first chunk still being written, so it only ever grows
+        parts = []
+        for index, (output, (_, separator)) in enumerate(zip(self.outputs, self.chunks)):
+            if output is None:
+                break
+            parts.append(output)
+            if index in self.jobs:
+                break
+            parts.append(separator)
+        return "".join(parts)
+
+    def _handle_partial(self, index, response):
+        if not self.cancelled and index in self.jobs:
+            self.outputs[index] = response.strip()
+            self.progress.emit(self.text())
+
+    def _handle_finished(self, index, response):
+        job = self.jobs.pop(index)
+        if self.cancelled:
+            if self.retired and not self.jobs:
+                self.deleteLater()
+            return
+        if job.cancelled:
+            # A prefetch chunk made way for a user request; its partial text
+            # must not be kept, so it runs again later
+            self.outputs[index] = None
+            self.scheduler.submit(self._job(index, job.llm))
+            return
+        if job.error or not response.strip():
+            self.error = job.error or "empty response"
+            self.outputs[index] = self.chunks[index][0]
+        else:
+            self.outputs[index] = response.strip()
+            if self.results is not None:
+                self.results.put("rephrase", self.chunks[index][0], self.instructions,
+                                 job.llm.model, REPHRASE_PROMPT, self.outputs[index])
+        self.pending -= 1
+        self.progress.emit(self.text())
+        if not self.pending:
+            self.done = True
+            self.finished.emit(self.text())
+
+PRESETS_PATH = os.path.join(QUILL_DIR, "presets.json")
+# Offered until the user's own instructions outrank them
+DEFAULT_PRESETS = ("Make it more formal", "Make it shorter", "Fix grammar and spelling",
+                   "Make it friendlier")
+REPHRASE_PRESET_BUTTONS = 4
+
+# How often each Rephrase instruction was used, in ~/.quill/presets.json. The
+# most used ones become one-click presets and are prefetched for selections.
+class RephrasePresets:
+    def __init__(self, path=PRESETS_PATH, max_entries=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.counts = {}
+        self.load()
+
+    def record(self, instructions):
+        instructions = " ".join(instructions.split())
+        if instructions:
+            self.counts[instructions] = self.counts.get(instructions, 0) + 1
+            self.save()
+
+    def top(self, count):
+        ranked = sorted(self.counts, key=self.counts.get, reverse=True)
+        ranked += [preset for preset in DEFAULT_PRESETS if preset not in self.counts]
+        return ranked[:count]
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(saved, dict):
+            self.counts = {k: v for k, v in saved.items() if isinstance(v, int)}
+
+    def save(self):
+        # Rarely used instructions are forgotten first
+        kept = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        self.counts = dict(kept[:self.max_entries])
+        try:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.counts, f, indent=1)
+        except OSError as e:
+            print(f"Could not save rephrase presets: {e}")
+
+OUTLINE_PROMPT = """Plan a piece of writing for this request: {request}
+List between 2 and {sections} short section headings, one per line, with no other text."""
+
+SECTION_PROMPT = """You are writing one section of a longer piece.
+Request: {request}
+Outline:
+{outline}
+Write only the section "{title}". Do not write its heading and do not cover the other sections."""
+
+OUTLINE_ITEM = re.compile(r"^\s*(?:[-*•#]+|\d+[.)])?\s*(.+?)\s*$")
+
+def parse_outline(text, max_sections):
+    titles = []
+    for line in text.splitlines():
+        match = OUTLINE_ITEM.match(line)
+        # Skip preambles such as "Here is an outline:"
+        if not match or match.group(1).endswith(":"):
+            continue
+        title = match.group(1).strip("*#\"' ")
+        if title and title not in titles:
+            titles.append(title)
+    return titles[:max_sections]
+
+# Writes long text outline first: one short request plans the sections, then
+# every section is written at once with the whole outline as shared context and
+# stitched back in order. The wait is about the outline plus the longest
+# section. Without a usable outline, or with outline=False, the request is
+# written in one piece.
+class OutlineWriter(QObject):
+    outlined = pyqtSignal(list)                    # section titles
+    section_progress = pyqtSignal(int, str, bool)  # index, text so far, finished
+    progress = pyqtSignal(str)                     # document stitched so far
+    finished = pyqtSignal(str)
+
+    def __init__(self, router, scheduler, request, max_sections=5, section_tokens=250,
+                 metrics=None, results=None, regenerate=False, output_tokens=None, outline=True,
+                 parent=None):
+        super().__init__(parent)
+        self.router = router
+        self.scheduler = scheduler
+        self.request = request
+        self.outline = outline
+        self.max_sections = max_sections
+        self.section_tokens = section_tokens
+        self.metrics = metrics
+        self.results = results
+        self.regenerate = regenerate
+        self.output_tokens = output_tokens
+        self.outline_job = None
+        self.titles = []
+        self.outputs = []
+        self.jobs = {}  # section index -> job, until it finishes
+        self.pending = 0
+        self.cancelled = False
+        self.retired = False
+        self.error = None
+
+    def cache_key(self):
+        if not self.outline:
+            return ("auto_write", self.request, "", self.router.route("auto_write").model, "")
+        return ("auto_write_long_form", self.request,
+                f"{self.max_sections} sections of {self.section_tokens} tokens",
+                self.router.route("auto_write", self.section_tokens).model,
+                OUTLINE_PROMPT + SECTION_PROMPT)
+
+    def start(self):
+        if self.results is not None:
+            cached = self.results.get(*self.cache_key(), bypass=self.regenerate)
+            if cached is not None:
+                self.progress.emit(cached)
+                self.finished.emit(cached)
+                return
+        if not self.outline:
+            self._write([""])
+            return
+        self.outline_job = GenerationJob(
+            self.router.route("auto_write", 15 * self.max_sections),
+            OUTLINE_PROMPT.format(request=self.request, sections=self.max_sections),
+            options={"num_predict": 15 * self.max_sections}, trigger="auto_write_outline",
+            metrics=self.metrics, group=self)
+        self.outline_job.finished.connect(self._handle_outline)
+        self.scheduler.submit(self.outline_job)
+
+    def cancel(self):
+        self.cancelled = True
+        self.scheduler.cancel_group(self)
+
+    def retire(self):
+        # Same as ChunkedRephrase.retire
+        self.cancel()
+        self.retired = True
+        self._delete_if_idle()
+
+    def _delete_if_idle(self):
+        if self.retired and not self.jobs and self.outline_job is None:
+            self.deleteLater()
+
+    def text(self):
+        return "\n\n".join(f"{title}\n\n{output}" if title else output
+                           for title, output in zip(self.titles, self.outputs) if output)
+
+    def _handle_outline(self, response):
+        job, self.outline_job = self.outline_job, None
+        if self.cancelled:
+            self._delete_if_idle()
+            return
+        if job.error:
+            self.error = job.error
+            self.finished.emit("")
+            return
+        titles = parse_outline(response, self.max_sections)
+        self._write(titles if len(titles) >= 2 else [""])
+
+    def _write(self, titles):
+        self.titles = titles
+        self.outputs = [""] * len(self.titles)
+        self.pending = len(self.titles)
+        self.outlined.emit(self.titles)
+        outline = "\n".join(f"{i + 1}. {title}" for i, title in enumerate(self.titles))
+        jobs = []
+        for index, title in enumerate(self.titles):
+            if title:
+                prompt = SECTION_PROMPT.format(request=self.request, outline=outline, title=title)
+                options = {"num_predict": self.section_tokens}
+            else:
+                prompt = self.request
+                options = {"num_predict": self.output_tokens} if self.output_tokens else {}
+            job = GenerationJob(self.router.route("auto_write", self.section_tokens if title else None),
+                                prompt, stream=True, options=options,
+                                trigger="auto_write_section" if title else "auto_write",
+                                metrics=self.metrics, group=self)
+            job.partial.connect(lambda response, index=index: self._handle_partial(index, response))
+            job.finished.connect(lambda response, index=index: self._handle_finished(index, response))
+            self.jobs[index] = job
+            jobs.append(job)
+        for job in jobs:
+            self.scheduler.submit(job)
+
+    def _handle_partial(self, index, response):
+        if not self.cancelled and index in self.jobs:
+            self.outputs[index] = response.strip()
+            self.section_progress.emit(index, self.outputs[index], False)
+            self.progress.emit(self.text())
+
+    def _handle_finished(self, index, response):
+        job = self.jobs.pop(index)
+        if self.cancelled:
+            self._delete_if_idle()
+            return
+        if job.error:
+            self.error = job.error
+        self.outputs[index] = response.strip() or self.outputs[index]
+        self.pending -= 1
+        self.section_progress.emit(index, self.outputs[index], True)
+        self.progress.emit(self.text())
+        if not self.pending:
+            if self.results is not None and not self.error:
+                self.results.put(*self.cache_key(), self.text())
+            self.finished.emit(self.text())
+
+ENGINE_SOCKET = os.path.join(QUILL_DIR, "engine.sock")
+ENGINE_LOG = os.path.join(QUILL_DIR, "engine.log")
+
+# Everything that talks to the model: the backend and its routing, the request
+# scheduler, the caches, the local predictor and the metrics. The window runs
+# one in-process, or `python app.py --engine` runs one as a daemon that any
+# number of front-ends share over a Unix socket (EngineServer, RemoteEngine).
+class Engine(QObject):
+    ready = pyqtSignal(bool)             # warm-up finished, and whether the model loaded
+    calibrated = pyqtSignal(str, dict)   # model, measured speed
+    predicted = pyqtSignal(str, list)    # text, local guesses for it
+
+    def __init__(self, config, startup=None, calibrate=False, parent=None):
+        super().__init__(parent)
+        self.config = config
+        self.startup = startup or StartupTimer()
+        self.calibrate = calibrate
+        
+        # Per-request timings go to ~/.quill/metrics.jsonl
+        self.metrics = MetricsRecorder()
+        self.metrics_server = None
+        if config["metrics_port"]:
+            try:
+                self.metrics_server = start_metrics_server(self.metrics, config["metrics_port"])
+            except OSError as e:
+                print(f"Metrics endpoint disabled: {e}")
+        
+        # The model itself is only loaded on the warm-up thread
+        self.llm = create_backend(config)
+        # Each task goes to its own model, re-routed once the models are measured
+        self.router = ModelRouter(config, self.llm)
+        # Every model request runs on one bounded, prioritized worker pool
+        self.scheduler = RequestScheduler(workers=config["max_parallel_requests"])
+        
+        # Rephrase and Auto Write results survive restarts
+        self.result_cache = None
+        if config["result_cache_mb"]:
+            self.result_cache = ResultCache(max_bytes=config["result_cache_mb"] * 2**20,
+                                            max_age=config["result_cache_days"] * 24 * 3600)
+        
+        # Instant next-word guesses, loaded in start. The engine server calls
+        # predict and learn from its connection threads, hence the lock.
+        self.predictor = None
+        if config["ngram_max_entries"]:
+            self.predictor = NgramPredictor(
+                path=NGRAMS_PATH if config["ngram_persist"] else None,
+                max_entries=config["ngram_max_entries"])
+        self.predictor_lock = Lock()
+        
+        self.completion_cache = CompletionCache(max_entries=256)
+        self.pipelines = []
+        # Background rephrasings of the last settled selection, by instructions
+        self.rephrase_presets = RephrasePresets()
+        self.prefetch_text = None
+        self.prefetched = {}
+        self.prefetch_stats = {"started": 0, "used": 0}
+        self.is_ready = None  # None until the warm-up finishes
+        self.warmup_thread = None
+        self.calibration_thread = None
+
+    def start(self):
+        if self.predictor is not None:
+            with self.startup.phase("predictor"), self.predictor_lock:
+                self.predictor.load()
+            self.predictor_timer = QTimer(self)
+            self.predictor_timer.timeout.connect(self.save_predictor)
+            self.predictor_timer.start(5 * 60 * 1000)
+        
+        # Load the model in the background before the user's first space
+        self.warmup_thread = WarmupThread(self.router.route("autocomplete"))
+        self.warmup_thread.done.connect(self._handle_warmup_done)
+        self.warmup_thread.start()
+
+    def _handle_warmup_done(self, ok):
+        self.is_ready = ok
+        self.ready.emit(ok)
+        # Measure the models routing chooses between, then route by the results
+        models = self.router.models() if self.calibrate else self.router.uncalibrated()
+        if ok and models:
+            self.calibration_thread = CalibrationThread(self.router, models)
+            self.calibration_thread.calibrated.connect(self.calibrated)
+            self.calibration_thread.finished.connect(self._apply_routing)
+            self.calibration_thread.start()
+
+    def _apply_routing(self):
+        for pipeline in self.pipelines:
+            pipeline.set_models(self.router.route("autocomplete"), self.router.upgrade())
+
+    def pipeline(self, parent=None):
+        # One per stream of typing, each with its own prompt session
+        pipeline = CompletionPipeline(
+            self.router.route("autocomplete"), self.scheduler, self.completion_cache,
+            PromptSession(max_chars=2000, rebase_chars=1000),
+            candidates=self.config["autocomplete_candidates"],
+            metrics=self.metrics,
+            upgrade=self.router.upgrade(),
+            budget_ms=self.router.budget_ms("autocomplete"),
+            max_tokens=self.config["autocomplete_max_tokens"],
+            stop=self.config["autocomplete_stop"],
+            stop_at=self.config["autocomplete_stop_at"],
+            parent=parent)
+        self.pipelines.append(pipeline)
+        return pipeline
+
+    def release(self, pipeline):
+        pipeline.cancel()
+        self.pipelines.remove(pipeline)
+
+    def rephrase(self, text, instructions, regenerate=False, parent=None):
+        instructions = " ".join(instructions.split())
+        self.rephrase_presets.record(instructions)
+        task = None
+        if text == self.prefetch_text and not regenerate:
+            task = self.prefetched.pop(instructions, None)
+        if task is not None:
+            # The background rephrasing becomes the user's request, finished or not
+            self.prefetch_stats["used"] += 1
+            task.setParent(parent)
+            task.promote(PRIORITY_USER)
+            return task
+        return self._rephrase(text, instructions, regenerate=regenerate, parent=parent)
+
+    def _rephrase(self, text, instructions, priority=PRIORITY_USER, trigger="rephrase",
+                  regenerate=False, parent=None):
+        return ChunkedRephrase(self.router, self.scheduler, text, instructions,
+                               max_tokens=self.config["rephrase_chunk_tokens"],
+                               metrics=self.metrics, results=self.result_cache,
+                               regenerate=regenerate,
+                               output_tokens=self.config["rephrase_max_tokens"],
+                               priority=priority, trigger=trigger, parent=parent)
+
+    def presets(self):
+        return self.rephrase_presets.top(REPHRASE_PRESET_BUTTONS)
+
+    def prefetch(self, text):
+        # Rephrases a settled selection with the most used instructions, so
+        # picking one of those presets finds the result ready. The jobs run
+        # after everything else and give way to any user request.
+        if text == self.prefetch_text:
+            return
+        self.cancel_prefetch()
+        count = self.config["rephrase_prefetch"]
+        if not count or not text.strip() or len(text) > self.config["rephrase_prefetch_max_chars"]:
+            return
+        self.prefetch_text = text
+        for instructions in self.rephrase_presets.top(count):
+            task = self._rephrase(text, instructions, priority=PRIORITY_PREFETCH,
+                                  trigger="rephrase_prefetch", parent=self)
+            self.prefetched[instructions] = task
+            self.prefetch_stats["started"] += 1
+            task.start()
+
+    def cancel_prefetch(self):
+        for task in self.prefetched.values():
+            task.retire()
+        self.prefetched = {}
+        self.prefetch_text = None
+
+    def write(self, request, long_form=False, regenerate=False, parent=None):
+        return OutlineWriter(self.router, self.scheduler, request,
+                             max_sections=self.config["auto_write_max_sections"],
+                             section_tokens=self.config["auto_write_section_tokens"],
+                             metrics=self.metrics, results=self.result_cache,
+                             regenerate=regenerate,
+                             output_tokens=self.config["auto_write_max_tokens"],
+                             outline=long_form, parent=parent)
+
+    def predict(self, text):
+        if self.predictor is None:
+            return []
+        with self.predictor_lock:
+            return self.predictor.predict(text)
+
+    def request_predictions(self, text):
+        # Answered right away here; the daemon's answer comes over the socket
+        self.predicted.emit(text, self.predict(text))
+
+    def learn(self, text):
+        if self.predictor is not None:
+            with self.predictor_lock:
+                self.predictor.learn(text)
+
+    def save_predictor(self):
+        with self.predictor_lock:
+            self.predictor.save()
+
+    def record_paste(self, trigger, seconds):
+        self.metrics.record_paste(trigger, seconds)
+
+    def record_stall(self, milliseconds, slot, where):
+        self.metrics.record_stall(milliseconds, slot, where)
+
+    def stats(self):
+        return {
+            "completion_cache": self.completion_cache.stats(),
+            "prompts_reused": sum(p.session.stats()["reused"] for p in self.pipelines),
+            "routes": self.router.stats()["routes"],
+            "results": self.result_cache.stats() if self.result_cache is not None else None,
+            "prefetch": dict(self.prefetch_stats),
+            "metrics": self.metrics.summary(),
+        }
+
+    def close(self):
+        for pipeline in self.pipelines:
+            pipeline.cancel()
+        self.cancel_prefetch()
+        self.scheduler.shutdown()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+        if self.result_cache is not None:
+            self.result_cache.close()
+        if self.predictor is not None:
+            self.save_predictor()
+        self.metrics.close()
+
+def open_engine_socket(path=ENGINE_SOCKET):
+    # A connection to the running engine daemon, or None
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+def spawn_engine():
+    # Starts the daemon in the background; it listens once it has started up
+    if not hasattr(socket, "AF_UNIX"):
+        return False
+    try:
+        os.makedirs(QUILL_DIR, mode=0o700, exist_ok=True)
+        with open(ENGINE_LOG, "ab") as log:
+            subprocess.Popen([sys.executable, os.path.abspath(__file__), "--engine"],
+                             stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                             start_new_session=True)
+    except OSError as e:
+        print(f"Could not start the engine daemon: {e}")
+        return False
+    return True
+
+# The request fields the engine relies on, and the JSON types each may have.
+# Anything else in a request is read with a fallback or left to the handler.
+REQUEST_TYPES = {
+    "id": (str, int, float, type(None)),
+    "target": (str, int, float),
+    "text": str,
+    "instructions": str,
+    "request": str,
+}
+
+def request_problem(request):
+    if not isinstance(request, dict):
+        return "not a request"
+    if not isinstance(request.get("method"), str):
+        return "method must be a string"
+    for key, types in REQUEST_TYPES.items():
+        if key in request and not isinstance(request[key], types):
+            return f"bad {key} in {request['method']} request"
+    return None
+
+# One front-end's connection to the daemon. Replies are written from the
+# engine's thread and, for predict, from the connection's reader thread.
+class EngineConnection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = Lock()
+        self.pipeline = None
+        self.tasks = {}  # request id -> running rephrase or write
+
+    def send(self, request_id, event, data=None):
+        line = json.dumps({"id": request_id, "event": event, "data": data}) + "\n"
+        with self.lock:
+            try:
+                self.sock.sendall(line.encode("utf-8"))
+            except OSError:
+                pass  # the reader thread sees the disconnect
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+# Serves an Engine on a Unix socket, one JSON object per line each way.
+# Requests are {"method": ..., "id": ..., ...}; replies and streamed updates are
+# {"id": ..., "event": ..., "data": ...}. Work is handed to the engine's thread,
+# except predict and learn, which are answered on the connection's thread so a
+# local guess never waits behind the event loop.
+class EngineServer(QObject):
+    received = pyqtSignal(object, dict)  # connection, request
+    disconnected = pyqtSignal(object)
+
+    def __init__(self, engine, path=ENGINE_SOCKET, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.path = path
+        self.connections = set()
+        self.methods = {
+            "hello": self.hello,
+            "complete": self.complete,
+            "cancel_complete": self.cancel_complete,
+            "rephrase": self.rephrase,
+            "write": self.write,
+            "cancel": self.cancel,
+            "prefetch": self.prefetch,
+            "cancel_prefetch": self.cancel_prefetch,
+            "record_paste": self.record_paste,
+            "record_stall": self.record_stall,
+            "stats": self.stats,
+        }
+        # Emitted from the connection threads, delivered on the engine's thread
+        self.received.connect(self._dispatch)
+        self.disconnected.connect(self._handle_disconnected)
+        engine.ready.connect(self._broadcast_ready)
+        self.sock = self._listen()
+        Thread(target=self._accept, daemon=True).start()
+
+    def _listen(self):
+        if open_engine_socket(self.path) is not None:
+            raise OSError(f"another engine is already listening on {self.path}")
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        try:
+            os.unlink(self.path)  # left behind by an engine that didn't exit cleanly
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Everything the user types passes through here, so the socket is
+        # created private rather than made private after it could be opened
+        umask = os.umask(0o077)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        sock.listen()
+        return sock
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.sock.accept()
+            except OSError:
+                return  # closed
+            Thread(target=self._serve, args=(EngineConnection(sock),), daemon=True).start()
+
+    def _serve(self, connection):
+        try:
+            for line in connection.sock.makefile("r", encoding="utf-8"):
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    request = None
+                problem = request_problem(request)
+                if problem is not None:
+                    connection.send(None, "error", f"{problem}: {line.strip()[:100]}")
+                    continue
+                # One bad request mustn't end the connection
+                try:
+                    if request["method"] == "predict":
+                        connection.send(request.get("id"), "result",
+                                        self.engine.predict(request.get("text", "")))
+                    elif request["method"] == "learn":
+                        self.engine.learn(request.get("text", ""))
+                    else:
+                        self.received.emit(connection, request)
+                except Exception as e:
+                    connection.send(request.get("id"), "error",
+                                    f"bad {request['method']} request: {e}")
+        except (OSError, UnicodeDecodeError):
+            pass
+        finally:
+            self.disconnected.emit(connection)
+
+    @pyqtSlot(object, dict)
+    def _dispatch(self, connection, request):
+        self.connections.add(connection)
+        method = self.methods.get(request["method"])
+        if method is None:
+            connection.send(request.get("id"), "error", f"unknown method {request['method']!r}")
+            return
+        # An exception escaping a slot would abort the daemon and every front-end with it
+        try:
+            method(connection, request)
+        except Exception as e:
+            connection.send(request.get("id"), "error", f"bad {request['method']} request: {e}")
+
+    def _broadcast_ready(self, ok):
+        for connection in self.connections:
+            connection.send(None, "ready", ok)
+
+    def hello(self, connection, request):
+        connection.send(None, "presets", self.engine.presets())
+        if self.engine.is_ready is not None:
+            connection.send(None, "ready", self.engine.is_ready)
+
+    def complete(self, connection, request):
+        if connection.pipeline is None:
+            connection.pipeline = self.engine.pipeline(parent=self)
+            connection.pipeline.suggestion_partial.connect(
+                lambda context, text: connection.send(None, "suggestion_partial", [context, text]))
+            connection.pipeline.suggestions_ready.connect(
+                lambda context, texts: connection.send(None, "suggestions_ready", [context, texts]))
+        connection.pipeline.submit(request["text"], request.get("priority", PRIORITY_SPECULATIVE))
+
+    def cancel_complete(self, connection, request):
+        if connection.pipeline is not None:
+            connection.pipeline.cancel()
+
+    def rephrase(self, connection, request):
+        self._run(connection, request["id"], self.engine.rephrase(
+            request["text"], request.get("instructions", ""),
+            regenerate=request.get("regenerate", False), parent=self))
+        # The ranking may have changed
+        connection.send(None, "presets", self.engine.presets())
+
+    def write(self, connection, request):
+        self._run(connection, request["id"], self.engine.write(
+            request["request"], long_form=request.get("long_form", False),
+            regenerate=request.get("regenerate", False), parent=self))
+
+    def _run(self, connection, request_id, task):
+        connection.tasks[request_id] = task
+        if isinstance(task, ChunkedRephrase):
+            # Ahead of each progress event, for front-ends inserting as it streams
+            task.progress.connect(
+                lambda text: connection.send(request_id, "settled", task.settled_text()))
+        task.progress.connect(lambda text: connection.send(request_id, "progress", text))
+        if isinstance(task, OutlineWriter):
+            task.outlined.connect(lambda titles: connection.send(request_id, "outlined", titles))
+            task.section_progress.connect(
+                lambda index, text, done: connection.send(request_id, "section_progress",
+                                                          [index, text, done]))
+        task.finished.connect(lambda text: self._finish(connection, request_id, task, text))
+        task.start()
+
+    def _finish(self, connection, request_id, task, text):
+        connection.send(request_id, "finished", {"text": text, "error": task.error})
+        if connection.tasks.pop(request_id, None) is task:
+            task.deleteLater()
+
+    def cancel(self, connection, request):
+        task = connection.tasks.pop(request["target"], None)
+        if task is not None:
+            task.retire()
+
+    def prefetch(self, connection, request):
+        self.engine.prefetch(request["text"])
+
+    def cancel_prefetch(self, connection, request):
+        self.engine.cancel_prefetch()
+
+    def record_paste(self, connection, request):
+        self.engine.record_paste(request["trigger"], float(request["seconds"]))
+
+    def record_stall(self, connection, request):
+        self.engine.record_stall(float(request["ms"]), request["slot"], request["at"])
+
+    def stats(self, connection, request):
+        connection.send(request.get("id"), "stats", self.engine.stats())
+
+    @pyqtSlot(object)
+    def _handle_disconnected(self, connection):
+        # Whatever the front-end was waiting for is no longer needed
+        self.connections.discard(connection)
+        if connection.pipeline is not None:
+            self.engine.release(connection.pipeline)
+            connection.pipeline.deleteLater()
+        for task in connection.tasks.values():
+            task.retire()
+        connection.tasks.clear()
+        connection.close()
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        for connection in list(self.connections):
+            connection.close()
+
+# The window's side of the daemon. It offers the same calls as Engine, and the
+# objects it hands out have the same signals as the ones they stand in for.
+# Replies are read on a thread and passed to the GUI thread through received.
+class RemoteEngine(QObject):
+    ready = pyqtSignal(bool)
+    calibrated = pyqtSignal(str, dict)  # only the daemon calibrates; never emitted here
+    predicted = pyqtSignal(str, list)
+    received = pyqtSignal(dict)
+    disconnected = pyqtSignal()
+
+    def __init__(self, config, sock=None, parent=None):
+        super().__init__(parent)
+        self.config = config
+        self.sock = None
+        self.unsent = []  # requests made before the socket was there
+        self.lock = Lock()
+        self.ids = itertools.count(1)
+        self.completion = None
+        self.tasks = {}       # request id -> RemoteTask, until it finishes
+        self.predicting = {}  # request id -> text, until its guesses arrive
+        self.last_stats = None
+        self.last_presets = list(DEFAULT_PRESETS[:REPHRASE_PRESET_BUTTONS])
+        self.connect_timer = None
+        self.received.connect(self._dispatch)
+        self.disconnected.connect(self._handle_disconnected)
+        if sock is not None:
+            self.attach(sock)
+
+    def connect_later(self, path=ENGINE_SOCKET, timeout=10.0):
+        # Polled from the event loop until the daemon listens on path
+        deadline = time.perf_counter() + timeout
+        self.connect_timer = QTimer(self)
+        self.connect_timer.timeout.connect(lambda: self._try_connect(path, deadline))
+        self.connect_timer.start(50)
+
+    def _try_connect(self, path, deadline):
+        sock = open_engine_socket(path)
+        if sock is not None:
+            self.connect_timer.stop()
+            self.attach(sock)
+        elif time.perf_counter() > deadline:
+            self.connect_timer.stop()
+            print(f"The engine daemon didn't start; see {ENGINE_LOG}")
+            self.disconnected.emit()
+
+    def attach(self, sock):
+        with self.lock:
+            self.sock = sock
+            unsent, self.unsent = self.unsent, []
+            for line in unsent:
+                try:
+                    sock.sendall(line)
+                except OSError:
+                    break
+        Thread(target=self._read, daemon=True).start()
+
+    def send(self, message):
+        line = (json.dumps(message) + "\n").encode("utf-8")
+        with self.lock:
+            if self.sock is None:
+                self.unsent.append(line)
+                return
+            try:
+                self.sock.sendall(line)
+            except OSError:
+                pass  # the reader thread sees the disconnect
+
+    def _read(self):
+        try:
+            for line in self.sock.makefile("r", encoding="utf-8"):
+                self.received.emit(json.loads(line))
+        except (OSError, ValueError):
+            pass
+        self.disconnected.emit()
+
+    @pyqtSlot(dict)
+    def _dispatch(self, message):
+        event, data = message.get("event"), message.get("data")
+        if event == "ready":
+            self.ready.emit(bool(data))
+        elif event == "stats":
+            self.last_stats = data
+        elif event == "presets":
+            self.last_presets = data
+        elif event in ("suggestion_partial", "suggestions_ready"):
+            if self.completion is not None:
+                self.completion.handle(event, *data)
+        elif message.get("id") in self.predicting:
+            self.predicted.emit(self.predicting.pop(message["id"]), data or [])
+        elif message.get("id") in self.tasks:
+            task = self.tasks[message["id"]]
+            if event in ("finished", "error"):
+                del self.tasks[message["id"]]
+            task.handle(event, data)
+        elif event == "error":
+            print(f"Engine: {data}")
+
+    def _handle_disconnected(self):
+        print("Lost the connection to the engine daemon")
+        for task in list(self.tasks.values()):
+            task.handle("error", "engine disconnected")
+        self.tasks.clear()
+        self.predicting.clear()
+        with self.lock:
+            self.unsent = []
+        self.ready.emit(False)
+
+    def submit(self, task, request):
+        request_id = next(self.ids)
+        self.tasks[request_id] = task
+        self.send(dict(request, id=request_id))
+        return request_id
+
+    def start(self):
+        self.send({"method": "hello"})
+
+    def pipeline(self, parent=None):
+        self.completion = RemotePipeline(self, parent)
+        return self.completion
+
+    def rephrase(self, text, instructions, regenerate=False, parent=None):
+        return RemoteTask(self, {"method": "rephrase", "text": text,
+                                 "instructions": instructions, "regenerate": regenerate}, parent)
+
+    def write(self, request, long_form=False, regenerate=False, parent=None):
+        return RemoteTask(self, {"method": "write", "request": request,
+                                 "long_form": long_form, "regenerate": regenerate}, parent)
+
+    def presets(self):
+        return self.last_presets
+
+    def prefetch(self, text):
+        self.send({"method": "prefetch", "text": text})
+
+    def cancel_prefetch(self):
+        self.send({"method": "cancel_prefetch"})
+
+    def request_predictions(self, text):
+        # Never waited for: the keystroke that asked goes on being handled
+        request_id = next(self.ids)
+        self.predicting[request_id] = text
+        self.send({"method": "predict", "id": request_id, "text": text})
+
+    def learn(self, text):
+        self.send({"method": "learn", "text": text})
+
+    def record_paste(self, trigger, seconds):
+        self.send({"method": "record_paste", "trigger": trigger, "seconds": seconds})
+
+    def record_stall(self, milliseconds, slot, where):
+        self.send({"method": "record_stall", "ms": milliseconds, "slot": slot, "at": where})
+
+    def stats(self):
+        # The previous reply; the next one is on its way
+        self.send({"method": "stats"})
+        return self.last_stats
+
+    def close(self):
+        if self.connect_timer is not None:
+            self.connect_timer.stop()
+        if self.sock is None:
+            return
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+class RemotePipeline(QObject):
+    suggestion_partial = pyqtSignal(str, str)
+    suggestions_ready = pyqtSignal(str, list)
+
+    def __init__(self, engine, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.text = None
+
+    def submit(self, text, priority=PRIORITY_SPECULATIVE):
+        self.text = text
+        self.engine.send({"method": "complete", "text": text, "priority": priority})
+
+    def cancel(self):
+        self.text = None
+        self.engine.send({"method": "cancel_complete"})
+
+    def handle(self, event, context, data):
+        # Suggestions already on the wire when the text changed are dropped
+        if context != self.text:
+            return
+        if event == "suggestion_partial":
+            self.suggestion_partial.emit(context, data)
+        else:
+            self.suggestions_ready.emit(context, data)
+
+# Stands in for a ChunkedRephrase or OutlineWriter running in the daemon
+class RemoteTask(QObject):
+    outlined = pyqtSignal(list)
+    section_progress = pyqtSignal(int, str, bool)
+    progress = pyqtSignal(str)
+    finished = pyqtSignal(str)
+
+    def __init__(self, engine, request, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.request = request
+        self.request_id = None
+        self.cancelled = False
+        self.error = None
+        self.settled = ""
+
+    def start(self):
+        self.request_id = self.engine.submit(self, self.request)
+
+    def settled_text(self):
+        return self.settled
+
+    def cancel(self):
+        self.cancelled = True
+        if self.engine.tasks.pop(self.request_id, None) is not None:
+            self.engine.send({"method": "cancel", "target": self.request_id})
+
+    def retire(self):
+        # No jobs run on this side
+        self.cancel()
+        self.deleteLater()
+
+    def handle(self, event, data):
+        if event == "outlined":
+            self.outlined.emit(data)
+        elif event == "section_progress":
+            self.section_progress.emit(*data)
+        elif event == "settled":
+            self.settled = data
+        elif event == "progress":
+            self.progress.emit(data)
+        elif event == "finished":
+            self.error = data["error"]
+            self.finished.emit(data["text"])
+        elif event == "error":
+            self.error = data
+            self.finished.emit("")
+
+def run_engine(calibrate=False):
+    # The daemon: an Engine served on ENGINE_SOCKET until SIGINT or SIGTERM
+    app = QCoreApplication(sys.argv[:1])
+    engine = Engine(load_config(), calibrate=calibrate)
+    try:
+        server = EngineServer(engine)
+    except OSError as e:
+        print(f"Engine not started: {e}")
+        engine.close()
+        return 1
+    engine.ready.connect(lambda ok: print("Engine ready" if ok else
+                                          "Engine running, but the model is unavailable"))
+    if calibrate:
+        engine.calibrated.connect(lambda model, speed: print(json.dumps({"model": model, **speed})))
+    signal.signal(signal.SIGINT, lambda *_: app.quit())
+    signal.signal(signal.SIGTERM, lambda *_: app.quit())
+    # Python only runs signal handlers between bytecodes, so wake it regularly
+    wakeup = QTimer()
+    wakeup.timeout.connect(lambda: None)
+    wakeup.start(200)
+    print(f"Quill engine listening on {server.path}", flush=True)
+    engine.start()
+    code = app.exec_()
+    server.close()
+    engine.close()
+    return code
+
+# Every widget's look, parsed once for the whole application. Widgets pick
+# their rules by object name. Rules for what sits inside a container come
+# after the container's rules, which they override at equal specificity.
+THEME = """
+#panel, #panel QWidget, #dialog, #dialog QWidget {
+    background-color: rgba(40, 44, 52, 0.95);
+    border-radius: 20px;
+    border: 1px solid #3d3d3d;
+}
+#popup, #popup QWidget {
+    background-color: rgba(40, 44, 52, 0.95);
+    border-radius: 10px;
+    border: 1px solid #3d3d3d;
+}
+#dialog QTextEdit {
+    background-color: rgba(55, 60, 70, 0.95);
+    color: white;
+    border: none;
+    border-radius: 12px;
+    padding: 15px;
+    font-size: 14px;
+}
+#popup QTextEdit {
+    background-color: rgba(55, 60, 70, 0.95);
+    color: white;
+    border: none;
+    border-radius: 8px;
+    padding: 8px;
+}
+#dialog QCheckBox, #popup QCheckBox {
+    color: #ffffff;
+    border: none;
+    background: transparent;
+}
+#overlay, #overlay QWidget, #popup #overlay, #dialog #overlay {
+    background-color: rgba(0, 0, 0, 180);
+    border-radius: 20px;
+}
+#overlay QProgressBar {
+    border: 2px solid grey;
+    border-radius: 5px;
+    text-align: center;
+    background-color: #1a1a1a;
+}
+#overlay QProgressBar::chunk {
+    background-color: #4a9eff;
+    width: 10px;
+    margin: 0.5px;
+}
+#overlay QLabel {
+    color: white;
+    font-size: 14px;
+}
+#sections QLabel {
+    color: #ffffff;
+    font-size: 12px;
+    border: none;
+    background: transparent;
+}
+#sections QProgressBar {
+    border: 1px solid grey;
+    border-radius: 5px;
+    text-align: center;
+    color: white;
+    background-color: #1a1a1a;
+    max-height: 14px;
+}
+#sections QProgressBar::chunk {
+    background-color: #4a9eff;
+}
+#suggestions QListWidget {
+    background-color: rgba(40, 44, 52, 0.95);
+    color: white;
+    border-radius: 5px;
+    border: 1px solid #3d3d3d;
+    padding: 5px;
+}
+#suggestions QListWidget::item {
+    padding: 8px;
+    border-radius: 4px;
+}
+#suggestions QListWidget::item:selected {
+    background-color: #4a9eff;
+    color: white;
+}
+#suggestions QListWidget::item:hover {
+    background-color: #3d8ce4;
+}
+QLabel#title {
+    color: #ffffff;
+    font-family: 'Segoe UI', Arial;
+    font-size: 18px;
+    font-weight: bold;
+    padding: 8px;
+}
+QLabel#dialogTitle {
+    color: #ffffff;
+    font-size: 16px;
+    font-weight: bold;
+}
+QLabel#popupTitle {
+    color: #ffffff;
+    font-size: 14px;
+    font-weight: bold;
+}
+QLabel#status {
+    color: #8f9aab;
+    font-size: 14px;
+    padding: 10px;
+    background-color: rgba(55, 60, 70, 0.95);
+    border-radius: 8px;
+    min-height: 20px;
+}
+QPushButton#close, QPushButton#popupClose {
+    background-color: transparent;
+    color: #ffffff;
+    font-size: 20px;
+    border: none;
+    border-radius: 15px;
+}
+QPushButton#popupClose {
+    font-size: 18px;
+    border-radius: 12px;
+}
+QPushButton#close:hover, QPushButton#popupClose:hover {
+    background-color: #ff4455;
+}
+QPushButton#autoWrite, QPushButton#rephrase, QPushButton#complete, QPushButton#generate {
+    color: white;
+    border: none;
+    border-radius: 12px;
+    padding: 15px;
+    font-size: 16px;
+    font-weight: bold;
+}
+QPushButton#generate {
+    min-height: 50px;
+}
+QPushButton#autoWrite, QPushButton#generate {
+    background-color: #4a9eff;
+}
+QPushButton#autoWrite:hover, QPushButton#generate:hover {
+    background-color: #3d8ce4;
+}
+QPushButton#autoWrite:pressed {
+    background-color: #3278c7;
+}
+QPushButton#rephrase {
+    background-color: #45a165;
+}
+QPushButton#rephrase:hover {
+    background-color: #3d8956;
+}
+QPushButton#rephrase:pressed {
+    background-color: #357a4b;
+}
+QPushButton#complete {
+    background-color: #9b59b6;
+}
+QPushButton#complete:hover {
+    background-color: #8e44ad;
+}
+QPushButton#complete:pressed {
+    background-color: #7d3c98;
+}
+QPushButton#rephraseRun, QPushButton#useNow {
+    color: white;
+    border: none;
+    border-radius: 8px;
+    padding: 8px;
+    font-size: 14px;
+    font-weight: bold;
+}
+QPushButton#rephraseRun {
+    background-color: #4a9eff;
+}
+QPushButton#rephraseRun:hover {
+    background-color: #3d8ce4;
+}
+QPushButton#useNow {
+    background-color: #45a165;
+}
+QPushButton#useNow:hover {
+    background-color: #3d8956;
+}
+QPushButton#preset {
+    background-color: rgba(55, 60, 70, 0.95);
+    color: #ffffff;
+    border: 1px solid #4a9eff;
+    border-radius: 8px;
+    padding: 4px 8px;
+    font-size: 12px;
+}
+QPushButton#preset:hover {
+    background-color: #3d8ce4;
+}
+"""
+
+UI_HEARTBEAT_MS = 16  # one frame at 60 Hz
+
+# Watches the GUI thread's event loop. A timer beats every frame, and how late
+# each beat fires is the lag every event saw, repaints included. When a beat
+# is overdue by half of stall_ms, a watchdog thread samples the GUI thread's
+# stack, so a stall is reported with the slot that was running.
+class UiMonitor(QObject):
+    stalled = pyqtSignal(float, str, str)  # ms, slot, innermost function
+
+    def __init__(self, stall_ms=100, window=1000, parent=None):
+        super().__init__(parent)
+        self.stall_ms = stall_ms
+        self.lags = deque(maxlen=window)
+        self.stalls = 0
+        self.last_stall = None
+        self.suspect = None  # (slot, where) sampled during the current beat
+        self.running = False
+        self.gui_thread = get_ident()
+        self.last_beat = time.perf_counter()
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self._beat)
+
+    def start(self):
+        self.running = True
+        self.last_beat = time.perf_counter()
+        self.timer.start(UI_HEARTBEAT_MS)
+        Thread(target=self._watch, name="quill-ui-monitor", daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.timer.stop()
+
+    def _beat(self):
+        now = time.perf_counter()
+        lag = max(0.0, (now - self.last_beat) * 1000 - UI_HEARTBEAT_MS)
+        self.last_beat = now
+        self.lags.append(lag)
+        suspect, self.suspect = self.suspect, None
+        if lag >= self.stall_ms:
+            slot, where = suspect or ("event loop", "")
+            self.stalls += 1
+            self.last_stall = (lag, slot)
+            self.stalled.emit(lag, slot, where)
+
+    def _watch(self):
+        while self.running:
+            time.sleep(self.stall_ms / 4000)
+            overdue = (time.perf_counter() - self.last_beat) * 1000 - UI_HEARTBEAT_MS
+            if self.suspect is None and overdue >= self.stall_ms / 2:
+                self.suspect = self.sample()
+
+    def sample(self):
+        # The outermost frame below the event loop is the slot Qt called
+        frame = sys._current_frames().get(self.gui_thread)
+        stack = []
+        while frame is not None:
+            stack.append(frame)
+            frame = frame.f_back
+        stack = [f for f in reversed(stack) if f.f_code.co_name not in ("<module>", "main")]
+        if not stack:
+            return None
+        return describe_frame(stack[0]), describe_frame(stack[-1])
+
+    def stats(self):
+        return {"lag_ms": percentiles(list(self.lags)), "stalls": self.stalls,
+                "last_stall": self.last_stall}
+
+def describe_frame(frame):
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
 class LoadingOverlay(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.setStyleSheet("""
-            QWidget {
-                background-color: rgba(0, 0, 0, 180);
-                border-radius: 20px;
-            }
-        """)
+        self.setObjectName("overlay")
+        # A plain QWidget subclass only paints a styled background when asked
+        self.setAttribute(Qt.WA_StyledBackground)
         layout = QVBoxLayout(self)
         
         # Progress bar
         self.progress = QProgressBar()
-        self.progress.setStyleSheet("""
-            QProgressBar {
-                border: 2px solid grey;
-                border-radius: 5px;
-                text-align: center;
-                background-color: #1a1a1a;
-            }
-            QProgressBar::chunk {
-                background-color: #4a9eff;
-                width: 10px;
-                margin: 0.5px;
-            }
-        """)
         self.progress.setMinimum(0)
         self.progress.setMaximum(0)
         layout.addWidget(self.progress)
         
         # Loading text
         self.label = QLabel("Generating...")
-        self.label.setStyleSheet("color: white; font-size: 14px;")
         self.label.setAlignment(Qt.AlignCenter)
         layout.addWidget(self.label)
 
+# One progress bar per section while OutlineWriter works, counting words
+class SectionProgress(QWidget):
+    def __init__(self, expected_words=200, parent=None):
+        super().__init__(parent)
+        self.expected_words = expected_words
+        self.setObjectName("sections")
+        self.layout = QVBoxLayout(self)
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        self.rows = []  # (label, bar), built as needed and reused
+        self.bars = []
+
+    def set_sections(self, titles):
+        while len(self.rows) < len(titles):
+            label, bar = QLabel(), QProgressBar()
+            self.layout.addWidget(label)
+            self.layout.addWidget(bar)
+            self.rows.append((label, bar))
+        for index, (label, bar) in enumerate(self.rows):
+            used = index < len(titles)
+            label.setVisible(used)
+            bar.setVisible(used)
+            if used:
+                label.setText(titles[index] or "Text")
+                bar.setMaximum(self.expected_words)
+                bar.setValue(0)
+                bar.setFormat("queued")
+        self.bars = [bar for _, bar in self.rows[:len(titles)]]
+
+    def update_section(self, index, text, finished):
+        bar = self.bars[index]
+        words = len(text.split())
+        if finished:
+            bar.setMaximum(max(words, 1))
+            bar.setValue(max(words, 1))
+            bar.setFormat(f"done, {words} words")
+        else:
+            bar.setValue(min(words, bar.maximum()))
+            bar.setFormat(f"{words} words")
+
+def looks_like_secret(token):
+    # Long tokens mixing three or more character classes are probably
+    # passwords or keys, which should never be sent to the model
+    if len(token) < 8:
+        return False
+    classes = (any(c.islower() for c in token) + any(c.isupper() for c in token)
+               + any(c.isdigit() for c in token) + any(not c.isalnum() for c in token))
+    return classes >= 3
+
+# Decides when a completion is worth asking for. It keeps moving averages of
+# the gap between keystrokes and of how long suggestions take to show, treats
+# a gap well above the user's usual one as a pause, and skips contexts where a
+# suggestion would be useless anyway.
+class TriggerPolicy:
+    def __init__(self, min_chars=12, min_pause=0.25, max_pause=1.2):
+        self.min_chars = min_chars
+        self.min_pause = min_pause
+        self.max_pause = max_pause
+        self.key_interval = 0.2  # seconds between keystrokes
+        self.latency = 0.5       # seconds from trigger to first suggestion
+        self.last_key = None
+        self.last_fired = None
+        self.boundaries = 0      # spaces and line breaks, i.e. triggers under the old policy
+        self.fired = 0
+        self.skipped = {}
+
+    def note_key(self, when, boundary=False):
+        if self.last_key is not None and when - self.last_key < 2.0:
+            self.key_interval += 0.2 * (when - self.last_key - self.key_interval)
+        self.last_key = when
+        if boundary:
+            self.boundaries += 1
+
+    def note_latency(self, seconds):
+        self.latency += 0.3 * (seconds - self.latency)
+
+    def pause(self):
+        # A slow model needs a longer pause: a suggestion requested while the
+        # user is still typing is out of date by the time it arrives
+        return min(self.max_pause, max(self.min_pause, 2.5 * self.key_interval + 0.25 * self.latency))
+
+    def check(self, text):
+        stripped = text.rstrip()
+        if len(stripped) < self.min_chars or len(stripped.split()) < 2:
+            return "short"
+        if text[-1].isalnum():
+            return "mid_token"
+        if looks_like_secret(stripped.split()[-1]):
+            return "password"
+        if text == self.last_fired:
+            return "duplicate"
+        return None
+
+    def decide(self, text):
+        reason = self.check(text)
+        if reason is not None:
+            self.skipped[reason] = self.skipped.get(reason, 0) + 1
+            return False
+        self.fired += 1
+        self.last_fired = text
+        return True
+
+    def stats(self):
+        return {
+            "boundaries": self.boundaries,
+            "fired": self.fired,
+            "skipped": dict(self.skipped),
+            "calls_saved": max(0, self.boundaries - self.fired),
+            "key_interval_ms": round(self.key_interval * 1000, 1),
+            "latency_ms": round(self.latency * 1000, 1),
+            "pause_ms": round(self.pause() * 1000, 1),
+        }
+
+# Turns keystroke events from KeyboardMonitor into completion triggers. In
+# adaptive mode a sentence end fires at once and anything else waits for a
+# pause; in "space" mode every space fires, as Quill originally did.
+class AdaptiveTrigger(QObject):
+    triggered = pyqtSignal(str)
+
+    def __init__(self, text_buffer, policy=None, mode="adaptive", parent=None):
+        super().__init__(parent)
+        self.text_buffer = text_buffer
+        self.policy = policy or TriggerPolicy()
+        self.mode = mode
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.fire)
+        self.fired_text = None
+        self.fired_at = None
+
+    @pyqtSlot(float, str)
+    def handle_key(self, when, kind):
+        boundary = kind in ("space", "sentence")
+        self.policy.note_key(when, boundary)
+        self.timer.stop()
+        if self.mode != "adaptive":
+            if boundary:
+                self.fire()
+        elif kind == "sentence":
+            self.fire()
+        else:
+            self.timer.start(int(self.policy.pause() * 1000))
+
+    def fire(self):
+        text = self.text_buffer.get()
+        if self.mode == "adaptive":
+            if not self.policy.decide(text):
+                return
+        elif not text.strip():
+            return
+        else:
+            self.policy.fired += 1
+        self.fired_text = text
+        self.fired_at = time.perf_counter()
+        self.triggered.emit(text)
+
+    def handle_suggestion(self, context):
+        # First suggestion for the latest trigger tells us how slow the model is
+        if context == self.fired_text and self.fired_at is not None:
+            self.policy.note_latency(time.perf_counter() - self.fired_at)
+            self.fired_at = None
+
+KEY_POLL_INTERVAL = 0.01  # seconds between reads of the capture process's ring
+
+# Follows what the user types. By default the keyboard hook runs in the
+# keycapture.py process and this thread reads its shared-memory ring in
+# batches; each read is one slice copy, so the thread holds the GIL only
+# briefly. With capture="thread", or when that process can't start, the hook
+# runs on this thread instead.
 class KeyboardMonitor(QThread):
-    text_captured = pyqtSignal(str)
+    typed = pyqtSignal(float, str)  # time, "char" / "space" / "sentence" / "edit"
+    listening = pyqtSignal()
+    failed = pyqtSignal(str)  # no way to capture keys at all
     
-    def __init__(self, text_buffer):
+    def __init__(self, text_buffer, capture="process"):
         super().__init__()
         self.running = True
         self.text_buffer = text_buffer
+        self.capture = capture
+        self.ring = None
+        self.ignored = (0.0, 0.0)  # keys pressed in this span were sent by Quill
         
     def run(self):
+        process = None
+        if self.capture == "process":
+            try:
+                self.ring = keycapture.KeyRing.create()
+                process = keycapture.spawn(self.ring)
+            except OSError as e:
+                print(f"Capturing keys in the window, the capture process failed to start: {e}")
+                if self.ring is not None:
+                    self.ring.close()
+                    self.ring = None
+        if process is None:
+            self.listen()
+            return
+        try:
+            listening = self.drain(process)
+        finally:
+            self.ring.set_state(keycapture.STOPPING)
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            self.ring.close()
+            self.ring = None
+        if self.running and not listening:
+            # It never hooked the keyboard, e.g. pynput or the display is missing
+            print("Capturing keys in the window, the capture process exited before listening")
+            self.listen()
+
+    def drain(self, process):
+        # Returns whether the process got as far as hooking the keyboard
+        listening = False
+        while self.running and process.poll() is None:
+            if not listening and self.ring.state() == keycapture.LISTENING:
+                listening = True
+                self.listening.emit()
+            for when, char, name in self.ring.read():
+                self.handle_key(char, name, when)
+            time.sleep(KEY_POLL_INTERVAL)
+        if self.running and process.returncode:
+            print(f"Keystroke capture stopped with exit code {process.returncode}")
+        return listening or self.ring.state() == keycapture.LISTENING
+
+    def listen(self):
+        try:
+            from pynput import keyboard
+        except ImportError as e:
+            # pynput reports a missing display or backend this way too
+            print(f"Keystrokes can't be captured: {e}")
+            self.failed.emit(str(e))
+            return
+
         def on_press(key):
             if not self.running:
                 return False
-                
-            try:
-                if hasattr(key, 'char') and key.char:
-                    self.text_buffer.append(key.char)
-                elif key == keyboard.Key.space:
-                    buffer_content = self.text_buffer.get()
-                    if buffer_content:
-                        self.text_captured.emit(buffer_content)
-            except AttributeError:
-                pass
+            # Special keys have a name (Key.space.name == "space"), others a char
+            self.handle_key(getattr(key, 'char', None), getattr(key, 'name', None))
 
         with keyboard.Listener(on_press=on_press) as listener:
+            self.listening.emit()
             listener.join()
 
+    def handle_key(self, char=None, name=None, when=None):
+        # Kept free of pynput types so recorded keystrokes can be replayed;
+        # when is the time the key was pressed, if it was captured elsewhere
+        when = when or time.perf_counter()
+        if self.ignored[0] <= when <= self.ignored[1]:
+            return
+        if char:
+            # Ctrl shortcuts arrive as control characters; skip them
+            if not char.isprintable():
+                return
+            self.text_buffer.append(char)
+            kind = "char"
+        elif name == "space":
+            self.text_buffer.append(" ")
+            previous = self.text_buffer.tail(2)[:-1]
+            kind = "sentence" if previous and previous in SENTENCE_END else "space"
+        elif name == "enter":
+            self.text_buffer.append("\n")
+            kind = "sentence"
+        elif name == "tab":
+            self.text_buffer.append("\t")
+            kind = "space"
+        elif name == "backspace":
+            self.text_buffer.backspace()
+            kind = "edit"
+        elif name == "delete":
+            self.text_buffer.delete()
+            kind = "edit"
+        elif name == "left":
+            self.text_buffer.move_cursor(-1)
+            kind = "edit"
+        elif name == "right":
+            self.text_buffer.move_cursor(1)
+            kind = "edit"
+        elif name in ("up", "down", "home", "end", "page_up", "page_down"):
+            # The caret jumped somewhere we can't follow, so the text
+            # we hold no longer sits right before it
+            self.text_buffer.clear()
+            kind = "edit"
+        else:
+            return
+        self.typed.emit(when, kind)
+
+    def ignore(self, start, end):
+        self.ignored = (start, end)
+
+    def stop(self):
+        self.running = False
+
+FOCUS_POLL_INTERVAL = 0.5  # seconds between checks of the focused window
+XPROP_LINE = re.compile(r"^(\w+)\([^)]*\) = (.*)$")
+
+def focused_window_x11():
+    try:
+        active = subprocess.run(["xprop", "-root", "_NET_ACTIVE_WINDOW"], capture_output=True,
+                                text=True, timeout=1).stdout
+        window = active.split()[-1]
+        if not window.startswith("0x") or int(window, 16) == 0:
+            return None
+        output = subprocess.run(["xprop", "-id", window, "_NET_WM_PID", "WM_CLASS", "_NET_WM_NAME"],
+                                capture_output=True, text=True, timeout=1).stdout
+    except (OSError, subprocess.SubprocessError, ValueError, IndexError):
+        return None
+    properties = {}
+    for line in output.splitlines():
+        match = XPROP_LINE.match(line)
+        if match:
+            properties[match.group(1)] = match.group(2)
+    pid = properties.get("_NET_WM_PID", "")
+    # WM_CLASS is "instance", "Class"; the class names the application
+    app = properties.get("WM_CLASS", "").split(", ")[-1].strip('"')
+    title = properties.get("_NET_WM_NAME", "").strip('"')
+    return (int(pid) if pid.isdigit() else None), app, title
+
+def focused_window_windows():
+    import ctypes
+    from ctypes import wintypes
+    user32, kernel32 = ctypes.windll.user32, ctypes.windll.kernel32
+    window = user32.GetForegroundWindow()
+    if not window:
+        return None
+    pid = wintypes.DWORD()
+    user32.GetWindowThreadProcessId(window, ctypes.byref(pid))
+    length = user32.GetWindowTextLengthW(window)
+    title = ctypes.create_unicode_buffer(length + 1)
+    user32.GetWindowTextW(window, title, length + 1)
+    app = ""
+    process = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+    if process:
+        path = ctypes.create_unicode_buffer(260)
+        size = wintypes.DWORD(len(path))
+        if kernel32.QueryFullProcessImageNameW(process, 0, path, ctypes.byref(size)):
+            app = os.path.basename(path.value)
+        kernel32.CloseHandle(process)
+    return pid.value, app, title.value
+
+def focused_window_macos():
+    from AppKit import NSWorkspace
+    app = NSWorkspace.sharedWorkspace().frontmostApplication()
+    if app is None:
+        return None
+    # Window titles need the accessibility permission, so only the app is known
+    return app.processIdentifier(), app.localizedName() or "", ""
+
+def focus_probe():
+    # How to find the focused window on this platform, or None: Linux needs
+    # xprop and an X11 session, macOS needs pyobjc
+    if sys.platform == "win32":
+        return focused_window_windows
+    if sys.platform == "darwin":
+        try:
+            import AppKit  # noqa: F401
+        except ImportError:
+            return None
+        return focused_window_macos
+    if os.environ.get("DISPLAY") and shutil.which("xprop"):
+        return focused_window_x11
+    return None
+
+# Reports which application (or, with scope="window", which window) has focus,
+# as a key for ContextBuffers. Quill's own windows don't count, so typing an
+# Auto Write request keeps the previous context. feed() switches by hand, for
+# tests and recorded traces, or where the platform can't be asked.
+class FocusWatcher(QThread):
+    focus_changed = pyqtSignal(str)  # context key
+
+    def __init__(self, scope="application", probe=None, interval=FOCUS_POLL_INTERVAL):
+        super().__init__()
+        self.scope = scope
+        self.probe = probe or focus_probe()
+        self.interval = interval
+        self.running = True
+        self.current = None
+
+    def run(self):
+        if self.probe is None:
+            print("Can't tell which window has focus here; every application shares one context")
+            return
+        while self.running:
+            window = self.probe()
+            if window is not None and window[0] != os.getpid():
+                self.feed(self.key(window))
+            time.sleep(self.interval)
+
+    def key(self, window):
+        _, app, title = window
+        return f"{app}: {title}" if self.scope == "window" else app
+
+    def feed(self, key):
+        if key != self.current:
+            self.current = key
+            self.focus_changed.emit(key)
+
     def stop(self):
         self.running = False
 
+INSERT_ECHO = 0.1  # seconds after an insertion during which the hook may still see its keys
+
+# Qt's clipboard belongs to the GUI thread. The insertion thread reaches it
+# through a blocking queued call, so the GUI thread keeps serving clipboard
+# requests from other applications in between.
+class ClipboardAccess(QObject):
+    request = pyqtSignal(object)
+
+    def __init__(self, clipboard):
+        super().__init__()
+        self.clipboard = clipboard
+        self.request.connect(self._run, Qt.BlockingQueuedConnection)
+
+    def _run(self, call):
+        call()
+
+    def call(self, function):
+        if QThread.currentThread() is self.thread():
+            return function()
+        result = []
+        self.request.emit(lambda: result.append(function()))
+        return result[0]
+
+    def save(self):
+        # Every format the clipboard holds, not just its text
+        data = self.clipboard.mimeData()
+        saved = QMimeData()
+        for name in data.formats():
+            saved.setData(name, data.data(name))
+        return saved
+
+    def set_text(self, text):
+        self.clipboard.setText(text)
+
+    def restore(self, saved, pasted):
+        # Unless the user copied something else meanwhile
+        if self.clipboard.text() != pasted:
+            return
+        if saved.formats():
+            self.clipboard.setMimeData(saved)
+        else:
+            self.clipboard.clear()
+
+# Sends the text as key presses through pynput. Fine for short text; longer
+# text takes a while in applications that handle every key slowly.
+class TypingInserter:
+    name = "typing"
+
+    def __init__(self):
+        self.keyboard = None
+
+    def available(self):
+        return importlib.util.find_spec("pynput") is not None
+
+    def controller(self):
+        if self.keyboard is None:
+            from pynput.keyboard import Controller
+            self.keyboard = Controller()
+        return self.keyboard
+
+    def insert(self, text):
+        self.controller().type(text)
+
+    def erase(self, count):
+        from pynput.keyboard import Key
+        keyboard = self.controller()
+        for _ in range(count):
+            keyboard.press(Key.backspace)
+            keyboard.release(Key.backspace)
+
+    def idle(self):
+        pass
+
+# Pastes with Ctrl+V (Cmd+V on macOS). The user's clipboard is saved before
+# the first paste and put back once nothing has been inserted for a moment.
+class ClipboardInserter(TypingInserter):
+    name = "clipboard"
+
+    def __init__(self, clipboard):
+        super().__init__()
+        self.clipboard = clipboard
+        self.saved = None
+        self.pasted = None
+
+    def insert(self, text):
+        from pynput.keyboard import Key
+        if self.saved is None:
+            self.saved = self.clipboard.call(self.clipboard.save)
+        self.pasted = text
+        self.clipboard.call(lambda: self.clipboard.set_text(text))
+        keyboard = self.controller()
+        modifier = Key.cmd if sys.platform == "darwin" else Key.ctrl
+        with keyboard.pressed(modifier):
+            keyboard.press("v")
+            keyboard.release("v")
+
+    def idle(self):
+        if self.saved is not None:
+            saved, pasted = self.saved, self.pasted
+            self.saved = None
+            self.clipboard.call(lambda: self.clipboard.restore(saved, pasted))
+
+# Sends the characters themselves, the way an input method delivers text,
+# independent of the keyboard layout: one SendInput call on Windows, CGEvent
+# Unicode strings on macOS, wtype on Wayland and xdotool on X11.
+class UnicodeInserter(TypingInserter):
+    name = "unicode"
+
+    def available(self):
+        if sys.platform == "win32":
+            return True
+        if sys.platform == "darwin":
+            return importlib.util.find_spec("Quartz") is not None
+        return self.command() is not None
+
+    def command(self):
+        if os.environ.get("WAYLAND_DISPLAY") and shutil.which("wtype"):
+            return ["wtype", "-"]
+        if os.environ.get("DISPLAY") and shutil.which("xdotool"):
+            return ["xdotool", "type", "--delay", "0", "--file", "-"]
+        return None
+
+    def insert(self, text):
+        if sys.platform == "win32":
+            send_unicode_windows(text)
+        elif sys.platform == "darwin":
+            send_unicode_macos(text)
+        else:
+            subprocess.run(self.command(), input=text, text=True, check=True, timeout=60)
+
+def send_unicode_windows(text):
+    import ctypes
+    from ctypes import wintypes
+
+    class KEYBDINPUT(ctypes.Structure):
+        _fields_ = [("wVk", wintypes.WORD), ("wScan", wintypes.WORD), ("dwFlags", wintypes.DWORD),
+                    ("time", wintypes.DWORD), ("dwExtraInfo", ctypes.c_size_t)]
+
+    class INPUT(ctypes.Structure):
+        # type, then the union of mouse, keyboard and hardware input; the
+        # mouse one is the largest, 8 bytes longer than the keyboard one
+        _fields_ = [("type", wintypes.DWORD), ("ki", KEYBDINPUT), ("padding", ctypes.c_ubyte * 8)]
+
+    KEYUP, UNICODE, RETURN = 0x2, 0x4, 0x0D
+    keys = []
+    for char in text.replace("\r\n", "\n"):
+        if char == "\n":
+            # Applications take a Unicode newline inconsistently; Enter works everywhere
+            keys += [(RETURN, 0, 0), (RETURN, 0, KEYUP)]
+            continue
+        encoded = char.encode("utf-16-le")
+        for unit in struct.unpack(f"<{len(encoded) // 2}H", encoded):
+            keys += [(0, unit, UNICODE), (0, unit, UNICODE | KEYUP)]
+    inputs = (INPUT * len(keys))(*(INPUT(1, KEYBDINPUT(vk, scan, flags, 0, 0))
+                                   for vk, scan, flags in keys))
+    sent = ctypes.windll.user32.SendInput(len(keys), inputs, ctypes.sizeof(INPUT))
+    if sent != len(keys):
+        raise OSError(f"SendInput took {sent} of {len(keys)} key events")
+
+def send_unicode_macos(text):
+    import Quartz
+    # One keyboard event carries at most 20 UTF-16 code units
+    pieces, piece, units = [], "", 0
+    for char in text:
+        size = len(char.encode("utf-16-le")) // 2
+        if units + size > 20:
+            pieces.append((piece, units))
+            piece, units = "", 0
+        piece += char
+        units += size
+    if piece:
+        pieces.append((piece, units))
+    for piece, units in pieces:
+        for down in (True, False):
+            event = Quartz.CGEventCreateKeyboardEvent(None, 0, down)
+            Quartz.CGEventKeyboardSetUnicodeString(event, units, piece)
+            Quartz.CGEventPost(Quartz.kCGHIDEventTap, event)
+
+INSERTERS = {"clipboard": ClipboardInserter, "typing": TypingInserter, "unicode": UnicodeInserter}
+
+def create_inserter(method, clipboard):
+    if method == "auto":
+        unicode = UnicodeInserter()
+        return unicode if unicode.available() else ClipboardInserter(clipboard)
+    if method == "clipboard":
+        return ClipboardInserter(clipboard)
+    if method not in INSERTERS:
+        raise ValueError(f"unknown insert_method {method!r}")
+    return INSERTERS[method]()
+
+# Puts results into the focused application from its own thread, in order,
+# so the window never waits for the target to take them. Whatever has queued
+# up while the previous insertion ran goes out as one batch. The keyboard
+# monitor is told to skip the keys sent, which it would otherwise take for
+# the user's typing.
+class InsertionEngine(QObject):
+    inserted = pyqtSignal(str, float)  # trigger, seconds from the final text until it was sent
+
+    def __init__(self, method="auto", restore_ms=500, parent=None):
+        super().__init__(parent)
+        self.clipboard = ClipboardAccess(QApplication.clipboard())
+        self.inserter = create_inserter(method, self.clipboard)
+        self.restore_delay = restore_ms / 1000
+        self.monitor = None
+        self.queue = queue.Queue()
+        self.thread = Thread(target=self._work, name="quill-insertion", daemon=True)
+        self.thread.start()
+
+    def insert(self, text, trigger):
+        self.stream(trigger).finish(text)
+
+    def stream(self, trigger):
+        return InsertionStream(self, trigger)
+
+    def _work(self):
+        dirty = False  # something was inserted since the inserter last went idle
+        while True:
+            try:
+                op = self.queue.get(timeout=self.restore_delay if dirty else None)
+            except queue.Empty:
+                self._send(self.inserter.idle)
+                dirty = False
+                continue
+            ops = [op]
+            while ops[-1] is not None:
+                try:
+                    ops.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Erasing part of text not yet sent just means sending less of it
+            erase, text, done = 0, "", []
+            for op in ops:
+                if op is None:
+                    break
+                if op[0] == "insert":
+                    text += op[1]
+                elif op[0] == "erase":
+                    kept = max(0, len(text) - op[1])
+                    erase += op[1] - (len(text) - kept)
+                    text = text[:kept]
+                else:
+                    done.append(op)
+            if erase or text:
+                self._send(self._apply, erase, text)
+                dirty = True
+            for _, trigger, started in done:
+                self.inserted.emit(trigger, time.perf_counter() - started)
+            if ops[-1] is None:
+                if dirty:
+                    self._send(self.inserter.idle)
+                return
+
+    def _apply(self, erase, text):
+        if erase:
+            self.inserter.erase(erase)
+        if text:
+            self.inserter.insert(text)
+
+    def _send(self, call, *args):
+        monitor = self.monitor
+        started = time.perf_counter()
+        if monitor is not None:
+            monitor.ignore(started, float("inf"))
+        try:
+            call(*args)
+        except Exception as e:
+            print(f"Inserting text failed ({self.inserter.name}): {e}")
+        finally:
+            if monitor is not None:
+                monitor.ignore(started, time.perf_counter() + INSERT_ECHO)
+
+    def close(self, timeout=2.0):
+        # Sends what is queued and restores the clipboard first. The thread
+        # may need the GUI thread for the clipboard, so keep serving it.
+        self.queue.put(None)
+        deadline = time.perf_counter() + timeout
+        while self.thread.is_alive() and time.perf_counter() < deadline:
+            QCoreApplication.processEvents()
+            self.thread.join(0.01)
+
+# Text that keeps growing while it is generated. Each update sends what was
+# added since the last one; if earlier text changed, the difference is erased
+# first, so feed it text that mostly grows.
+class InsertionStream:
+    def __init__(self, engine, trigger):
+        self.engine = engine
+        self.trigger = trigger
+        self.sent = ""
+        self.finished = False
+
+    def update(self, text):
+        if self.finished:
+            return
+        common = len(os.path.commonprefix([self.sent, text]))
+        if common < len(self.sent):
+            self.engine.queue.put(("erase", len(self.sent) - common))
+        if common < len(text):
+            self.engine.queue.put(("insert", text[common:]))
+        self.sent = text
+
+    def finish(self, text=None):
+        if text is not None:
+            self.update(text)
+        if not self.finished:
+            self.finished = True
+            self.engine.queue.put(("done", self.trigger, time.perf_counter()))
+
 class SuggestionWidget(QWidget):
+    accepted = pyqtSignal(str)
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowFlags(Qt.ToolTip | Qt.FramelessWindowHint)
         self.setAttribute(Qt.WA_TranslucentBackground)
         
-        self.keyboard = Controller()
-        
         layout = QVBoxLayout(self)
         self.suggestions = QListWidget()
         self.suggestions.itemClicked.connect(self.use_suggestion)
         layout.addWidget(self.suggestions)
         
-        self.setStyleSheet("""
-            QListWidget {
-                background-color: rgba(40, 44, 52, 0.95);
-                color: white;
-                border-radius: 5px;
-                border: 1px solid #3d3d3d;
-                padding: 5px;
-            }
-            QListWidget::item {
-                padding: 8px;
-                border-radius: 4px;
-            }
-            QListWidget::item:selected {
-                background-color: #4a9eff;
-                color: white;
-            }
-            QListWidget::item:hover {
-                background-color: #3d8ce4;
-            }
-        """)
+        self.setObjectName("suggestions")
         
+    def set_suggestion(self, text, others=()):
+        # Streamed updates rewrite the first item in place so the
+        # selection and hover state survive while tokens arrive
+        if (self.suggestions.count() == len(others) + 1
+                and all(self.suggestions.item(i + 1).text() == other
+                        for i, other in enumerate(others))):
+            self.suggestions.item(0).setText(text)
+        else:
+            self.set_suggestions([text, *others])
+
+    def set_suggestions(self, texts):
+        self.suggestions.clear()
+        self.suggestions.addItems(texts)
+
     def use_suggestion(self, item):
+        # Clicking while the suggestion is still streaming accepts it as is
         text = item.text()
-        pyperclip.copy(text)
-        self.keyboard.press(Key.ctrl)
-        self.keyboard.press('v')
-        self.keyboard.release('v')
-        self.keyboard.release(Key.ctrl)
+        self.accepted.emit(text)
+        self.parent().insertion.insert(text, "autocomplete")
         self.hide()
 
 class RephraseWidget(QWidget):
@@ -157,142 +4167,477 @@ class RephraseWidget(QWidget):
         super().__init__(parent)
         self.setWindowFlags(Qt.ToolTip | Qt.FramelessWindowHint)
         self.setAttribute(Qt.WA_TranslucentBackground)
-        self.keyboard = Controller()
+        self.setObjectName("popup")
 
         layout = QVBoxLayout(self)
         
         # Header with close button
         header = QHBoxLayout()
         title = QLabel("Rephrase Text")
-        title.setStyleSheet("""
-            QLabel {
-                color: #ffffff;
-                font-size: 14px;
-                font-weight: bold;
-            }
-        """)
+        title.setObjectName("popupTitle")
         header.addWidget(title)
         
         close_btn = QPushButton("×")
         close_btn.setFixedSize(25, 25)
-        close_btn.clicked.connect(self.hide)
-        close_btn.setStyleSheet("""
-            QPushButton {
-                background-color: transparent;
-                color: #ffffff;
-                font-size: 18px;
-                border: none;
-                border-radius: 12px;
-            }
-            QPushButton:hover {
-                background-color: #ff4455;
-            }
-        """)
+        close_btn.clicked.connect(self.dismiss)
+        close_btn.setObjectName("popupClose")
         header.addWidget(close_btn)
         layout.addLayout(header)
         
+        # The most used instructions, one click each
+        self.presets = QHBoxLayout()
+        self.preset_buttons = []
+        for _ in range(REPHRASE_PRESET_BUTTONS):
+            button = QPushButton()
+            button.setObjectName("preset")
+            button.clicked.connect(lambda checked, button=button: self.apply_preset(button.text()))
+            button.hide()
+            self.presets.addWidget(button)
+            self.preset_buttons.append(button)
+        layout.addLayout(self.presets)
+        
         self.input = QTextEdit()
         self.input.setPlaceholderText("How would you like to rephrase this?")
         self.input.setMinimumWidth(300)
         self.input.setMinimumHeight(100)
         layout.addWidget(self.input)
         
+        # Streamed output shows up here while the model is still generating
+        self.preview = QTextEdit()
+        self.preview.setReadOnly(True)
+        self.preview.setMinimumHeight(100)
+        self.preview.hide()
+        layout.addWidget(self.preview)
+        
         self.rephrase_btn = QPushButton("Rephrase")
-        self.rephrase_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #4a9eff;
-                color: white;
-                border: none;
-                border-radius: 8px;
-                padding: 8px;
-                font-size: 14px;
-                font-weight: bold;
-            }
-            QPushButton:hover {
-                background-color: #3d8ce4;
-            }
-        """)
+        self.rephrase_btn.setObjectName("rephraseRun")
         self.rephrase_btn.clicked.connect(self.rephrase_text)
         layout.addWidget(self.rephrase_btn)
         
-        self.setStyleSheet("""
-            QWidget {
-                background-color: rgba(40, 44, 52, 0.95);
-                border-radius: 10px;
-                border: 1px solid #3d3d3d;
-            }
-            QTextEdit {
-                background-color: rgba(55, 60, 70, 0.95);
-                color: white;
-                border: none;
-                border-radius: 8px;
-                padding: 8px;
-            }
-        """)
+        self.regenerate = QCheckBox("Regenerate instead of reusing a saved result")
+        layout.addWidget(self.regenerate)
+        
+        self.use_btn = QPushButton("Use Now")
+        self.use_btn.setObjectName("useNow")
+        self.use_btn.clicked.connect(self.use_partial_text)
+        self.use_btn.hide()
+        layout.addWidget(self.use_btn)
         
         # Loading overlay
         self.loading_overlay = LoadingOverlay(self)
         self.loading_overlay.hide()
         
+        self.rephrase = None
+        self.rephrase_done = False
+        self.stream = None  # inserting the rest of the rephrasing after Use Now
+        self.selected_text = ""
+        
     def resizeEvent(self, event):
         super().resizeEvent(event)
         self.loading_overlay.resize(self.size())
+
+    def set_selection(self, text, presets):
+        self.selected_text = text
+        for index, button in enumerate(self.preset_buttons):
+            button.setVisible(index < len(presets))
+            if index < len(presets):
+                button.setText(presets[index])
+
+    def apply_preset(self, instructions):
+        self.input.setPlainText(instructions)
+        self.rephrase_text()
+
+    def dismiss(self):
+        # Nobody will pick a prefetched rephrasing now
+        self.parent().engine.cancel_prefetch()
+        self.hide()
         
     def rephrase_text(self):
         self.loading_overlay.show()
+        self.preview.clear()
         instructions = self.input.toPlainText()
-        selected_text = pyperclip.paste()
+        selected_text = self.selected_text
+        if not selected_text:
+            import pyperclip
+            selected_text = pyperclip.paste()
         
-        # Create generation thread
-        self.gen_thread = GenerationThread(
-            self.parent().llm,
-            f"Rephrase the following text: {selected_text}\nInstructions: {instructions}"
-        )
-        self.gen_thread.finished.connect(self.handle_rephrased_text)
-        self.gen_thread.start()
+        # A second click replaces the request instead of running both
+        self.drop_rephrase()
+        self.rephrase_done = False
+        self.stream = None
+        self.rephrase = self.parent().engine.rephrase(
+            selected_text, instructions, regenerate=self.regenerate.isChecked(), parent=self)
+        self.rephrase.progress.connect(self.show_partial_text)
+        self.rephrase.finished.connect(self.handle_rephrased_text)
+        self.rephrase.start()
     
+    def drop_rephrase(self):
+        # Each task holds the whole selection, its chunks and their outputs,
+        # and this widget lives as long as the window
+        if self.rephrase is not None:
+            self.rephrase.retire()
+            self.rephrase = None
+
+    def show_partial_text(self, rephrased):
+        if self.stream is not None:
+            if self.sender() is self.rephrase:
+                self.stream.update(self.rephrase.settled_text())
+            return
+        # First token replaces the spinner with the live preview
+        self.loading_overlay.hide()
+        self.preview.show()
+        self.use_btn.show()
+        self.preview.setPlainText(rephrased)
+
+    def use_partial_text(self):
+        if self.parent().config["insert_streaming"] and not self.rephrase_done:
+            # What is settled goes in now, the rest as it is generated
+            self.stream = self.parent().insertion.stream("rephrase")
+            self.stream.update(self.rephrase.settled_text())
+            self.loading_overlay.hide()
+            self.preview.hide()
+            self.use_btn.hide()
+            self.hide()
+            return
+        self.drop_rephrase()
+        self.paste_text(self.preview.toPlainText())
+
     def handle_rephrased_text(self, rephrased):
-        pyperclip.copy(rephrased)
-        self.keyboard.press(Key.ctrl)
-        self.keyboard.press('v')
-        self.keyboard.release('v')
-        self.keyboard.release(Key.ctrl)
+        rephrase = self.sender()
+        if rephrase is not self.rephrase or rephrase.cancelled:
+            return
+        self.rephrase_done = True
+        self.drop_rephrase()
+        if self.stream is not None:
+            self.stream.finish(rephrased)
+            self.stream = None
+            return
+        if rephrase.error:
+            # Failed chunks kept their original text; let the user decide
+            self.loading_overlay.hide()
+            if rephrased.strip():
+                self.show_partial_text(rephrased)
+            return
+        self.paste_text(rephrased)
+
+    def paste_text(self, rephrased):
+        self.parent().insertion.insert(rephrased, "rephrase")
+        self.loading_overlay.hide()
+        self.preview.hide()
+        self.use_btn.hide()
+        self.hide()
+
+# The Auto Write dialog. It is built once, the first time it opens, and reset
+# every time after.
+class AutoWriteDialog(QWidget):
+    def __init__(self, section_words, parent=None):
+        super().__init__(parent)
+        self.setWindowFlags(Qt.FramelessWindowHint | Qt.Dialog)
+        self.setAttribute(Qt.WA_TranslucentBackground)
+        self.setObjectName("dialog")
+        
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(20, 20, 20, 20)
+        
+        # Header
+        header = QHBoxLayout()
+        title = QLabel("Auto Write")
+        title.setObjectName("dialogTitle")
+        header.addWidget(title)
+        
+        close_btn = QPushButton("×")
+        close_btn.setFixedSize(30, 30)
+        close_btn.setObjectName("close")
+        close_btn.clicked.connect(self.dismiss)
+        header.addWidget(close_btn)
+        layout.addLayout(header)
+        
+        self.text_input = QTextEdit()
+        self.text_input.setPlaceholderText("Enter what you want to write about...")
+        self.text_input.setMinimumHeight(150)
+        layout.addWidget(self.text_input)
+        
+        self.long_form = QCheckBox("Long form: outline first, then write sections in parallel")
+        layout.addWidget(self.long_form)
+        
+        self.regenerate = QCheckBox("Regenerate instead of reusing a saved result")
+        layout.addWidget(self.regenerate)
+        
+        # Per-section progress for long-form writing
+        self.sections = SectionProgress(expected_words=section_words)
+        self.sections.hide()
+        layout.addWidget(self.sections)
+        
+        # Streamed output preview
+        self.preview = QTextEdit()
+        self.preview.setReadOnly(True)
+        self.preview.hide()
+        layout.addWidget(self.preview)
+        
+        # Loading overlay for dialog
+        self.loading_overlay = LoadingOverlay(self)
+        self.loading_overlay.hide()
+        
+        self.generate_btn = QPushButton("Generate")
+        self.generate_btn.setObjectName("generate")
+        self.generate_btn.clicked.connect(self.generate)
+        layout.addWidget(self.generate_btn)
+        
+        self.job = None
+
+    def drop_job(self):
+        # The dialog lives as long as the window, so no job may outlive its use
+        if self.job is not None:
+            self.job.retire()
+            self.job = None
+
+    def open(self):
+        self.drop_job()
+        self.text_input.clear()
+        self.text_input.show()
+        self.long_form.setChecked(False)
+        self.long_form.show()
+        self.regenerate.setChecked(False)
+        self.regenerate.show()
+        self.sections.hide()
+        self.preview.clear()
+        self.preview.hide()
+        self.generate_btn.setText("Generate")
+        self.loading_overlay.hide()
+        self.setFixedSize(500, 330)
+        parent = self.parent()
+        self.move(parent.x() + (parent.width() - self.width()) // 2,
+                  parent.y() + (parent.height() - self.height()) // 2)
+        self.show()
+        self.text_input.setFocus()
+
+    def dismiss(self):
+        # Nothing gets inserted once the dialog is closed
+        self.drop_job()
+        self.hide()
+
+    def show_partial(self, response):
+        self.loading_overlay.hide()
+        self.text_input.hide()
+        self.long_form.hide()
+        self.regenerate.hide()
+        self.preview.show()
+        self.preview.setPlainText(response)
+        self.generate_btn.setText("Insert Now")
+
+    def show_outline(self, titles):
+        # Section bars replace the spinner once the outline is in
+        self.loading_overlay.hide()
+        self.text_input.hide()
+        self.long_form.hide()
+        self.regenerate.hide()
+        self.sections.set_sections(titles)
+        self.sections.show()
+        self.setFixedSize(500, 340 + 40 * len(titles))
+
+    def handle_finished(self, response):
+        job = self.sender()
+        if job is not self.job or job.cancelled:
+            return
+        if job.error:
+            # Whatever was written stays in the preview for Insert Now
+            self.drop_job()
+            self.loading_overlay.hide()
+            return
+        self.insert(response)
+
+    def generate(self):
+        # While streaming, the same button accepts the text generated so far
+        if self.preview.isVisible():
+            self.insert(self.preview.toPlainText())
+            return
+        self.drop_job()
+        self.loading_overlay.show()
+        self.job = self.parent().engine.write(
+            self.text_input.toPlainText(), long_form=self.long_form.isChecked(),
+            regenerate=self.regenerate.isChecked(), parent=self)
+        if self.long_form.isChecked():
+            self.job.outlined.connect(self.show_outline)
+            self.job.section_progress.connect(self.sections.update_section)
+        self.job.progress.connect(self.show_partial)
+        self.job.finished.connect(self.handle_finished)
+        self.job.start()
+
+    def insert(self, response):
+        # Hidden first, so the text goes to the application underneath
+        self.drop_job()
         self.loading_overlay.hide()
         self.hide()
+        self.parent().insertion.insert(response, "auto_write")
 
 class FloatingAssistant(QMainWindow):
-    def __init__(self):
+    def __init__(self, startup=None, startup_report=False, calibrate=False):
         super().__init__()
         self.setWindowTitle("Writing Assistant")
         self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint)
         self.setAttribute(Qt.WA_TranslucentBackground)
-        self.keyboard = Controller()
+        self.startup = startup or StartupTimer()
+        self.startup_report = startup_report
+        self.calibrate = calibrate
         
-        # Initialize Ollama
-        self.llm = Ollama(model="hf.co/bartowski/SmolLM2-360M-Instruct-GGUF:Q5_K_S")  # Use your preferred model
+        self.config = load_config()
+        # Parsed once here, not by every widget and dialog
+        QApplication.instance().setStyleSheet(THEME)
         
-        # Initialize text buffer
-        self.text_buffer = TextBuffer(max_size=2000)  # Stores last 2000 characters
+        # The model, caches and scheduler live in the engine: the shared daemon
+        # when one is running, otherwise one in this window. Calibration always
+        # runs here so its results can be printed.
+        with self.startup.phase("engine"):
+            # "auto" uses a running daemon, "daemon" starts one first if needed
+            mode = None if calibrate else self.config["engine"]
+            sock = open_engine_socket() if mode in ("auto", "daemon") else None
+            if sock is not None:
+                self.engine = RemoteEngine(self.config, sock, parent=self)
+            elif mode == "daemon" and spawn_engine():
+                # Requests wait for the new daemon to listen; the window doesn't
+                self.engine = RemoteEngine(self.config, parent=self)
+                self.engine.connect_later()
+            else:
+                self.engine = Engine(self.config, self.startup, calibrate, parent=self)
+            if isinstance(self.engine, RemoteEngine):
+                self.engine.disconnected.connect(
+                    lambda: self.status.setText("Engine stopped - restart Quill"))
+        self.engine.ready.connect(self.handle_engine_ready)
+        self.engine.predicted.connect(self.show_local_predictions)
+        self.engine.calibrated.connect(self.handle_calibrated)
         
-        # Initialize widgets
-        self.suggestion_widget = SuggestionWidget(self)
-        self.rephrase_widget = RephraseWidget(self)
+        # Results go into the focused application from a thread of their own
+        self.insertion = InsertionEngine(self.config["insert_method"],
+                                         restore_ms=self.config["insert_restore_ms"], parent=self)
+        self.insertion.inserted.connect(self.engine.record_paste)
         
-        # Initialize keyboard monitor with text buffer
-        self.keyboard_monitor = KeyboardMonitor(self.text_buffer)
-        self.keyboard_monitor.text_captured.connect(self.handle_text_capture)
-        self.keyboard_monitor.start()
+        # Event loop lag, and the slots that hold it up
+        self.ui_monitor = None
+        if self.config["ui_stall_ms"] > 0:
+            self.ui_monitor = UiMonitor(self.config["ui_stall_ms"], parent=self)
+            self.ui_monitor.stalled.connect(self.engine.record_stall)
+            self.ui_monitor.start()
         
-        self.initUI()
+        # What the user has typed, one buffer per application; the saved
+        # buffers are loaded in start_services
+        self.text_buffer = ContextBuffers(
+            max_chars=self.config["context_chars"],
+            max_contexts=self.config["context_max_apps"],
+            path=CONTEXTS_PATH if self.config["context_persist"] else None)
+        
+        # Instant next-word guesses from what the user has written before,
+        # shown while the model works
+        self.local_context = ""
+        self.local_predictions = []
+        # The model's suggestions on show, and the text they continue
+        self.model_context = ""
+        self.model_suggestions = []
+        
+        # Autocomplete runs off the GUI thread; only the newest result is shown
+        self.completion_pipeline = self.engine.pipeline(parent=self)
+        self.completion_pipeline.suggestion_partial.connect(self.show_partial_suggestion)
+        self.completion_pipeline.suggestions_ready.connect(self.show_suggestions)
+        
+        # Decides which keystrokes are worth a completion request
+        self.trigger = AdaptiveTrigger(self.text_buffer, mode=self.config["trigger_mode"], parent=self)
+        self.trigger.triggered.connect(self.handle_text_capture)
+        self.completion_pipeline.suggestion_partial.connect(
+            lambda context, _: self.trigger.handle_suggestion(context))
+        self.completion_pipeline.suggestions_ready.connect(
+            lambda context, _: self.trigger.handle_suggestion(context))
         
-        # Monitor clipboard for text selection
+        # Popups, the keyboard hook and the model warm-up are started by
+        # start_services once the window is on screen
+        self.suggestion_widget = None
+        self.rephrase_widget = None
+        self.keyboard_monitor = None
+        self.capture_failed = False
+        self.focus_watcher = None
+        
+        self.initUI()
         self.clipboard = QApplication.clipboard()
-        self.clipboard.selectionChanged.connect(self.handle_selection)
         
         # Loading overlay
         self.loading_overlay = LoadingOverlay(self)
         self.loading_overlay.hide()
         
+    def start_services(self):
+        self.startup.milestone("window_visible")
+        
+        with self.startup.phase("widgets"):
+            self.suggestion_widget = SuggestionWidget(self)
+            self.suggestion_widget.accepted.connect(self.handle_suggestion_accepted)
+            self.rephrase_widget = RephraseWidget(self)
+            self.auto_write_dialog = AutoWriteDialog(
+                self.config["auto_write_section_tokens"] * 3 // 4, parent=self)
+            
+            # Monitor clipboard for text selection, acting once it settles
+            self.selection = ""
+            self.selection_timer = QTimer(self)
+            self.selection_timer.setSingleShot(True)
+            self.selection_timer.setInterval(self.config["selection_settle_ms"])
+            self.selection_timer.timeout.connect(self.handle_selection_settled)
+            self.clipboard.selectionChanged.connect(self.handle_selection)
+        
+        # Switch context buffers as focus moves between applications
+        self.text_buffer.load()
+        if self.config["context_scope"] != "global":
+            self.focus_watcher = FocusWatcher(self.config["context_scope"])
+            self.focus_watcher.focus_changed.connect(self.handle_focus)
+            self.focus_watcher.start()
+        
+        # Initialize keyboard monitor with text buffer
+        self.startup.begin("listener")
+        self.keyboard_monitor = KeyboardMonitor(self.text_buffer, self.config["key_capture"])
+        self.insertion.monitor = self.keyboard_monitor
+        self.keyboard_monitor.typed.connect(self.trigger.handle_key)
+        self.keyboard_monitor.typed.connect(self.handle_typed)
+        self.keyboard_monitor.listening.connect(lambda: self.startup.end("listener"))
+        self.keyboard_monitor.failed.connect(self.handle_capture_failed)
+        self.keyboard_monitor.start()
+        
+        # Live stats in the status tooltip
+        self.stats_timer = QTimer(self)
+        self.stats_timer.timeout.connect(self.update_stats)
+        self.stats_timer.start(2000)
+        
+        # Load the model in the background before the user's first space; a
+        # running daemon answers straight away
+        self.startup.begin("model_warmup")
+        self.status.setText("Loading model...")
+        self.engine.start()
+        
+    @pyqtSlot(bool)
+    def handle_engine_ready(self, ok):
+        if "ready" in self.startup.milestones:
+            # The daemon went away or came back
+            self.status.setText(self.ready_status() if ok else "Engine stopped - restart Quill")
+            return
+        self.startup.end("model_warmup")
+        self.startup.milestone("ready")
+        self.status.setText(self.ready_status() if ok else "Model unavailable - is Ollama running?")
+        self.startup.save()
+        if self.startup_report:
+            print(json.dumps(self.startup.report(), indent=2))
+        
+    def ready_status(self):
+        # Rephrase and Auto Write still work without the keyboard hook
+        if self.capture_failed:
+            return "Ready - typing isn't captured, no autocomplete"
+        return "Ready"
+
+    @pyqtSlot(str)
+    def handle_capture_failed(self, error):
+        self.capture_failed = True
+        self.startup.end("listener")
+        if "ready" in self.startup.milestones:
+            self.status.setText(self.ready_status())
+
+    @pyqtSlot(str, dict)
+    def handle_calibrated(self, model, speed):
+        if self.calibrate:
+            print(json.dumps({"model": model, **speed}))
+        
     def resizeEvent(self, event):
         super().resizeEvent(event)
         self.loading_overlay.resize(self.size())
@@ -304,44 +4649,19 @@ class FloatingAssistant(QMainWindow):
         layout.setContentsMargins(20, 20, 20, 20)
         layout.setSpacing(15)
 
-        central_widget.setStyleSheet("""
-            QWidget {
-                background-color: rgba(40, 44, 52, 0.95);
-                border-radius: 20px;
-                border: 1px solid #3d3d3d;
-            }
-        """)
+        central_widget.setObjectName("panel")
 
         # Header
         header = QHBoxLayout()
         
         title = QLabel("✏️ Writing Assistant")
-        title.setStyleSheet("""
-            QLabel {
-                color: #ffffff;
-                font-family: 'Segoe UI', Arial;
-                font-size: 18px;
-                font-weight: bold;
-                padding: 8px;
-            }
-        """)
+        title.setObjectName("title")
         header.addWidget(title)
         
         close_btn = QPushButton("X")
         close_btn.setFixedSize(30, 30)
         close_btn.clicked.connect(self.close)
-        close_btn.setStyleSheet("""
-            QPushButton {
-                background-color: transparent;
-                color: #ffffff;
-                font-size: 20px;
-                border: none;
-                border-radius: 15px;
-            }
-            QPushButton:hover {
-                background-color: #ff4455;
-            }
-        """)
+        close_btn.setObjectName("close")
         header.addWidget(close_btn)
         layout.addLayout(header)
 
@@ -351,23 +4671,7 @@ class FloatingAssistant(QMainWindow):
         auto_write_btn = QPushButton("✨ Auto Write")
         auto_write_btn.setFixedHeight(50)
         auto_write_btn.clicked.connect(self.show_auto_write_dialog)
-        auto_write_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #4a9eff;
-                color: white;
-                border: none;
-                border-radius: 12px;
-                padding: 15px;
-                font-size: 16px;
-                font-weight: bold;
-            }
-            QPushButton:hover {
-                background-color: #3d8ce4;
-            }
-            QPushButton:pressed {
-                background-color: #3278c7;
-            }
-        """)
+        auto_write_btn.setObjectName("autoWrite")
         layout.addWidget(auto_write_btn)
 
         # Feature buttons container
@@ -379,205 +4683,192 @@ class FloatingAssistant(QMainWindow):
         rephrase_btn = QPushButton("🔄 Rephrase")
         rephrase_btn.setFixedHeight(50)
         rephrase_btn.clicked.connect(self.show_rephrase_dialog)
-        rephrase_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #45a165;
-                color: white;
-                border: none;
-                border-radius: 12px;
-                padding: 15px;
-                font-size: 16px;
-                font-weight: bold;
-            }
-            QPushButton:hover {
-                background-color: #3d8956;
-            }
-            QPushButton:pressed {
-                background-color: #357a4b;
-            }
-        """)
+        rephrase_btn.setObjectName("rephrase")
         features_layout.addWidget(rephrase_btn)
 
         # Complete button
         complete_btn = QPushButton("✨ Complete")
         complete_btn.setFixedHeight(50)
         complete_btn.clicked.connect(self.trigger_completion)
-        complete_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #9b59b6;
-                color: white;
-                border: none;
-                border-radius: 12px;
-                padding: 15px;
-                font-size: 16px;
-                font-weight: bold;
-            }
-            QPushButton:hover {
-                background-color: #8e44ad;
-            }
-            QPushButton:pressed {
-                background-color: #7d3c98;
-            }
-        """)
+        complete_btn.setObjectName("complete")
         features_layout.addWidget(complete_btn)
         
         layout.addWidget(features_container)
 
         # Status indicator
         self.status = QLabel("Ready")
-        self.status.setStyleSheet("""
-            QLabel {
-                color: #8f9aab;
-                font-size: 14px;
-                padding: 10px;
-                background-color: rgba(55, 60, 70, 0.95);
-                border-radius: 8px;
-                min-height: 20px;
-            }
-        """)
+        self.status.setObjectName("status")
         layout.addWidget(self.status)
 
         self.setMinimumSize(400, 300)
 
     def show_auto_write_dialog(self):
-        dialog = QWidget(self)
-        dialog.setWindowFlags(Qt.FramelessWindowHint | Qt.Dialog)
-        dialog.setAttribute(Qt.WA_TranslucentBackground)
-        
-        layout = QVBoxLayout(dialog)
-        layout.setContentsMargins(20, 20, 20, 20)
-        
-        # Styling
-        dialog.setStyleSheet("""
-            QWidget {
-                background-color: rgba(40, 44, 52, 0.95);
-                border-radius: 20px;
-                border: 1px solid #3d3d3d;
-            }
-            QTextEdit {
-                background-color: rgba(55, 60, 70, 0.95);
-                color: white;
-                border: none;
-                border-radius: 12px;
-                padding: 15px;
-                font-size: 14px;
-            }
-        """)
-        
-        # Header
-        header = QHBoxLayout()
-        title = QLabel("Auto Write")
-        title.setStyleSheet("color: #ffffff; font-size: 16px; font-weight: bold;")
-        header.addWidget(title)
-        
-        close_btn = QPushButton("×")
-        close_btn.setFixedSize(30, 30)
-        close_btn.clicked.connect(dialog.close)
-        close_btn.setStyleSheet("""
-            QPushButton {
-                background-color: transparent;
-                color: #ffffff;
-                font-size: 20px;
-                border: none;
-                border-radius: 15px;
-            }
-            QPushButton:hover {
-                background-color: #ff4455;
-            }
-        """)
-        header.addWidget(close_btn)
-        layout.addLayout(header)
-        
-        text_input = QTextEdit()
-        text_input.setPlaceholderText("Enter what you want to write about...")
-        text_input.setMinimumHeight(150)
-        layout.addWidget(text_input)
-        
-        # Loading overlay for dialog
-        dialog_loading = LoadingOverlay(dialog)
-        dialog_loading.hide()
-        
-        def generate_with_loading():
-            dialog_loading.show()
-            self.gen_thread = GenerationThread(self.llm, text_input.toPlainText())
-            self.gen_thread.finished.connect(lambda response: self.handle_generated_text(response, dialog, dialog_loading))
-            self.gen_thread.start()
-        
-        generate_btn = QPushButton("Generate")
-        generate_btn.clicked.connect(generate_with_loading)
-        generate_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #4a9eff;
-                color: white;
-                border: none;
-                border-radius: 12px;
-                padding: 15px;
-                font-size: 16px;
-                font-weight: bold;
-                min-height: 50px;
-            }
-            QPushButton:hover {
-                background-color: #3d8ce4;
-            }
-        """)
-        layout.addWidget(generate_btn)
-        
-        dialog.setFixedSize(500, 300)
-        dialog.move(
-            self.x() + (self.width() - dialog.width()) // 2,
-            self.y() + (self.height() - dialog.height()) // 2
-        )
-        
-        dialog.show()
-
-    def handle_generated_text(self, response, dialog, loading_overlay):
-        pyperclip.copy(response)
-        self.keyboard.press(Key.ctrl)
-        self.keyboard.press('v')
-        self.keyboard.release('v')
-        self.keyboard.release(Key.ctrl)
-        loading_overlay.hide()
-        dialog.close()
+        self.auto_write_dialog.open()
         
     def show_rephrase_dialog(self):
         selected_text = self.clipboard.text(mode=self.clipboard.Selection)
         if selected_text:
-            cursor_pos = QCursor.pos()
-            self.rephrase_widget.move(cursor_pos.x() + 10, cursor_pos.y() + 10)
-            self.rephrase_widget.show()
+            self.show_rephrase_widget(selected_text)
+
+    def show_rephrase_widget(self, selected_text):
+        self.rephrase_widget.set_selection(selected_text, self.engine.presets())
+        cursor_pos = QCursor.pos()
+        self.rephrase_widget.move(cursor_pos.x() + 10, cursor_pos.y() + 10)
+        self.rephrase_widget.show()
 
     def trigger_completion(self):
+        # An explicit request, so it goes ahead of speculative autocomplete
         buffer_content = self.text_buffer.get()
-        if buffer_content:
-            self.handle_text_capture(buffer_content)
+        if buffer_content.strip():
+            self.completion_pipeline.submit(buffer_content, PRIORITY_USER)
 
     @pyqtSlot(str)
     def handle_text_capture(self, text):
         if text.strip():
-            prompt = f"""Instructions: You are an autocomplete AI. You will be given text and you need to suggest a natural continuation. Consider the entire context provided. Note: DO NOT PROVIDE ANY TEXT EXCEPT THE CONTINUATION.
-Previous text: {text}
-Provide a natural continuation:"""
-            
-            test_prompt="""Instructions: You are an autocomplete AI. You will be given text and you need to suggest a natural continuation. Consider the entire context provided. 
-Note: DO NOT PROVIDE ANY TEXT EXCEPT THE CONTINUATION.
+            self.completion_pipeline.submit(text)
 
-Previous text: Hello, I am a very talented Data Analyst and today I am going to
-Provide a natural continuation:"""
-            
-            suggestion = [self.llm(prompt).strip()]
-            self.suggestion_widget.suggestions.clear()
-            self.suggestion_widget.suggestions.addItems(suggestion)
-            
+    @pyqtSlot(str, str)
+    def show_partial_suggestion(self, context, suggestion):
+        self.model_context, self.model_suggestions = context, [suggestion]
+        self.suggestion_widget.set_suggestion(suggestion, self.local_extras(context, [suggestion]))
+        self.show_suggestion_widget()
+
+    @pyqtSlot(str, list)
+    def show_suggestions(self, context, suggestions):
+        if not suggestions:
+            return
+        self.model_context, self.model_suggestions = context, suggestions
+        self.suggestion_widget.set_suggestions(suggestions + self.local_extras(context, suggestions))
+        self.show_suggestion_widget()
+
+    def update_stats(self):
+        # Lines about this window's own state, then the engine's
+        contexts = self.text_buffer.stats()
+        local = (f"Trigger: {self.trigger.policy.stats()['calls_saved']} calls saved by waiting for pauses\n"
+                 f"Context: {contexts['active'] or 'unknown application'} "
+                 f"({len(self.text_buffer)} chars, {contexts['contexts']} applications kept)\n")
+        if self.ui_monitor is not None:
+            ui = self.ui_monitor.stats()
+            local += (f"UI: event loop lag p50 {ui['lag_ms'].get('p50', 0):.1f} ms, "
+                      f"p95 {ui['lag_ms'].get('p95', 0):.1f} ms, {ui['stalls']} stalls over "
+                      f"{self.ui_monitor.stall_ms} ms")
+            if ui["last_stall"] is not None:
+                local += f" (last: {ui['last_stall'][1]})"
+            local += "\n"
+        engine = self.engine.stats()
+        if engine is None:
+            # The daemon's first reply hasn't arrived yet
+            self.status.setToolTip(local.rstrip())
+            return
+        stats = engine["completion_cache"]
+        routes = ", ".join(f"{task} {model}" for task, model in engine["routes"].items())
+        results = ""
+        if engine["results"] is not None:
+            saved = engine["results"]
+            results = (f"Saved results: {saved['hits']} reused, {saved['misses']} generated "
+                       f"({saved['hit_rate']:.0%} hit rate)\n")
+        prefetch = engine["prefetch"]
+        if prefetch["started"]:
+            results += (f"Prefetch: {prefetch['used']} of {prefetch['started']} "
+                        f"background rephrasings used\n")
+        self.status.setToolTip(
+            f"Completion cache: {stats['calls_saved']} LLM calls saved "
+            f"({stats['hits']} exact, {stats['prefix_hits']} prefix, {stats['misses']} misses)\n"
+            f"Prompt session: {engine['prompts_reused']} prompts reused the backend's cached prefix\n"
+            f"{local}"
+            f"Models: {routes}\n"
+            f"{results}"
+            f"{engine['metrics']}".rstrip()
+        )
+
+    def show_suggestion_widget(self):
+        if not self.suggestion_widget.isVisible():
             cursor_pos = QCursor.pos()
             self.suggestion_widget.move(cursor_pos.x() + 10, cursor_pos.y() + 10)
             self.suggestion_widget.show()
 
+    @pyqtSlot(str)
+    def handle_focus(self, key):
+        # Suggestions for the previous application's text are no longer wanted
+        self.text_buffer.switch(key)
+        self.trigger.timer.stop()
+        self.completion_pipeline.cancel()
+        self.local_predictions = []
+        self.model_suggestions = []
+        self.suggestion_widget.hide()
+
+    @pyqtSlot(float, str)
+    def handle_typed(self, when, kind):
+        if not self.config["ngram_max_entries"]:
+            return
+        if kind == "sentence":
+            # Learn the sentence just finished, accepted suggestions included
+            sentences = SENTENCE_SPLIT.split(self.text_buffer.tail(1000))
+            if len(sentences) >= 2:
+                self.engine.learn(sentences[-2])
+        self.local_context = self.text_buffer.tail(200)
+        self.local_predictions = []
+        if self.local_context.strip():
+            self.engine.request_predictions(self.local_context)
+
+    @pyqtSlot(str, list)
+    def show_local_predictions(self, context, predictions):
+        # Guesses for text the user has typed past since are dropped
+        if context != self.local_context:
+            return
+        self.local_predictions = predictions
+        # Model suggestions being typed out stay on top
+        model = self.model_remainders(self.text_buffer.get())
+        shown = model + self.local_extras(context, model)
+        if shown:
+            self.suggestion_widget.set_suggestions(shown)
+            self.show_suggestion_widget()
+        else:
+            self.suggestion_widget.hide()  # nothing on it fits the text any more
+
+    def model_remainders(self, text):
+        # What is left of the model's suggestions once part of one was typed.
+        # A full buffer drops text off its front, so they are matched from the
+        # end of the text they continued.
+        if text == self.model_context:
+            return list(self.model_suggestions)
+        anchor = self.model_context[-100:]
+        start = text.rfind(anchor) if anchor else -1
+        if start < 0:
+            return []
+        remainders = (remaining_continuation(anchor, suggestion, text[start:])
+                      for suggestion in self.model_suggestions)
+        return [remainder for remainder in remainders if remainder is not None]
+
+    def local_extras(self, context, suggestions):
+        # Local guesses for the same text go below the model's suggestions
+        if not self.local_predictions or not context.endswith(self.local_context):
+            return []
+        shown = {suggestion.strip() for suggestion in suggestions}
+        return [p for p in self.local_predictions if p.strip() not in shown]
+
+    @pyqtSlot(str)
+    def handle_suggestion_accepted(self, text):
+        # Accepting a partial suggestion stops the rest of the generation
+        self.completion_pipeline.cancel()
+        # The pasted text is now part of what the user is writing
+        self.text_buffer.append(text)
+        self.local_predictions = []
+        self.model_suggestions = []
+
     def handle_selection(self):
+        # Fires for every step of a drag; only the selection it settles on counts
+        self.selection_timer.start()
+
+    def handle_selection_settled(self):
         selected_text = self.clipboard.text(mode=self.clipboard.Selection)
-        if selected_text:
-            cursor_pos = QCursor.pos()
-            self.rephrase_widget.move(cursor_pos.x() + 10, cursor_pos.y() + 10)
-            self.rephrase_widget.show()
+        if not selected_text:
+            return
+        if selected_text == self.selection and self.rephrase_widget.isVisible():
+            return  # same selection again, e.g. a drag that ended where it began
+        self.selection = selected_text
+        self.show_rephrase_widget(selected_text)
+        self.engine.prefetch(selected_text)
 
     def mousePressEvent(self, event):
         self.oldPos = event.globalPos()
@@ -588,14 +4879,43 @@ Provide a natural continuation:"""
         self.oldPos = event.globalPos()
 
     def closeEvent(self, event):
-        self.keyboard_monitor.stop()
-        self.keyboard_monitor.wait()
+        self.completion_pipeline.cancel()
+        if self.keyboard_monitor is not None:
+            self.keyboard_monitor.stop()
+            self.keyboard_monitor.wait()
+        if self.focus_watcher is not None:
+            self.focus_watcher.stop()
+            self.focus_watcher.wait()
+        self.text_buffer.save()
+        self.insertion.close()
+        if self.ui_monitor is not None:
+            self.ui_monitor.stop()
+        # A daemon keeps running for the other front-ends
+        self.engine.close()
         event.accept()
 
 def main():
-    app = QApplication(sys.argv)
-    assistant = FloatingAssistant()
-    assistant.show()
+    parser = argparse.ArgumentParser(description="Quill writing assistant")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print a per-phase startup timing breakdown once the model is loaded")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="measure every configured model's speed again and print the results")
+    parser.add_argument("--engine", action="store_true",
+                        help="run only the engine daemon, which front-ends share over "
+                             f"{ENGINE_SOCKET}")
+    args, qt_args = parser.parse_known_args()
+    if args.engine:
+        sys.exit(run_engine(args.calibrate))
+    
+    startup = StartupTimer()
+    startup.end("imports")
+    with startup.phase("qt_init"):
+        app = QApplication(sys.argv[:1] + qt_args)
+    with startup.phase("window"):
+        assistant = FloatingAssistant(startup, args.startup_report, args.calibrate)
+        assistant.show()
+    # Runs on the first event loop pass, after the window has been painted
+    QTimer.singleShot(0, assistant.start_services)
     sys.exit(app.exec_())
 
 if __name__ == '__main__':
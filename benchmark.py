@@ -0,0 +1,599 @@
+# Headless end-to-end latency benchmark for Quill's autocomplete path.
+#
+# Replays a keystroke trace through KeyboardMonitor.handle_key, TextBuffer and
+# CompletionPipeline against a deterministic fake model, in real time, and
+# prints a JSON report that can be compared between builds. Latency counts
+# from the last keystroke before each request, so the trigger's wait is in it.
+# Every suggestion is accepted the moment it completes, as if the user had
+# stopped typing, and pasted through InsertionEngine into a fake application:
+#
+#   python benchmark.py --words 80 --wpm 90 --latency 0.4 --tokens-per-second 25
+#   python benchmark.py --trace my_trace.jsonl --output results.json
+#
+# With --ngram-tokens it instead measures the local n-gram predictor: how fast
+# it learns, how long a lookup takes and how much memory it needs:
+#
+#   python benchmark.py --ngram-tokens 1000000
+#
+# With --hook-latency it times the keyboard hook callback while this process is
+# kept busy with pure-Python work, once with the hook on a thread here and once
+# in the keycapture.py process:
+#
+#   python benchmark.py --hook-latency
+#
+# With --insertion it puts text into a window of its own through each way
+# Quill can insert results, and times how long until the window shows all of
+# it. This one needs a desktop session, and the window must keep focus:
+#
+#   python benchmark.py --insertion
+#
+# A trace file holds one keystroke per line, e.g. {"t": 0.21, "key": "a"} or
+# {"t": 0.48, "key": "space"}, where t is seconds since the start of the trace
+# and key is either a single character or a special key name. A line such as
+# {"t": 3.5, "focus": "mail"} moves focus to another application, which gets
+# its own context buffer; --apps makes the synthetic trace switch between
+# applications after every sentence.
+import os
+import sys
+if "--insertion" not in sys.argv:
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import json
+import time
+import zlib
+import random
+import argparse
+import itertools
+import tempfile
+import subprocess
+from collections import deque
+from threading import Lock, Thread
+from PyQt5.QtCore import QTimer, Qt
+from PyQt5.QtWidgets import QApplication, QTextEdit
+
+from app import (TextBuffer, ContextBuffers, KeyboardMonitor, CompletionPipeline, CompletionCache,
+                 PromptSession, MetricsRecorder, RequestScheduler, AdaptiveTrigger,
+                 NgramPredictor, InsertionEngine, INSERTERS, percentiles, KEY_POLL_INTERVAL)
+import keycapture
+
+SAMPLE_TEXT = (
+    "Thanks for sending the report over so quickly. I went through the numbers this "
+    "morning and most of them line up with what we saw last quarter. The one thing "
+    "that stands out is the drop in weekly active users in March, which I think is "
+    "related to the pricing change. Could you pull the churn figures for the same "
+    "period so we can check? I would also like to see the support ticket volume "
+    "broken down by product area. If the pattern holds, we should bring it up at "
+    "the planning meeting next week and decide whether to roll the change back. "
+    "Let me know if you need anything from my side before then. "
+)
+
+VOCAB = ("the", "of", "and", "to", "a", "in", "that", "we", "for", "it", "with", "as",
+         "this", "on", "be", "at", "by", "report", "team", "week", "data", "next")
+
+# Stands in for the model with a fixed time to first token and token rate.
+# Continuations are deterministic: for a given prompt it either predicts the
+# next words of the reference text or makes some up, so runs are repeatable
+# and the completion cache sees realistic prefix hits.
+class FakeLLM:
+    def __init__(self, reference="", latency=0.3, tokens_per_second=20.0,
+                 max_tokens=12, accuracy=0.5, model="fake"):
+        self.reference = reference
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.max_tokens = max_tokens
+        self.accuracy = accuracy
+        self.model = model
+        self.calls = 0
+        self.tokens = 0  # tokens actually streamed, so early stops show up
+        self.prompt_chars = []  # length of the user's text in each prompt
+        self.lock = Lock()
+
+    def continuation(self, prompt, options):
+        text = prompt.rsplit("Previous text: ", 1)[-1].split("\nProvide a natural continuation:")[0]
+        with self.lock:
+            self.prompt_chars.append(len(text))
+        seed = zlib.crc32((text + json.dumps(options, sort_keys=True)).encode("utf-8"))
+        rng = random.Random(seed)
+        count = min(self.max_tokens, options.get("num_predict") or self.max_tokens)
+        index = self.reference.find(text)
+        if text and index != -1 and rng.random() < self.accuracy:
+            return self.reference[index + len(text):].split()[:count]
+        return [rng.choice(VOCAB) for _ in range(count)]
+
+    def stream(self, prompt, **options):
+        with self.lock:
+            self.calls += 1
+        words = self.continuation(prompt, options)
+        time.sleep(self.latency)
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(1.0 / self.tokens_per_second)
+            with self.lock:
+                self.tokens += 1
+            yield (" " if i else "") + word
+
+    def __call__(self, prompt, **options):
+        return "".join(self.stream(prompt, **options))
+
+# Stands in for the focused application the way FakeLLM stands in for the
+# model: every paste takes the same time
+class FakeInserter:
+    name = "fake"
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def available(self):
+        return True
+
+    def insert(self, text):
+        time.sleep(self.seconds)
+
+    def erase(self, count):
+        time.sleep(self.seconds)
+
+    def idle(self):
+        pass
+
+def synthetic_trace(text, wpm, seed=0, apps=1):
+    # Average word is five characters plus a space; sentence ends pause longer
+    rng = random.Random(seed)
+    interval = 60.0 / (wpm * 5)
+    events = [{"t": 0.0, "focus": "app0"}] if apps > 1 else []
+    sentences = 0
+    t = 0.0
+    for char in text:
+        t += interval * rng.uniform(0.6, 1.4)
+        if events and events[-1].get("key") in (".", "!", "?"):
+            t += interval * 4
+        if (apps > 1 and len(events) >= 2 and events[-1].get("key") == "space"
+                and events[-2].get("key") in (".", "!", "?")):
+            # Each sentence is written in the next application in turn
+            sentences += 1
+            events.append({"t": round(t, 4), "focus": f"app{sentences % apps}"})
+        events.append({"t": round(t, 4), "key": "space" if char == " " else char})
+    return events
+
+def load_trace(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def ngram_corpus(tokens, seed=0, vocabulary=20000):
+    # Zipf-distributed words where every word also has a few favourite
+    # followers, so there are repeated phrases as well as a long tail
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocabulary)]
+    cumulative = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(vocabulary)))
+    followers = {}
+    sentences = []
+    produced = 0
+    while produced < tokens:
+        length = min(rng.randint(6, 20), tokens - produced)
+        draws = rng.choices(words, cum_weights=cumulative, k=length)
+        sentence = [draws[0]]
+        for word in draws[1:]:
+            previous = sentence[-1]
+            if previous not in followers:
+                followers[previous] = rng.choices(words, cum_weights=cumulative, k=4)
+            sentence.append(rng.choice(followers[previous]) if rng.random() < 0.6 else word)
+        sentences.append(" ".join(sentence))
+        produced += length
+    return sentences
+
+def ngram_benchmark(args):
+    sentences = ngram_corpus(args.ngram_tokens, args.seed)
+    path = os.path.join(tempfile.mkdtemp(), "ngrams.bin")
+    predictor = NgramPredictor(path, max_entries=args.ngram_max_entries)
+    started = time.perf_counter()
+    for i in range(0, len(sentences), 50):
+        predictor.learn(". ".join(sentences[i:i + 50]) + ". ")
+    learn_seconds = time.perf_counter() - started
+
+    # Lookups at random points of the corpus, both between and inside words
+    rng = random.Random(args.seed)
+    lookups = []
+    hits = 0
+    for _ in range(args.ngram_lookups):
+        sentence = rng.choice(sentences)
+        text = sentence[:rng.randint(1, len(sentence))]
+        started = time.perf_counter()
+        predictions = predictor.predict(text)
+        lookups.append((time.perf_counter() - started) * 1e6)
+        hits += bool(predictions)
+
+    started = time.perf_counter()
+    predictor.dirty = True
+    predictor.save()
+    save_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    NgramPredictor(path).load()
+    load_seconds = time.perf_counter() - started
+
+    stats = predictor.stats()
+    return {
+        "build": build_id(),
+        "timestamp": time.time(),
+        "settings": {"tokens": args.ngram_tokens, "max_entries": args.ngram_max_entries,
+                     "seed": args.seed},
+        "learn_tokens_per_second": round(args.ngram_tokens / learn_seconds),
+        "lookup_us": percentiles(lookups),
+        "lookups_with_predictions": round(hits / len(lookups), 3) if lookups else None,
+        "index": stats,
+        "memory_mb_per_million_tokens": round(stats["memory_bytes"] / 2**20 * 1e6 / args.ngram_tokens, 2),
+        "file_bytes": os.path.getsize(path),
+        "save_ms": round(save_seconds * 1000, 1),
+        "load_ms": round(load_seconds * 1000, 1),
+    }
+
+def burn_cpu(seconds):
+    # Stands in for a busy GUI thread: pure-Python work that only lets go of
+    # the GIL at the interpreter's switch interval
+    until = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < until:
+        total += sum(i * i for i in range(2000))
+    return total
+
+def hook_latency_benchmark(args):
+    keys = args.hook_keys
+    interval = args.hook_interval_ms / 1000
+
+    # The hook on a thread of this process, as with "key_capture": "thread"
+    monitor = KeyboardMonitor(TextBuffer(max_size=2000))
+    thread_ms = []
+
+    def fire():
+        due = time.perf_counter()
+        for i in range(keys):
+            due += interval
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            char = SAMPLE_TEXT[i % len(SAMPLE_TEXT)]
+            if char == " ":
+                monitor.handle_key(name="space")
+            else:
+                monitor.handle_key(char=char)
+            thread_ms.append((time.perf_counter() - due) * 1000)
+
+    hook = Thread(target=fire)
+    hook.start()
+    while hook.is_alive():
+        burn_cpu(0.05)
+    hook.join()
+
+    # The hook in the capture process, read back here in batches while busy
+    ring = keycapture.KeyRing.create()
+    monitor = KeyboardMonitor(TextBuffer(max_size=2000))
+    monitor.ring = ring
+    delivery_ms = []
+    monitor.typed.connect(lambda when, kind: delivery_ms.append((time.perf_counter() - when) * 1000),
+                          Qt.DirectConnection)
+    process = keycapture.spawn(ring, "--synthetic", str(keys),
+                               "--interval-ms", str(args.hook_interval_ms),
+                               stdout=subprocess.PIPE, text=True)
+    monitor.running = True
+    reader = Thread(target=monitor.drain, args=(process,))
+    reader.start()
+    while process.poll() is None:
+        burn_cpu(0.05)
+    process_ms = json.loads(process.communicate()[0])
+    reader.join()
+    for when, char, name in ring.read():
+        monitor.handle_key(char, name, when)
+    lost = ring.lost
+    ring.close()
+
+    return {
+        "build": build_id(),
+        "timestamp": time.time(),
+        "settings": {"keys": keys, "interval_ms": args.hook_interval_ms,
+                     "switch_interval_ms": sys.getswitchinterval() * 1000,
+                     "poll_interval_ms": KEY_POLL_INTERVAL * 1000},
+        # From when a key was due until the hook callback returned
+        "thread_hook_ms": percentiles(thread_ms),
+        "process_hook_ms": percentiles(process_ms),
+        # From when a key was due until this process handled it
+        "process_delivery_ms": percentiles(delivery_ms),
+        "process_lost_keys": lost,
+    }
+
+def wait_events(app, seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        app.processEvents()
+        time.sleep(0.001)
+
+def insertion_benchmark(args):
+    app = QApplication(sys.argv[:1])
+    window = QTextEdit()
+    window.setWindowTitle("Quill insertion benchmark")
+    window.resize(600, 400)
+    window.show()
+    window.raise_()
+    window.activateWindow()
+    window.setFocus()
+    wait_events(app, 0.5)
+
+    methods = {}
+    for method in INSERTERS:
+        engine = InsertionEngine(method, restore_ms=args.insert_restore_ms)
+        if not engine.inserter.available():
+            methods[method] = {"available": False}
+            engine.close()
+            continue
+        lengths = {}
+        for length in args.insert_chars:
+            text = (SAMPLE_TEXT * (length // len(SAMPLE_TEXT) + 1))[:length]
+            times = []
+            for _ in range(args.insert_trials):
+                window.clear()
+                wait_events(app, 0.05)
+                # From handing over the text until the window shows all of it
+                started = time.perf_counter()
+                engine.insert(text, "benchmark")
+                deadline = started + args.insert_timeout
+                while window.toPlainText() != text and time.perf_counter() < deadline:
+                    app.processEvents()
+                if window.toPlainText() == text:
+                    times.append((time.perf_counter() - started) * 1000)
+            lengths[str(length)] = {"insert_ms": percentiles(times),
+                                    "correct": len(times) / args.insert_trials}
+        engine.close()
+        methods[method] = {"available": True, "chars": lengths}
+
+    # The fastest method for the longest text among those that never failed
+    longest = str(max(args.insert_chars))
+    reliable = [method for method, result in methods.items() if result["available"]
+                and all(chars["correct"] == 1 for chars in result["chars"].values())]
+    window.close()
+    return {
+        "build": build_id(),
+        "timestamp": time.time(),
+        "settings": {"trials": args.insert_trials, "chars": args.insert_chars,
+                     "restore_ms": args.insert_restore_ms, "platform": sys.platform,
+                     "session": os.environ.get("XDG_SESSION_TYPE")},
+        "methods": methods,
+        "recommended": min(reliable, key=lambda m: methods[m]["chars"][longest]["insert_ms"]["p50"],
+                           default=None),
+    }
+
+def build_id():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+class Replay:
+    def __init__(self, app, trace, llm, args, upgrade=None):
+        self.app = app
+        self.trace = trace
+        self.llm = llm
+        self.upgrade = upgrade
+        self.args = args
+        self.text_buffer = ContextBuffers(max_chars=2000)
+        self.monitor = KeyboardMonitor(self.text_buffer)
+        self.cache = None if args.no_cache else CompletionCache(max_entries=256)
+        self.metrics = MetricsRecorder(path=None)
+        self.scheduler = RequestScheduler(workers=args.parallel)
+        self.pipeline = CompletionPipeline(
+            llm, self.scheduler, self.cache, PromptSession(max_chars=2000, rebase_chars=1000),
+            candidates=args.candidates, metrics=self.metrics,
+            upgrade=upgrade, budget_ms=args.budget_ms,
+            max_tokens=args.limit_tokens, stop_at=args.stop_at)
+        self.last_key = None     # when the latest keystroke was replayed
+        self.keyed = {}          # context -> last keystroke before its trigger
+        self.triggered = {}      # context -> time the trigger fired
+        self.first_visible = {}  # context -> first partial or complete suggestion
+        self.completed = {}      # context -> first complete candidate list
+        self.pasted = {}         # context -> accepted suggestion fully sent
+        self.pasting = deque()   # (context, accepted at) in insertion order
+        self.insertion = InsertionEngine("typing")
+        self.insertion.inserter = FakeInserter(args.paste_ms / 1000)
+        self.insertion.inserted.connect(self.handle_pasted)
+        self.trigger = AdaptiveTrigger(self.text_buffer, mode=args.trigger)
+        self.monitor.typed.connect(self.trigger.handle_key)
+        self.trigger.triggered.connect(self.handle_trigger)
+        self.pipeline.suggestion_partial.connect(self.handle_visible)
+        self.pipeline.suggestions_ready.connect(self.handle_ready)
+
+    def handle_trigger(self, text):
+        self.triggered[text] = time.perf_counter()
+        self.keyed.setdefault(text, self.last_key)
+        self.pipeline.submit(text)
+
+    def handle_visible(self, context, suggestion):
+        self.trigger.handle_suggestion(context)
+        self.first_visible.setdefault(context, time.perf_counter())
+
+    def handle_ready(self, context, suggestions):
+        self.trigger.handle_suggestion(context)
+        now = time.perf_counter()
+        self.first_visible.setdefault(context, now)
+        if context in self.completed:
+            return
+        self.completed[context] = now
+        # Taken straight away; stale_triggers counts the ones a real typist
+        # would have typed past
+        if suggestions:
+            self.pasting.append((context, now))
+            self.insertion.insert(suggestions[0], "autocomplete")
+
+    def handle_pasted(self, trigger, seconds):
+        context, accepted = self.pasting.popleft()
+        self.pasted[context] = accepted + seconds
+
+    def press(self, event):
+        if "focus" in event:
+            self.text_buffer.switch(event["focus"])
+            self.trigger.timer.stop()
+            self.pipeline.cancel()
+            return
+        key = event["key"]
+        self.last_key = time.perf_counter()
+        if len(key) == 1 and key != " ":
+            self.monitor.handle_key(char=key)
+        else:
+            self.monitor.handle_key(name="space" if key == " " else key)
+
+    def run(self):
+        for event in self.trace:
+            QTimer.singleShot(int(event["t"] * 1000), Qt.PreciseTimer,
+                              lambda event=event: self.press(event))
+        # Leave time for the last request to finish before stopping
+        end = self.trace[-1]["t"] if self.trace else 0
+        drain = (self.llm.latency + self.llm.max_tokens / self.llm.tokens_per_second
+                 + self.args.paste_ms / 1000 + 1.0)
+        QTimer.singleShot(int((end + drain) * 1000), self.app.quit)
+        started = time.perf_counter()
+        self.app.exec_()
+        self.pipeline.cancel()
+        self.scheduler.shutdown()
+        self.insertion.close()
+        return time.perf_counter() - started
+
+    def latencies(self, start, end):
+        return percentiles([(end[c] - t) * 1000 for c, t in start.items()
+                            if c in end and t is not None])
+
+    def report(self, elapsed):
+        keys = [e["key"] for e in self.trace if "key" in e]
+        typed = "".join(" " if key in (" ", "space") else key
+                        for key in keys if len(key) == 1 or key == "space")
+        words = len(typed.split())
+        return {
+            "build": build_id(),
+            "timestamp": time.time(),
+            "settings": {
+                "latency_s": self.llm.latency,
+                "tokens_per_second": self.llm.tokens_per_second,
+                "max_tokens": self.llm.max_tokens,
+                "accuracy": self.llm.accuracy,
+                "candidates": self.args.candidates,
+                "parallel": self.args.parallel,
+                "cache": self.cache is not None,
+                "trigger": self.args.trigger,
+                "upgrade_latency_s": self.upgrade.latency if self.upgrade else None,
+                "budget_ms": self.args.budget_ms,
+                "limit_tokens": self.args.limit_tokens,
+                "stop_at": self.args.stop_at,
+                "apps": self.args.apps,
+                "paste_ms": self.args.paste_ms,
+            },
+            "elapsed_s": round(elapsed, 2),
+            "keystrokes": len(keys),
+            "applications": self.text_buffer.stats()["contexts"],
+            "words": words,
+            "triggers": len(self.triggered),
+            "llm_calls": self.llm.calls,
+            "llm_calls_per_100_words": round(100.0 * self.llm.calls / words, 1) if words else None,
+            "tokens_generated": self.llm.tokens,
+            # Characters of typed text sent with each request
+            "prompt_text_chars": percentiles(self.llm.prompt_chars),
+            # From the last keystroke, which is what the user feels; the
+            # trigger_to_ figures leave out how long the trigger waited
+            "key_to_trigger_ms": self.latencies(self.keyed, self.triggered),
+            "key_to_visible_ms": self.latencies(self.keyed, self.first_visible),
+            "key_to_complete_ms": self.latencies(self.keyed, self.completed),
+            "key_to_pasted_ms": self.latencies(self.keyed, self.pasted),
+            "trigger_to_visible_ms": self.latencies(self.triggered, self.first_visible),
+            "trigger_to_complete_ms": self.latencies(self.triggered, self.completed),
+            "pasted": len(self.pasted),
+            # Triggers whose suggestion never showed because newer text superseded it
+            "stale_triggers": len(self.triggered) - len(self.first_visible.keys() & self.triggered.keys()),
+            "dropped_results": self.pipeline.dropped,
+            "upgrade_calls": self.upgrade.calls if self.upgrade else 0,
+            "upgrades": self.pipeline.upgrades,
+            "skipped_queued_requests": self.scheduler.dropped,
+            "trigger": self.trigger.policy.stats(),
+            "cache": self.cache.stats() if self.cache is not None else None,
+            # Per-stage timings of the model calls themselves, cancelled ones included
+            "generation": self.metrics.snapshot().get("autocomplete", {}),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay keystrokes through Quill's autocomplete path")
+    parser.add_argument("--trace", help="JSONL keystroke trace; a synthetic one is typed otherwise")
+    parser.add_argument("--words", type=int, default=60, help="length of the synthetic trace")
+    parser.add_argument("--wpm", type=float, default=120, help="typing speed of the synthetic trace")
+    parser.add_argument("--apps", type=int, default=1,
+                        help="applications the synthetic trace switches between, one sentence each")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake model time to first token, seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=20.0)
+    parser.add_argument("--max-tokens", type=int, default=12,
+                        help="how many tokens the fake model produces when left alone")
+    parser.add_argument("--limit-tokens", type=int, default=24,
+                        help="autocomplete output limit sent with each request, like autocomplete_max_tokens")
+    parser.add_argument("--stop-at", choices=("sentence", "clause", "none"), default="sentence",
+                        help="stop reading a suggestion at the first sentence or clause end")
+    parser.add_argument("--accuracy", type=float, default=0.5,
+                        help="fraction of requests where the fake model predicts the next words")
+    parser.add_argument("--candidates", type=int, default=1)
+    parser.add_argument("--parallel", type=int, default=1)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--trigger", choices=("adaptive", "space"), default="adaptive",
+                        help="trigger policy; 'space' fires on every space like older builds")
+    parser.add_argument("--upgrade-latency", type=float,
+                        help="race a slower, more accurate fake model with this time to first token")
+    parser.add_argument("--upgrade-accuracy", type=float, default=0.9)
+    parser.add_argument("--budget-ms", type=float, default=600,
+                        help="autocomplete latency budget the upgrade model must finish within")
+    parser.add_argument("--paste-ms", type=float, default=20.0,
+                        help="fake time to paste an accepted suggestion, e.g. a p50 from --insertion")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ngram-tokens", type=int,
+                        help="benchmark the local n-gram predictor on a synthetic corpus of this size instead")
+    parser.add_argument("--ngram-max-entries", type=int, default=500000)
+    parser.add_argument("--ngram-lookups", type=int, default=10000)
+    parser.add_argument("--hook-latency", action="store_true",
+                        help="time the keyboard hook callback under CPU load instead")
+    parser.add_argument("--hook-keys", type=int, default=1000)
+    parser.add_argument("--hook-interval-ms", type=float, default=10.0)
+    parser.add_argument("--insertion", action="store_true",
+                        help="time each way of inserting text into a window instead")
+    parser.add_argument("--insert-chars", type=int, nargs="+", default=[20, 400],
+                        help="lengths of the inserted texts")
+    parser.add_argument("--insert-trials", type=int, default=10)
+    parser.add_argument("--insert-timeout", type=float, default=5.0,
+                        help="seconds before an insertion counts as failed")
+    parser.add_argument("--insert-restore-ms", type=float, default=500)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    if args.ngram_tokens or args.hook_latency or args.insertion:
+        if args.ngram_tokens:
+            report = ngram_benchmark(args)
+        elif args.hook_latency:
+            report = hook_latency_benchmark(args)
+        else:
+            report = insertion_benchmark(args)
+        output = json.dumps(report, indent=2)
+        print(output)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(output + "\n")
+        return
+
+    text = " ".join((SAMPLE_TEXT * (args.words // len(SAMPLE_TEXT.split()) + 1)).split()[:args.words]) + " "
+    trace = load_trace(args.trace) if args.trace else synthetic_trace(text, args.wpm, args.seed, args.apps)
+    llm = FakeLLM(text, args.latency, args.tokens_per_second, args.max_tokens, args.accuracy)
+    upgrade = None
+    if args.upgrade_latency is not None:
+        upgrade = FakeLLM(text, args.upgrade_latency, args.tokens_per_second, args.max_tokens,
+                          args.upgrade_accuracy, model="fake-large")
+
+    # InsertionEngine needs the clipboard; the offscreen platform has one
+    app = QApplication(sys.argv[:1])
+    replay = Replay(app, trace, llm, args, upgrade)
+    report = replay.report(replay.run())
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+# Keystroke capture in its own small process. The OS keyboard hook runs here,
+# away from the window's GIL, so Qt painting, clipboard work and response
+# parsing can never hold up the hook callback. Each key goes into a ring of
+# fixed-size records in shared memory, which the window reads in batches:
+#
+#   python keycapture.py <shared memory name> --capacity 4096
+#
+# The window starts it (see KeyboardMonitor in app.py). With --synthetic it
+# fires evenly spaced fake keys through the same write path instead of hooking
+# the keyboard, and prints how long each callback took, for
+# `python benchmark.py --hook-latency`.
+#
+# Only the standard library and pynput are imported here, so the process
+# stays small and starts quickly.
+import os
+import sys
+import json
+import time
+import struct
+import argparse
+import subprocess
+from multiprocessing import shared_memory
+
+# Special keys by index; 0 marks a character key
+KEY_NAMES = ("", "space", "enter", "tab", "backspace", "delete", "left", "right",
+             "up", "down", "home", "end", "page_up", "page_down")
+KEY_CODES = {name: code for code, name in enumerate(KEY_NAMES) if name}
+
+# Header: keys written so far, then the capture state
+COUNT = struct.Struct("<Q")
+STATE_OFFSET = 8
+HEADER_SIZE = 16
+# One key: time.perf_counter() when it was pressed, code point, key name index.
+# perf_counter is system-wide on Linux, macOS and Windows, so the window can
+# compare it with its own clock.
+RECORD = struct.Struct("<dIB3x")
+
+STARTING, LISTENING, STOPPING = 0, 1, 2
+
+def attach_memory(name):
+    # Python 3.13 can attach without tracking. Before that, the resource tracker
+    # would unlink the window's memory when this process exits.
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        memory = shared_memory.SharedMemory(name)
+        if os.name == "posix":
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(memory._name, "shared_memory")
+        return memory
+
+# Single-producer, single-consumer ring of key records. The writer stores a
+# record before the count that publishes it; the reader copies everything new
+# out in one or two slices and skips records the writer lapped meanwhile.
+class KeyRing:
+    def __init__(self, memory, capacity, owner=False):
+        self.memory = memory
+        self.capacity = capacity
+        self.owner = owner
+        self.buffer = memory.buf
+        self.written = 0  # writer side
+        self.read_count = 0
+        self.lost = 0     # keys overwritten before the reader got to them
+
+    @classmethod
+    def create(cls, capacity=4096):
+        memory = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity * RECORD.size)
+        memory.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+        return cls(memory, capacity, owner=True)
+
+    @classmethod
+    def attach(cls, name, capacity):
+        return cls(attach_memory(name), capacity)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def state(self):
+        return self.buffer[STATE_OFFSET]
+
+    def set_state(self, state):
+        self.buffer[STATE_OFFSET] = state
+
+    def write(self, char=None, name=None, when=None):
+        code = ord(char) if char and len(char) == 1 else 0
+        key = KEY_CODES.get(name, 0)
+        if not code and not key:
+            return  # modifiers and keys Quill doesn't follow
+        offset = HEADER_SIZE + (self.written % self.capacity) * RECORD.size
+        RECORD.pack_into(self.buffer, offset, when or time.perf_counter(), code, key)
+        self.written += 1
+        COUNT.pack_into(self.buffer, 0, self.written)
+
+    def read(self):
+        # Keys written since the last read, oldest first, as (time, char, name)
+        written = COUNT.unpack_from(self.buffer, 0)[0]
+        if written == self.read_count:
+            return []
+        first = max(self.read_count, written - self.capacity)
+        start = first % self.capacity
+        end = start + (written - first)
+        if end <= self.capacity:
+            data = bytes(self.buffer[HEADER_SIZE + start * RECORD.size:HEADER_SIZE + end * RECORD.size])
+        else:
+            data = (bytes(self.buffer[HEADER_SIZE + start * RECORD.size:])
+                    + bytes(self.buffer[HEADER_SIZE:HEADER_SIZE + (end - self.capacity) * RECORD.size]))
+        # Records the writer reached again while we copied may be torn, and so
+        # may the one it is writing now, which the count doesn't include yet
+        torn = COUNT.unpack_from(self.buffer, 0)[0] + 1 - self.capacity - first
+        torn = min(max(0, torn), written - first)
+        self.lost += first - self.read_count + torn
+        self.read_count = written
+        return [(when, chr(code) if code else None, KEY_NAMES[key] or None)
+                for when, code, key in RECORD.iter_unpack(data[torn * RECORD.size:])]
+
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+def spawn(ring, *args, **kwargs):
+    # Starts the capture process on a ring created by this process
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), ring.name,
+                             "--capacity", str(ring.capacity), *args],
+                            stdin=subprocess.DEVNULL, **kwargs)
+
+def watch(ring, parent):
+    # Until the window asks us to stop, or goes away without asking
+    while ring.state() != STOPPING and os.getppid() == parent:
+        time.sleep(0.2)
+
+def capture(ring):
+    from pynput import keyboard
+
+    def on_press(key):
+        # Special keys have a name (Key.space.name == "space"), others a char
+        ring.write(getattr(key, "char", None), getattr(key, "name", None))
+
+    parent = os.getppid()
+    listener = keyboard.Listener(on_press=on_press)
+    listener.start()
+    listener.wait()
+    ring.set_state(LISTENING)
+    try:
+        watch(ring, parent)
+    finally:
+        listener.stop()
+
+def synthetic(ring, keys, interval):
+    # Each callback is timed from when its key was due to when it returned
+    text = "the quick brown fox jumps over the lazy dog "
+    ring.set_state(LISTENING)
+    latencies = []
+    due = time.perf_counter()
+    for i in range(keys):
+        due += interval
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        char = text[i % len(text)]
+        if char == " ":
+            ring.write(name="space", when=due)
+        else:
+            ring.write(char, when=due)
+        latencies.append((time.perf_counter() - due) * 1000)
+    print(json.dumps(latencies))
+
+def main():
+    parser = argparse.ArgumentParser(description="Quill's keystroke capture process")
+    parser.add_argument("name", help="shared memory ring created by the window")
+    parser.add_argument("--capacity", type=int, required=True, help="keys the ring holds")
+    parser.add_argument("--synthetic", type=int, metavar="KEYS",
+                        help="fire this many fake keys instead of hooking the keyboard")
+    parser.add_argument("--interval-ms", type=float, default=10.0,
+                        help="time between synthetic keys")
+    args = parser.parse_args()
+
+    ring = KeyRing.attach(args.name, args.capacity)
+    try:
+        if args.synthetic:
+            synthetic(ring, args.synthetic, args.interval_ms / 1000)
+        else:
+            capture(ring)
+    finally:
+        ring.close()
+
+if __name__ == '__main__':
+    main()
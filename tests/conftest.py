@@ -0,0 +1,29 @@
+# Tests run without a display, against a throwaway home directory, so nothing
+# they do touches the real ~/.quill. Both have to be set before app is imported.
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+os.environ["HOME"] = os.environ["USERPROFILE"] = tempfile.mkdtemp(prefix="quill-tests-")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PyQt5.QtWidgets import QApplication
+
+@pytest.fixture(scope="session")
+def qapp():
+    return QApplication.instance() or QApplication([])
+
+@pytest.fixture
+def wait_until(qapp):
+    # Signals from worker threads arrive through the event loop
+    def wait(predicate, timeout=5.0):
+        deadline = time.perf_counter() + timeout
+        while not predicate():
+            if time.perf_counter() > deadline:
+                raise AssertionError("timed out waiting")
+            qapp.processEvents()
+            time.sleep(0.005)
+    return wait
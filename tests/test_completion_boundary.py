@@ -0,0 +1,27 @@
+from app import completion_boundary
+
+def test_incomplete_text_has_no_boundary():
+    assert completion_boundary("and then we went") is None
+    # A full stop only counts once whitespace follows it
+    assert completion_boundary("see you at 3.30") is None
+    assert completion_boundary("the end.") is None
+
+def test_cut_after_the_first_sentence_end():
+    assert completion_boundary("we went home. Then we") == "we went home."
+    assert completion_boundary("really?! Yes") == "really?!"
+
+def test_line_break_ends_a_suggestion():
+    assert completion_boundary("first line\nsecond") == "first line"
+
+def test_clause_ends_only_in_clause_mode():
+    text = "if it rains, we stay in. Otherwise"
+    assert completion_boundary(text) == "if it rains, we stay in."
+    assert completion_boundary(text, "clause") == "if it rains,"
+    assert completion_boundary("a; b: c", "clause") == "a;"
+
+def test_boundaries_before_enough_words_are_skipped():
+    assert completion_boundary("Yes. I think so. And", min_words=2) == "Yes. I think so."
+    assert completion_boundary("Yes. No", min_words=2) is None
+
+def test_no_stop():
+    assert completion_boundary("we went home. Then", "none") is None
@@ -0,0 +1,45 @@
+from app import CompletionCache, remaining_continuation
+
+def cache_with(context, continuation):
+    cache = CompletionCache()
+    cache.put("model", "template", context, continuation)
+    return cache
+
+def test_exact_hit_is_stripped():
+    cache = cache_with("I like ", " food is great\n")
+    assert cache.get("model", "template", "I like ") == "food is great"
+    assert cache.stats()["hits"] == 1
+
+def test_prefix_hit_inside_a_word():
+    cache = cache_with("I like ", "food is great")
+    assert cache.get("model", "template", "I like fo") == "od is great"
+    assert cache.stats()["prefix_hits"] == 1
+
+def test_prefix_hit_after_a_whole_word_keeps_the_space():
+    cache = cache_with("I like", " food is great")
+    assert cache.get("model", "template", "I like food") == " is great"
+    assert cache.get("model", "template", "I like food ") == "is great"
+
+def test_text_that_leaves_the_continuation_misses():
+    cache = cache_with("I like ", "food is great")
+    assert cache.get("model", "template", "I like pie") is None
+    assert cache.get("model", "template", "I like food is great") is None
+    assert cache.stats()["misses"] == 2
+
+def test_other_models_and_templates_miss():
+    cache = cache_with("I like ", "food is great")
+    assert cache.get("other", "template", "I like fo") is None
+    assert cache.get("model", "other", "I like ") is None
+
+def test_least_recently_used_entry_is_evicted():
+    cache = CompletionCache(max_entries=2)
+    cache.put("m", "t", "one ", "1")
+    cache.put("m", "t", "two ", "2")
+    cache.get("m", "t", "one ")
+    cache.put("m", "t", "three ", "3")
+    assert cache.get("m", "t", "two ") is None
+    assert cache.get("m", "t", "one ") == "1"
+
+def test_remaining_continuation_needs_the_old_context_as_prefix():
+    assert remaining_continuation("I like ", "food", "We like fo") is None
+    assert remaining_continuation("I like ", "food", "I like ") is None
@@ -0,0 +1,36 @@
+from app import ContextBuffers, FocusWatcher
+
+def test_feed_reports_only_changes(qapp):
+    watcher = FocusWatcher(probe=lambda: None)
+    keys = []
+    watcher.focus_changed.connect(keys.append)
+    for key in ("editor", "editor", "mail", "editor"):
+        watcher.feed(key)
+    assert keys == ["editor", "mail", "editor"]
+
+def test_key_includes_the_title_only_per_window():
+    window = (123, "Editor", "notes.txt")
+    assert FocusWatcher(probe=lambda: None).key(window) == "Editor"
+    assert FocusWatcher("window", probe=lambda: None).key(window) == "Editor: notes.txt"
+
+def test_each_application_keeps_its_own_text():
+    buffers = ContextBuffers(max_chars=100)
+    buffers.switch("editor")
+    buffers.append("def main():")
+    buffers.switch("mail")
+    buffers.append("Dear Sam,")
+    assert buffers.get() == "Dear Sam,"
+    buffers.switch("editor")
+    assert buffers.get() == "def main():"
+
+def test_oldest_application_is_dropped_beyond_the_limit():
+    # The focused application takes one of the two slots
+    buffers = ContextBuffers(max_chars=100, max_contexts=2)
+    for key in ("a", "b", "c"):
+        buffers.switch(key)
+        buffers.append(key * 3)
+    buffers.switch("b")
+    assert buffers.get() == "bbb"
+    buffers.switch("a")
+    assert buffers.get() == ""
+    assert buffers.stats()["evicted"] >= 1
@@ -0,0 +1,133 @@
+import json
+import os
+import socket
+from threading import Thread
+
+import pytest
+
+from app import DEFAULT_CONFIG, Engine, EngineServer, RemoteEngine, open_engine_socket
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"),
+                                reason="the engine daemon needs Unix sockets")
+
+CONFIG = dict(DEFAULT_CONFIG, backend="stub", stub_latency=0.0, stub_tokens_per_second=1000.0,
+              result_cache_mb=0, rephrase_prefetch=0)
+
+@pytest.fixture
+def daemon(qapp, tmp_path, wait_until):
+    engine = Engine(CONFIG)
+    server = EngineServer(engine, path=str(tmp_path / "engine.sock"))
+    engine.start()
+    wait_until(lambda: engine.is_ready is not None)
+    yield engine, server
+    server.close()
+    engine.close()
+
+@pytest.fixture
+def remote(daemon):
+    _, server = daemon
+    remote = RemoteEngine(CONFIG, open_engine_socket(server.path))
+    yield remote
+    remote.close()
+
+def test_socket_is_private(daemon):
+    _, server = daemon
+    assert os.stat(server.path).st_mode & 0o077 == 0
+
+def test_hello_answers_ready(remote, wait_until):
+    ready = []
+    remote.ready.connect(ready.append)
+    remote.start()
+    wait_until(lambda: ready)
+    assert ready == [True]
+
+def test_rephrase_matches_the_engine_in_process(daemon, remote, wait_until):
+    engine, _ = daemon
+    text = "The meeting moved to Thursday. Everyone should bring their notes."
+    local, remote_results = [], []
+    task = engine.rephrase(text, "Make it shorter")
+    task.finished.connect(local.append)
+    task.start()
+    remote_task = remote.rephrase(text, "Make it shorter")
+    remote_task.finished.connect(remote_results.append)
+    remote_task.start()
+    wait_until(lambda: local and remote_results)
+    assert remote_task.error is None
+    assert remote_results == local
+    assert remote_task.settled_text() == local[0]
+
+def test_completion_arrives_for_the_submitted_text(remote, wait_until):
+    pipeline = remote.pipeline()
+    results = []
+    pipeline.suggestions_ready.connect(lambda context, suggestions: results.append(context))
+    pipeline.submit("It was a dark and stormy night and ")
+    wait_until(lambda: results)
+    # One update per finished candidate, all for the same text
+    assert set(results) == {"It was a dark and stormy night and "}
+
+def test_predictions_come_back_through_the_signal(remote, wait_until):
+    for _ in range(3):
+        remote.learn("I like green apples")
+    predicted = []
+    remote.predicted.connect(lambda text, guesses: predicted.append((text, guesses)))
+    remote.request_predictions("I like g")
+    wait_until(lambda: predicted)
+    assert predicted == [("I like g", ["reen apples"])]
+
+def test_requests_made_before_connecting_are_sent_on_connect(daemon, wait_until):
+    _, server = daemon
+    remote = RemoteEngine(CONFIG)
+    ready = []
+    remote.ready.connect(ready.append)
+    remote.start()
+    remote.connect_later(server.path, timeout=5.0)
+    wait_until(lambda: ready)
+    assert ready == [True]
+    remote.close()
+
+def test_giving_up_on_a_daemon_that_never_listens(qapp, tmp_path, wait_until):
+    remote = RemoteEngine(CONFIG)
+    ready = []
+    remote.ready.connect(ready.append)
+    remote.start()
+    remote.connect_later(str(tmp_path / "missing.sock"), timeout=0.1)
+    wait_until(lambda: ready)
+    assert ready == [False] and remote.unsent == []
+    remote.close()
+
+@pytest.fixture
+def raw(daemon):
+    _, server = daemon
+    sock = open_engine_socket(server.path)
+    lines = []
+
+    def read():
+        for line in sock.makefile("r", encoding="utf-8"):
+            lines.append(json.loads(line))
+
+    Thread(target=read, daemon=True).start()
+    yield sock, lines
+    sock.close()
+
+def test_unknown_method_is_an_error(raw, wait_until):
+    sock, lines = raw
+    sock.sendall(b'{"method": "nope", "id": 7}\n')
+    wait_until(lambda: lines)
+    assert lines[0]["id"] == 7 and lines[0]["event"] == "error"
+
+@pytest.mark.parametrize("request_line", [
+    b'{"method": ["x"]}',
+    b'[1, 2]',
+    b'{"method": "rephrase", "id": 1, "text": "hi", "instructions": 5}',
+    b'{"method": "rephrase", "id": [1], "text": "hi"}',
+    b'{"method": "predict", "text": 5}',
+    b'{"method": "record_stall", "ms": "slow"}',
+])
+def test_malformed_requests_are_errors_and_the_connection_survives(raw, wait_until, request_line):
+    sock, lines = raw
+    sock.sendall(request_line + b'\n')
+    wait_until(lambda: lines)
+    assert lines[0]["event"] == "error"
+    sock.sendall(b'{"method": "stats", "id": 2}\n')
+    wait_until(lambda: len(lines) == 2)
+    assert lines[1]["id"] == 2 and lines[1]["event"] == "stats"
@@ -0,0 +1,45 @@
+import pytest
+
+from keycapture import KeyRing
+
+@pytest.fixture
+def ring():
+    ring = KeyRing.create(capacity=8)
+    yield ring
+    ring.close()
+
+def test_keys_come_back_in_order_with_their_times(ring):
+    ring.write("a", when=1.0)
+    ring.write(name="space", when=2.0)
+    ring.write("b", when=3.0)
+    assert ring.read() == [(1.0, "a", None), (2.0, None, "space"), (3.0, "b", None)]
+    assert ring.read() == []
+
+def test_keys_quill_does_not_follow_are_not_written(ring):
+    ring.write(name="shift")
+    ring.write(None)
+    assert ring.read() == []
+
+def test_read_across_the_end_of_the_ring(ring):
+    for char in "abcdef":
+        ring.write(char)
+    assert [char for _, char, _ in ring.read()] == list("abcdef")
+    # Slots 6 and 7, then 0 to 2 again
+    for char in "ghijk":
+        ring.write(char)
+    assert [char for _, char, _ in ring.read()] == list("ghijk")
+    assert ring.lost == 0
+
+def test_keys_the_writer_lapped_are_counted_as_lost(ring):
+    for i in range(20):
+        ring.write(chr(ord("a") + i))
+    # The oldest slot left may be the one being written again
+    assert [char for _, char, _ in ring.read()] == [chr(ord("a") + i) for i in range(13, 20)]
+    assert ring.lost == 13
+
+def test_a_full_ring_drops_the_slot_the_writer_fills_next(ring):
+    for char in "abcdefgh":
+        ring.write(char)
+    # The next key goes over "a", possibly while the reader copies it
+    assert [char for _, char, _ in ring.read()] == list("bcdefgh")
+    assert ring.lost == 1
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+from app import NgramPredictor
+
+def test_predicts_the_next_words_it_has_seen():
+    predictor = NgramPredictor()
+    for _ in range(3):
+        predictor.learn("I like green apples.")
+    assert predictor.predict("I like ") == ["green apples"]
+    assert predictor.predict("I like gr") == ["een apples"]
+
+def test_sentences_with_secrets_are_not_learned():
+    predictor = NgramPredictor()
+    predictor.learn("Hunter2Secret99\nmy key is p@ss-Word1 ok. Lunch is at noon.")
+    assert predictor.predict("Hun") == []
+    assert predictor.predict("my ") == []
+    assert predictor.predict("Lunch is at ") == ["noon"]
+
+def test_save_and_load_do_nothing_without_a_path():
+    predictor = NgramPredictor()
+    predictor.learn("I like green apples")
+    predictor.save()
+    predictor.load()
+    assert predictor.predict("I like ") == ["green"]
+
+@pytest.mark.skipif(sys.platform == "win32", reason="POSIX permissions")
+def test_saved_file_is_private_and_loads_back(tmp_path):
+    path = tmp_path / "quill" / "ngrams.bin"
+    predictor = NgramPredictor(str(path))
+    predictor.learn("I like green apples")
+    predictor.save()
+    assert os.stat(path).st_mode & 0o077 == 0
+    assert os.stat(path.parent).st_mode & 0o077 == 0
+    loaded = NgramPredictor(str(path))
+    loaded.load()
+    assert loaded.predict("I like ") == ["green"]
@@ -0,0 +1,99 @@
+import time
+
+from PyQt5 import sip
+
+from app import ChunkedRephrase, RequestScheduler, split_chunks
+
+TEXT = ("The first paragraph has two sentences. It is short.\n\n"
+        "The second paragraph is a little longer than the first one. It has three "
+        "sentences in it. This is the last.\n\n"
+        "Third.")
+
+def joined(chunks):
+    return "".join(chunk + separator for chunk, separator in chunks)
+
+def test_chunks_join_back_into_the_text():
+    for max_chars in (10, 40, 80, 1000):
+        chunks = split_chunks(TEXT, max_chars)
+        assert joined(chunks) == TEXT
+        # Only a single word longer than the limit may exceed it
+        assert all(len(chunk) <= max_chars or " " not in chunk for chunk, _ in chunks)
+
+def test_paragraphs_are_split_before_sentences():
+    chunks = split_chunks(TEXT, 120)
+    assert [chunk for chunk, _ in chunks] == [
+        "The first paragraph has two sentences. It is short.",
+        "The second paragraph is a little longer than the first one. It has three "
+        "sentences in it. This is the last.\n\nThird.",
+    ]
+    assert chunks[0][1] == "\n\n"
+
+def test_long_sentences_are_split_at_sentence_ends():
+    chunks = split_chunks("One two three. Four five six. Seven.", 15)
+    assert [chunk for chunk, _ in chunks] == ["One two three.", "Four five six.", "Seven."]
+
+def test_a_word_longer_than_the_limit_stays_whole():
+    assert split_chunks("a extraordinarily b", 5) == [("a", " "), ("extraordinarily", " "), ("b", "")]
+
+# Rewrites each chunk in capitals. Longer chunks take longer, so outputs
+# arrive out of order; chunks containing "fail" fail.
+class FakeBackend:
+    model = "fake"
+
+    def __init__(self):
+        self.done = []  # chunks in the order they were written
+
+    def stream(self, prompt, **options):
+        text = prompt.split("Rephrase the following text: ", 1)[1].split("\nInstructions:")[0]
+        if "fail" in text:
+            raise RuntimeError("backend down")
+        time.sleep(len(text) / 200)
+        self.done.append(text)
+        for word in text.upper().split():
+            yield word + " "
+
+class FakeRouter:
+    def __init__(self):
+        self.backend = FakeBackend()
+
+    def route(self, task, tokens=None):
+        return self.backend
+
+def rephrase(text, max_tokens=20):
+    scheduler = RequestScheduler(workers=3)
+    task = ChunkedRephrase(FakeRouter(), scheduler, text, "shout", max_tokens=max_tokens)
+    results = []
+    task.finished.connect(results.append)
+    return task, scheduler, results
+
+def test_chunks_finishing_out_of_order_are_reassembled_in_order(wait_until):
+    task, scheduler, results = rephrase(TEXT)
+    assert len(task.chunks) == 3
+    task.start()
+    wait_until(lambda: results)
+    chunks = [chunk for chunk, _ in task.chunks]
+    assert task.router.backend.done != chunks
+    expected = "".join(" ".join(chunk.upper().split()) + separator
+                       for chunk, separator in task.chunks)
+    assert results == [expected]
+    assert task.error is None
+    scheduler.shutdown()
+
+def test_a_failed_chunk_keeps_its_original_text(wait_until):
+    text = "This part is fine.\n\nThis part will fail."
+    task, scheduler, results = rephrase(text, max_tokens=5)
+    task.start()
+    wait_until(lambda: results)
+    assert results == ["THIS PART IS FINE.\n\nThis part will fail."]
+    assert task.error == "backend down"
+    scheduler.shutdown()
+
+def test_retired_task_is_deleted_once_its_jobs_report_back(wait_until):
+    task, scheduler, results = rephrase(TEXT)
+    task.start()
+    task.retire()
+    assert not sip.isdeleted(task) and task.jobs
+    wait_until(lambda: not task.jobs)
+    wait_until(lambda: sip.isdeleted(task))
+    assert results == []
+    scheduler.shutdown()
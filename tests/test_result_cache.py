@@ -0,0 +1,83 @@
+import pytest
+
+import app
+from app import ResultCache
+
+ARGS = ("rephrase", "Some  text\n", "Make it shorter", "model", "template")
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResultCache(str(tmp_path / "results.sqlite3"))
+    yield cache
+    cache.close()
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, "time", lambda: now[0])
+    return now
+
+def test_put_then_get_with_normalized_whitespace(cache):
+    assert cache.get(*ARGS) is None
+    cache.put(*ARGS, "Shorter.")
+    assert cache.get("rephrase", "Some text", " Make  it shorter", "model", "template") == "Shorter."
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_every_part_of_the_key_counts(cache):
+    cache.put(*ARGS, "Shorter.")
+    for index, other in enumerate(("auto_write", "Other text", "Formal", "other", "other")):
+        args = list(ARGS)
+        args[index] = other
+        assert cache.get(*args) is None
+
+def test_results_survive_a_restart(tmp_path):
+    path = str(tmp_path / "results.sqlite3")
+    first = ResultCache(path)
+    first.put(*ARGS, "Shorter.")
+    first.close()
+    second = ResultCache(path)
+    assert second.get(*ARGS) == "Shorter."
+    second.close()
+
+def test_regenerate_bypasses_and_replaces(cache):
+    cache.put(*ARGS, "Shorter.")
+    assert cache.get(*ARGS, bypass=True) is None
+    cache.put(*ARGS, "Briefer.")
+    assert cache.get(*ARGS) == "Briefer."
+    assert cache.stats()["bypassed"] == 1
+
+def test_empty_results_are_not_kept(cache):
+    cache.put(*ARGS, "  ")
+    assert cache.get(*ARGS) is None
+
+def test_old_entries_expire(tmp_path, clock):
+    cache = ResultCache(str(tmp_path / "results.sqlite3"), max_age=60)
+    cache.put(*ARGS, "Shorter.")
+    clock[0] += 61
+    assert cache.get(*ARGS) is None
+    cache.close()
+
+def test_least_recently_used_are_evicted_past_max_bytes(tmp_path, clock):
+    cache = ResultCache(str(tmp_path / "results.sqlite3"), max_bytes=250)
+    for name in ("a", "b", "c"):
+        clock[0] += 1
+        cache.put("rephrase", name, "", "model", "template", name * 100)
+    # Only two fit, so "a" went first
+    assert cache.stats()["entries"] == 2
+    assert cache.get("rephrase", "a", "", "model", "template") is None
+    clock[0] += 1
+    # Reading "b" leaves "c" the least recently used
+    assert cache.get("rephrase", "b", "", "model", "template") == "b" * 100
+    clock[0] += 1
+    cache.put("rephrase", "d", "", "model", "template", "d" * 100)
+    assert cache.get("rephrase", "c", "", "model", "template") is None
+    assert cache.get("rephrase", "b", "", "model", "template") == "b" * 100
+    cache.close()
+
+def test_an_unusable_database_is_a_miss_not_an_error(tmp_path, capsys):
+    # A directory where the file should be
+    cache = ResultCache(str(tmp_path))
+    cache.put(*ARGS, "Shorter.")
+    assert cache.get(*ARGS) is None
+    assert cache.stats()["misses"] == 1
+    assert "Result cache unavailable" in capsys.readouterr().out
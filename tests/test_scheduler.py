@@ -0,0 +1,105 @@
+from threading import Event
+
+from app import (RequestScheduler, GenerationJob, PRIORITY_USER, PRIORITY_SPECULATIVE,
+                 PRIORITY_PREFETCH)
+
+# Stands in for a backend: records each prompt and holds the ones named in
+# blocked until released
+class FakeModel:
+    def __init__(self, blocked=()):
+        self.prompts = []
+        self.blocked = set(blocked)
+        self.started = Event()
+        self.release = Event()
+
+    def __call__(self, prompt, **options):
+        self.prompts.append(prompt)
+        if prompt in self.blocked:
+            self.started.set()
+            self.release.wait(5)
+        return f"{prompt} done"
+
+def submit(scheduler, model, prompt, results, **kwargs):
+    job = GenerationJob(model, prompt, **kwargs)
+    job.finished.connect(lambda text: results.append((prompt, text)))
+    return scheduler.submit(job)
+
+def test_queued_jobs_start_in_priority_order(wait_until):
+    model = FakeModel(blocked=["first"])
+    scheduler = RequestScheduler(workers=1)
+    results = []
+    submit(scheduler, model, "first", results)
+    model.started.wait(5)
+    submit(scheduler, model, "prefetch", results, priority=PRIORITY_PREFETCH)
+    submit(scheduler, model, "speculative", results, priority=PRIORITY_SPECULATIVE)
+    submit(scheduler, model, "user", results, priority=PRIORITY_USER)
+    model.release.set()
+    wait_until(lambda: len(results) == 4)
+    assert model.prompts == ["first", "user", "speculative", "prefetch"]
+    scheduler.shutdown()
+
+def test_cancelled_group_is_dropped_without_running(wait_until):
+    model = FakeModel(blocked=["first"])
+    scheduler = RequestScheduler(workers=1)
+    results = []
+    submit(scheduler, model, "first", results)
+    model.started.wait(5)
+    submit(scheduler, model, "a", results, group="old")
+    submit(scheduler, model, "b", results, group="old")
+    submit(scheduler, model, "c", results, group="new")
+    scheduler.cancel_group("old")
+    model.release.set()
+    wait_until(lambda: len(results) == 4)
+    assert model.prompts == ["first", "c"]
+    assert ("a", "") in results and ("b", "") in results
+    assert scheduler.stats() == {"queued": 0, "running": 0, "dropped": 2}
+    scheduler.shutdown()
+
+def test_user_request_preempts_speculative_work(wait_until):
+    model = FakeModel(blocked=["speculative"])
+    scheduler = RequestScheduler(workers=1)
+    results = []
+    speculative = submit(scheduler, model, "speculative", results, priority=PRIORITY_SPECULATIVE)
+    model.started.wait(5)
+    submit(scheduler, model, "user", results, priority=PRIORITY_USER)
+    assert speculative.cancelled
+    model.release.set()
+    wait_until(lambda: len(results) == 2)
+    assert model.prompts == ["speculative", "user"]
+    scheduler.shutdown()
+
+def test_promoted_job_is_not_preempted():
+    model = FakeModel(blocked=["prefetch"])
+    scheduler = RequestScheduler(workers=1)
+    prefetch = submit(scheduler, model, "prefetch", [], priority=PRIORITY_PREFETCH, group="g")
+    model.started.wait(5)
+    scheduler.promote("g", PRIORITY_USER)
+    submit(scheduler, model, "user", [], priority=PRIORITY_USER)
+    assert not prefetch.cancelled
+    model.release.set()
+    scheduler.shutdown()
+
+# Reads as cancelled from its second look on, as if cancel() landed right
+# after the scheduler took it off the queue
+class CancelledWhileDequeued(GenerationJob):
+    looks = 0
+
+    @property
+    def cancelled(self):
+        self.looks += 1
+        return self.looks > 1
+
+    @cancelled.setter
+    def cancelled(self, value):
+        pass
+
+def test_job_cancelled_while_dequeued_leaves_running(wait_until):
+    model = FakeModel()
+    scheduler = RequestScheduler(workers=1)
+    results = []
+    job = CancelledWhileDequeued(model, "racy")
+    job.finished.connect(results.append)
+    scheduler.submit(job)
+    wait_until(lambda: results)
+    wait_until(lambda: scheduler.stats()["running"] == 0)
+    scheduler.shutdown()
@@ -0,0 +1,41 @@
+import pytest
+
+from app import StubServer, StubBackend, STUB_WORDS
+
+@pytest.fixture(scope="module")
+def backend():
+    backend = StubBackend(latency=0.0, tokens_per_second=1000.0)
+    yield backend
+    backend.server.shutdown()
+
+def test_same_prompt_and_options_give_the_same_words():
+    server = StubServer(latency=0.0)
+    try:
+        words = server.complete("Once upon a time", {"temperature": 0.2})
+        assert words == server.complete("Once upon a time", {"temperature": 0.2})
+        assert words != server.complete("Once upon a time", {"temperature": 0.9})
+        assert len(words) == server.max_tokens
+        assert set(words) <= set(STUB_WORDS)
+    finally:
+        server.shutdown()
+
+def test_num_predict_and_stop_bound_the_output():
+    server = StubServer(latency=0.0)
+    try:
+        assert len(server.complete("prompt", {"num_predict": 3})) == 3
+        assert len(server.complete("prompt", {"num_predict": -1})) == server.max_tokens
+        stopped = server.complete("prompt", {"num_predict": 50, "stop": ["the"]})
+        assert "the" not in stopped and len(stopped) < 50
+    finally:
+        server.shutdown()
+
+def test_streamed_and_whole_responses_agree(backend):
+    options = {"num_predict": 6, "temperature": 0.2}
+    whole = backend("Write something", **options)
+    chunks = backend.stream("Write something", **options)
+    try:
+        streamed = "".join(chunks)
+    finally:
+        chunks.close()
+    assert streamed == whole
+    assert len(whole.split()) == 6
@@ -0,0 +1,70 @@
+from app import TextBuffer
+
+def test_typing_and_backspace_at_the_end():
+    buffer = TextBuffer(max_size=50)
+    buffer.append("Hello wrld")
+    for _ in range(4):
+        buffer.backspace()
+    buffer.append("world")
+    assert buffer.get() == "Hello world"
+    assert len(buffer) == 11
+
+def test_edits_at_a_moved_caret():
+    buffer = TextBuffer(max_size=50)
+    buffer.append("Hello world")
+    buffer.move_cursor(-5)
+    buffer.append("big ")
+    assert buffer.get() == "Hello big world"
+    # The caret stays after what was typed
+    buffer.backspace()
+    buffer.append("-")
+    assert buffer.get() == "Hello big-world"
+    buffer.delete()
+    assert buffer.get() == "Hello big-orld"
+    buffer.move_cursor(100)
+    buffer.append("!")
+    assert buffer.get() == "Hello big-orld!"
+
+def test_caret_stays_inside_the_text():
+    buffer = TextBuffer(max_size=50)
+    buffer.append("abc")
+    buffer.move_cursor(-10)
+    buffer.backspace()
+    assert buffer.get() == "abc"
+    buffer.delete()
+    assert buffer.get() == "bc"
+
+def test_oldest_text_falls_off_the_front():
+    buffer = TextBuffer(max_size=10)
+    buffer.append("one two three four")
+    assert buffer.get() == "three four"
+    assert buffer.tail(4) == "four"
+    assert buffer.last_words(1) == "four"
+    assert buffer.last_words(5) == "three four"
+
+def test_edit_after_the_ring_wrapped():
+    buffer = TextBuffer(max_size=10)
+    buffer.append("one two three")
+    buffer.move_cursor(-6)
+    buffer.append("X")
+    # " two three" was held; the insert pushes its first character out
+    assert buffer.get() == "twoX three"
+    buffer.append("Y")
+    assert buffer.get() == "woXY three"
+
+def test_context_starts_on_a_sentence_or_word():
+    buffer = TextBuffer(max_size=200)
+    buffer.append("First one. Second sentence here. Third")
+    assert buffer.context(30) == "Second sentence here. Third"
+    assert buffer.context(20) == "Third"
+    assert buffer.context(25, boundary="word") == "sentence here. Third"
+    assert buffer.context(100) == "First one. Second sentence here. Third"
+    # A line break starts a sentence too
+    buffer.append("\nnext line")
+    assert buffer.context(12) == "next line"
+
+def test_clear():
+    buffer = TextBuffer(max_size=10)
+    buffer.append("some text")
+    buffer.clear()
+    assert buffer.get() == "" and buffer.last_words(2) == ""